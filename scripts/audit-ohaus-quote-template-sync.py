@@ -1,10 +1,10 @@
 import argparse
 import os
-import re
 from pathlib import Path
 
-import openpyxl
-import requests
+from catalog_sync import DEFAULT_PAGE_SIZE, iter_catalog_rows_by_keys
+from ohaus_sources import TEMPLATE_AUDIT_COLUMNS, audit_template, norm, parse_template_rows, report_template_audit
+from supabase_rest import SupabaseRest
 
 
 SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
@@ -32,84 +32,9 @@ def load_env():
     load_env_file(root / ".env")
 
 
-def norm(s: str) -> str:
-    return re.sub(r"[^a-z0-9]+", "", str(s or "").strip().lower())
-
-
-def clean(v):
-    s = str(v or "").strip()
-    if s.lower() in {"-", "--", "n/a", "na", "none", "null"}:
-        return ""
-    return s
-
-
-def num(v):
-    s = clean(v)
-    if not s:
-        return None
-    s = re.sub(r"[^0-9,.-]", "", s)
-    if "," in s and "." in s:
-        if s.rfind(",") > s.rfind("."):
-            s = s.replace(".", "").replace(",", ".")
-        else:
-            s = s.replace(",", "")
-    elif "," in s:
-        s = s.replace(",", ".")
-    try:
-        out = float(s)
-    except Exception:
-        return None
-    return round(out, 2)
-
-
-def parse_template_rows(xlsx_path: Path):
-    wb = openpyxl.load_workbook(xlsx_path, data_only=True)
-    ws = wb[wb.sheetnames[0]]
-    headers = [clean(h) for h in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
-    rows = {}
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        data = {headers[idx]: row[idx] for idx in range(min(len(headers), len(row)))}
-        model = clean(data.get("modelo", ""))
-        if not model:
-            continue
-        key = norm(model)
-        if not key:
-            continue
-        rows[key] = {
-            "model": model,
-            "summary": clean(data.get("descripcion_comercial_corta", "")),
-            "description": clean(data.get("descripcion_comercial_larga", "")) or clean(data.get("descripcion_comercial_corta", "")),
-            "family": clean(data.get("familia", "")),
-            "image_url": clean(data.get("imagen_url", "")),
-            "datasheet_url": clean(data.get("ficha_pdf_url", "")),
-            "prices_cop": {
-                "bogota": num(data.get("precio_bogota_cop")),
-                "antioquia": num(data.get("precio_antioquia_cop")),
-                "distribuidor": num(data.get("precio_distribuidor_cop")),
-            },
-        }
-    wb.close()
-    return rows
-
-
-def request_ok(resp: requests.Response):
-    if 200 <= resp.status_code < 300:
-        return
-    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:800]}")
-
-
-def get_catalog_rows(base_url: str, service_key: str, owner_id: str, provider: str):
-    url = f"{base_url}/rest/v1/agent_product_catalog"
-    headers = {"apikey": service_key, "Authorization": f"Bearer {service_key}"}
-    params = {
-        "select": "id,name,summary,description,image_url,datasheet_url,source_payload",
-        "created_by": f"eq.{owner_id}",
-        "provider": f"eq.{provider}",
-        "limit": "5000",
-    }
-    resp = requests.get(url, headers=headers, params=params, timeout=120)
-    request_ok(resp)
-    return resp.json() if resp.text else []
+def get_catalog_rows(client: SupabaseRest, owner_id: str, provider: str, keys, page_size: int = DEFAULT_PAGE_SIZE):
+    filters = {"created_by": f"eq.{owner_id}", "provider": f"eq.{provider}"}
+    return iter_catalog_rows_by_keys(client, TEMPLATE_AUDIT_COLUMNS, filters, keys, page_size=page_size)
 
 
 def main():
@@ -119,12 +44,10 @@ def main():
     parser.add_argument("--owner-id", default=os.getenv("QUOTE_TEMPLATE_OWNER_ID") or SYSTEM_USER_ID)
     parser.add_argument("--provider", default=os.getenv("QUOTE_TEMPLATE_PROVIDER") or DEFAULT_PROVIDER)
     parser.add_argument("--max-errors", type=int, default=40)
+    parser.add_argument("--page-size", type=int, default=int(os.getenv("QUOTE_TEMPLATE_PAGE_SIZE") or DEFAULT_PAGE_SIZE))
     args = parser.parse_args()
 
-    base_url = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip().rstrip("/")
-    service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
-    if not base_url or not service_key:
-        raise RuntimeError("Missing SUPABASE_URL/NEXT_PUBLIC_SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
+    client = SupabaseRest.from_env(timeout_sec=120)
 
     xlsx_path = Path(args.xlsx)
     if not xlsx_path.is_absolute():
@@ -133,64 +56,22 @@ def main():
         raise RuntimeError(f"Template XLSX not found: {xlsx_path}")
 
     template = parse_template_rows(xlsx_path)
-    catalog_rows = get_catalog_rows(base_url, service_key, str(args.owner_id).strip(), str(args.provider).strip())
-    catalog_by_key = {norm(str(r.get("name") or "")): r for r in catalog_rows if norm(str(r.get("name") or ""))}
-
-    missing_models = []
-    mismatches = []
-
-    for key, tpl in template.items():
-        row = catalog_by_key.get(key)
-        if not row:
-            missing_models.append(tpl.get("model") or key)
-            continue
-
-        payload = row.get("source_payload") if isinstance(row.get("source_payload"), dict) else {}
-        checks = {
-            "summary": (clean(tpl.get("summary")), clean(row.get("summary"))),
-            "description": (clean(tpl.get("description")), clean(row.get("description"))),
-            "family": (clean(tpl.get("family")), clean(payload.get("family"))),
-            "image_url": (clean(tpl.get("image_url")), clean(row.get("image_url"))),
-            "datasheet_url": (clean(tpl.get("datasheet_url")), clean(row.get("datasheet_url"))),
-            "price_bogota": (tpl.get("prices_cop", {}).get("bogota"), num((payload.get("prices_cop") or {}).get("bogota"))),
-            "price_antioquia": (tpl.get("prices_cop", {}).get("antioquia"), num((payload.get("prices_cop") or {}).get("antioquia"))),
-            "price_distribuidor": (tpl.get("prices_cop", {}).get("distribuidor"), num((payload.get("prices_cop") or {}).get("distribuidor"))),
-        }
-
-        for field, (expected, got) in checks.items():
-            if expected in (None, ""):
-                continue
-            if isinstance(expected, float) or isinstance(got, float):
-                if expected is None and got is None:
-                    continue
-                if float(expected or 0) != float(got or 0):
-                    mismatches.append(f"{tpl.get('model')}: {field} expected={expected} got={got}")
-            else:
-                if norm(str(expected)) != norm(str(got)):
-                    mismatches.append(f"{tpl.get('model')}: {field} expected='{expected}' got='{got}'")
+    # Template models are looked up server-side by model_key; the rest of the catalog is never read.
+    catalog_rows = get_catalog_rows(client, str(args.owner_id).strip(), str(args.provider).strip(), template.keys(), args.page_size)
+    catalog_by_key = {}
+    catalog_count = 0
+    for r in catalog_rows:
+        catalog_count += 1
+        key = norm(str(r.get("name") or ""))
+        if key and key in template:
+            catalog_by_key[key] = r
+
+    missing_models, mismatches = audit_template(template, catalog_by_key)
 
     print(f"Template models: {len(template)}")
-    print(f"Catalog rows: {len(catalog_rows)}")
-    print(f"Missing models in DB: {len(missing_models)}")
-    print(f"Field mismatches: {len(mismatches)}")
-
-    shown = 0
-    for m in missing_models:
-        if shown >= args.max_errors:
-            break
-        print(f"MISSING: {m}")
-        shown += 1
-
-    for mm in mismatches:
-        if shown >= args.max_errors:
-            break
-        print(f"MISMATCH: {mm}")
-        shown += 1
-
-    if missing_models or mismatches:
-        raise SystemExit(1)
-
-    print("Audit OK: XLS and DB are aligned.")
+    print(f"Catalog rows fetched for template models: {catalog_count}")
+    print(client.stats_line())
+    report_template_audit(missing_models, mismatches, args.max_errors)
 
 
 if __name__ == "__main__":
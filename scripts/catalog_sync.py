@@ -0,0 +1,276 @@
+import re
+
+from schema_probe import require_columns, require_rpc
+from supabase_rest import AdaptiveExecutor, SupabaseRest, request_ok
+
+
+CATALOG_TABLE = "rest/v1/agent_product_catalog"
+MERGE_PATCH_FUNCTION = "agent_catalog_merge_patch"
+MERGE_PATCH_RPC = f"rest/v1/rpc/{MERGE_PATCH_FUNCTION}"
+DEFAULT_BATCH_SIZE = 300
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_KEY_CHUNK = 200
+
+# Columns agent_catalog_merge_patch deep-merges instead of replacing (migration 032).
+MERGE_COLUMNS = ("source_payload",)
+
+# Bumped on every update (migration 033). Writers that fetch it get a
+# version check per row; see bulk_patch_catalog().
+VERSION_COLUMN = "row_version"
+CONFLICT_RETRIES = 3
+
+# Bookkeeping that every sync bumps or overwrites (timestamps, provenance tag);
+# on their own they never make a row "changed".
+VOLATILE_KEYS = {"updated_at", "last_price_update", "price_list_synced_at", "cotizaciones_synced_at", "import_source"}
+
+_MISSING = object()
+
+
+def iter_catalog_rows(client: SupabaseRest, columns, filters: dict, page_size: int = DEFAULT_PAGE_SIZE):
+    """Yield agent_product_catalog rows matching `filters`, one page at a time.
+
+    Pages are keyset-paginated on id (id > last seen id, ordered by id), so
+    there is no row cap and no OFFSET rescans. A short page does not end the
+    scan, because PostgREST may cap pages below `page_size` (db max-rows);
+    only an empty page does.
+    """
+    columns = [c for c in columns if c != "id"]
+    require_columns(client, "agent_product_catalog", columns)
+    select = ",".join(["id", *columns])
+    page_size = max(1, int(page_size or DEFAULT_PAGE_SIZE))
+    last_id = None
+    while True:
+        params = {"select": select, **filters, "order": "id.asc", "limit": str(page_size)}
+        if last_id is not None:
+            params["id"] = f"gt.{last_id}"
+        resp = client.get(CATALOG_TABLE, params=params)
+        request_ok(resp, 800)
+        page = resp.json() if resp.text else []
+        if not page:
+            return
+        yield from page
+        last_id = page[-1]["id"]
+
+
+def catalog_model_key(name: str) -> str:
+    """Python side of the generated model_key column (migration 030)."""
+    return re.sub(r"[^A-Z0-9]", "", str(name or "").upper())
+
+
+def iter_catalog_rows_by_keys(
+    client: SupabaseRest,
+    columns,
+    filters: dict,
+    keys,
+    chunk_size: int = DEFAULT_KEY_CHUNK,
+    page_size: int = DEFAULT_PAGE_SIZE,
+):
+    """Yield only the catalog rows whose model_key is in `keys`.
+
+    Keys are sent in chunked model_key=in.(...) filters (served by the
+    created_by/provider/model_key index), each chunk paged like
+    iter_catalog_rows(). Keys are [A-Z0-9] only, so they need no quoting.
+    """
+    require_columns(client, "agent_product_catalog", ["model_key"])
+    keys = sorted({catalog_model_key(k) for k in keys} - {""})
+    chunk_size = max(1, int(chunk_size or DEFAULT_KEY_CHUNK))
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i : i + chunk_size]
+        yield from iter_catalog_rows(client, columns, {**filters, "model_key": f"in.({','.join(chunk)})"}, page_size)
+
+
+def deep_merge(base, patch):
+    """Python side of jsonb_deep_merge() (migration 032): objects merge key by
+    key, anything else in `patch` replaces `base`."""
+    if not isinstance(base, dict) or not isinstance(patch, dict):
+        return patch
+    out = dict(base)
+    for k, v in patch.items():
+        out[k] = deep_merge(out.get(k), v)
+    return out
+
+
+def expand_patch(row: dict, patch_obj: dict) -> dict:
+    """The column values `patch_obj` leaves on `row` once written, for diffing."""
+    return {k: deep_merge(row.get(k), v) if k in MERGE_COLUMNS else v for k, v in patch_obj.items()}
+
+
+def merge_patch(base: dict, patch_obj: dict) -> dict:
+    """Apply `patch_obj` on top of `base` (a row or an earlier patch) the way the write does."""
+    return {**base, **expand_patch(base, patch_obj)}
+
+
+def _post_batch(client: SupabaseRest, batch: list, select: str):
+    return client.post(MERGE_PATCH_RPC, params={"select": select}, json_body={"p_items": batch})
+
+
+def _row_label(row: dict) -> str:
+    return str(row.get("name") or row.get("id") or "")
+
+
+def _merge_item(row: dict, patch_obj: dict) -> dict:
+    item = {"id": row.get("id"), "patch": patch_obj}
+    if row.get(VERSION_COLUMN) is not None:
+        item["version"] = row[VERSION_COLUMN]
+    return item
+
+
+def _write_batch(client: SupabaseRest, batch: list, failures: list, skipped: list, returned: list = None) -> int:
+    if returned is None:
+        select = "id"
+    else:
+        select = ",".join(dict.fromkeys(["id", "name", *(k for _, patch_obj in batch for k in patch_obj)]))
+    resp = _post_batch(client, [_merge_item(row, patch_obj) for row, patch_obj in batch], select)
+    if 200 <= resp.status_code < 300:
+        rows = resp.json() if resp.text else []
+        if returned is not None:
+            returned.extend(rows)
+        # Items that did not come back were skipped by the version check.
+        applied = {r.get("id") for r in rows}
+        skipped.extend(item for item in batch if item[0].get("id") not in applied)
+        return len(rows)
+    if len(batch) == 1:
+        failures.append({"id": batch[0][0].get("id"), "model": _row_label(batch[0][0]), "error": f"HTTP {resp.status_code}: {resp.text[:300]}"})
+        return 0
+    # Bisect so a single rejected row is named without dropping its batch mates.
+    mid = len(batch) // 2
+    written = _write_batch(client, batch[:mid], failures, skipped, returned)
+    written += _write_batch(client, batch[mid:], failures, skipped, returned)
+    return written
+
+
+def _refetch_rows(client: SupabaseRest, rows) -> dict:
+    """Re-read `rows` by id with the columns they were fetched with."""
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    ids = [row.get("id") for row in rows]
+    fresh = {}
+    for i in range(0, len(ids), DEFAULT_KEY_CHUNK):
+        chunk = ids[i : i + DEFAULT_KEY_CHUNK]
+        resp = client.get(CATALOG_TABLE, params={"select": ",".join(columns), "id": f"in.({','.join(chunk)})"})
+        request_ok(resp, 800)
+        for row in resp.json() if resp.text else []:
+            fresh[row.get("id")] = row
+    return fresh
+
+
+def bulk_patch_catalog(
+    client: SupabaseRest,
+    items,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    executor: AdaptiveExecutor = None,
+    returned: list = None,
+    replan=None,
+):
+    """Write (catalog_row, patch_obj) pairs through agent_catalog_merge_patch.
+
+    Each patch carries only the columns it changes, and source_payload only
+    the keys it owns; the RPC deep-merges those into the stored document.
+    Batches run on `executor` when given (they touch disjoint ids), otherwise
+    serially. Returns (written, failures); each failure names the rejected
+    row id and model. When `returned` is a list, the written rows (id, name
+    and patched columns) are appended to it.
+
+    Rows fetched with row_version are only written if nobody changed them
+    since. Conflicting rows are re-read and `replan(fresh_row)` rebuilds
+    their patch (None or an unchanged patch drops the row), for up to
+    CONFLICT_RETRIES rounds; without `replan` a conflict is a failure.
+    """
+    pending = list(items)
+    if pending:
+        require_rpc(client, MERGE_PATCH_FUNCTION)
+    failures = []
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    written = 0
+    for attempt in range(CONFLICT_RETRIES + 1):
+        skipped = []
+        tasks = []
+        for i in range(0, len(pending), batch_size):
+            tasks.append(lambda b=pending[i : i + batch_size]: _write_batch(client, b, failures, skipped, returned))
+        if executor:
+            written += sum(executor.run(tasks))
+        else:
+            written += sum(task() for task in tasks)
+        if not skipped:
+            break
+
+        if replan is None or attempt == CONFLICT_RETRIES:
+            for row, _patch_obj in skipped:
+                failures.append({"id": row.get("id"), "model": _row_label(row), "error": "row changed concurrently (version conflict)"})
+            break
+
+        fresh = _refetch_rows(client, [row for row, _patch_obj in skipped])
+        pending = []
+        for row, _patch_obj in skipped:
+            current = fresh.get(row.get("id"))
+            if current is None:
+                failures.append({"id": row.get("id"), "model": _row_label(row), "error": "row no longer exists"})
+                continue
+            patch_obj = replan(current)
+            if patch_obj and classify_patch(current, expand_patch(current, patch_obj)) != "unchanged":
+                pending.append((current, patch_obj))
+        print(f"Write conflicts: {len(skipped)} rows changed concurrently, {len(pending)} re-planned")
+    return written, failures
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _is_empty(v) -> bool:
+    return v is None or v == "" or v == {} or v == []
+
+
+def diff_kind(expected, current):
+    """None when equal at business level, "new" when only empty values get
+    filled, "changed" otherwise. Dicts are compared key by key."""
+    if _is_empty(expected) and _is_empty(current):
+        return None
+    if isinstance(expected, dict) and isinstance(current, dict):
+        kinds = {diff_kind(expected.get(k), current.get(k)) for k in (set(expected) | set(current)) - VOLATILE_KEYS}
+        return "changed" if "changed" in kinds else ("new" if "new" in kinds else None)
+    if _is_number(expected) and _is_number(current):
+        # base_price_usd is numeric(18,2); compare everything at cent precision.
+        if round(float(expected), 2) == round(float(current), 2):
+            return None
+    elif isinstance(expected, list) and isinstance(current, list):
+        if len(expected) == len(current) and all(diff_kind(a, b) is None for a, b in zip(expected, current)):
+            return None
+    elif expected == current:
+        return None
+    return "new" if _is_empty(current) else "changed"
+
+
+def classify_patch(row: dict, patch_obj: dict) -> str:
+    """Return "unchanged", "new" or "changed" for a planned patch vs the fetched row.
+
+    "new" means the patch only fills fields that are empty on the current row.
+    Columns missing from the fetched row count as changed so an incomplete
+    select never hides a write. The patch is compared as-is; pass
+    expand_patch(row, patch_obj) for patches written by bulk_patch_catalog.
+    """
+    kinds = set()
+    for k, v in patch_obj.items():
+        if k in VOLATILE_KEYS:
+            continue
+        current = row.get(k, _MISSING)
+        kinds.add("changed" if current is _MISSING else diff_kind(v, current))
+    if "changed" in kinds:
+        return "changed"
+    return "new" if "new" in kinds else "unchanged"
+
+
+def new_diff_counts() -> dict:
+    return {"changed": 0, "unchanged": 0, "new": 0}
+
+
+def diff_line(counts: dict) -> str:
+    return f"Diff vs catalog: changed {counts['changed']}, new {counts['new']}, unchanged (skipped) {counts['unchanged']}"
+
+
+def report_failures(failures, limit: int = 20):
+    if not failures:
+        return
+    print(f"Rejected rows: {len(failures)}")
+    for f in failures[:limit]:
+        print(f"REJECTED: id={f.get('id')} model={f.get('model')} {f.get('error')}")
+    raise SystemExit(1)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+
+STATE_FORMAT = 2
+DEFAULT_STATE = ".cache/crm/contacts-state.sqlite3"
+# Provenance only: a row moving down the sheet or a renamed export is not a
+# change worth re-pushing.
+HASH_IGNORED_METADATA = ("row_number", "source_file")
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+def contact_hash(contact: dict) -> str:
+    meta = {k: v for k, v in (contact.get("metadata") or {}).items() if k not in HASH_IGNORED_METADATA}
+    body = json.dumps({**contact, "metadata": meta}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ContactState:
+    """contact_key -> content hash of the contacts the last successful import
+    pushed, kept in a sqlite3 file.
+
+    The state is scoped to the Supabase project, owner and tenant it was
+    written for; any other target starts empty. A run records every contact
+    it sees with record() into a temporary table, and save() replaces the
+    stored set with it in one transaction, so contacts that left the exports
+    drop out of the state. Neither set is held in memory, which keeps
+    multi-million-contact runs within the CRM_IMPORT_MEMORY_MB budget.
+    """
+
+    def __init__(self, path: Path, target: str, created_by: str, tenant_id: str, cache_mb: int = 16):
+        self.path = Path(path)
+        self.header = {
+            "format": STATE_FORMAT,
+            "target": target,
+            "created_by": created_by,
+            "tenant_id": tenant_id,
+        }
+        if self.path.exists() and self.path.stat().st_size and self._magic() != SQLITE_MAGIC:
+            raise RuntimeError(f"{self.path} is not a sqlite3 contact state (older JSON state?); delete it or pass another --state")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute(f"pragma cache_size = {-max(1, int(cache_mb)) * 1024}")
+        self.db.execute("pragma temp_store = file")
+        self.db.execute("create temp table current (contact_key text primary key, hash text not null) without rowid")
+        self.use_previous = self._stored_header() == {k: str(v) for k, v in self.header.items()}
+
+    def _magic(self) -> bytes:
+        with open(self.path, "rb") as fh:
+            return fh.read(len(SQLITE_MAGIC))
+
+    def _stored_header(self) -> dict:
+        tables = {name for (name,) in self.db.execute("select name from sqlite_master where type = 'table'")}
+        if not {"header", "contacts"} <= tables:
+            return {}
+        return dict(self.db.execute("select key, value from header"))
+
+    def _previous(self, key: str):
+        if not self.use_previous:
+            return None
+        row = self.db.execute("select hash from main.contacts where contact_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def reset(self):
+        """Push every contact this run (--full)."""
+        self.use_previous = False
+
+    def record(self, contact: dict) -> str:
+        """Remember the contact's hash; return "new", "changed" or "unchanged"."""
+        key = contact["contact_key"]
+        digest = contact_hash(contact)
+        self.db.execute("insert or replace into temp.current (contact_key, hash) values (?, ?)", (key, digest))
+        prev = self._previous(key)
+        if prev is None:
+            return "new"
+        return "unchanged" if prev == digest else "changed"
+
+    def needs_push(self, contact: dict) -> bool:
+        key = contact["contact_key"]
+        row = self.db.execute("select hash from temp.current where contact_key = ?", (key,)).fetchone()
+        return self._previous(key) != (row[0] if row else None)
+
+    def save(self):
+        with self.db:
+            self.db.execute("create table if not exists header (key text primary key, value text not null)")
+            self.db.execute("create table if not exists contacts (contact_key text primary key, hash text not null) without rowid")
+            self.db.execute("delete from header")
+            self.db.executemany("insert into header (key, value) values (?, ?)", [(k, str(v)) for k, v in self.header.items()])
+            self.db.execute("delete from main.contacts")
+            self.db.execute("insert into main.contacts (contact_key, hash) select contact_key, hash from temp.current")
+        self.use_previous = True
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,128 @@
+import copy
+import hashlib
+import json
+from pathlib import Path
+
+
+MANIFEST_FORMAT = 2
+DEFAULT_MANIFEST_DIR = ".cache/ohaus"
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileManifest:
+    """Persisted parse cache for a folder of source files.
+
+    Entries are keyed by path relative to the folder and fingerprinted by
+    size, mtime and sha256. size+mtime is the fast path; when either moved the
+    content hash decides, so a touched-but-identical file is still a hit.
+    Several tools may share one manifest: each passes its own `consumer`, and
+    `pushed[consumer]` records the content that tool last wrote to the DB, so a
+    file stays dirty for a tool until its own successful --apply. Changing
+    `namespace`, `parser_version` or the folder discards the whole manifest.
+    """
+
+    def __init__(self, path: Path, folder: Path, namespace: str, parser_version: int = 1, consumer: str = "default"):
+        self.path = Path(path)
+        self.folder = Path(folder)
+        self.consumer = consumer
+        self.header = {
+            "format": MANIFEST_FORMAT,
+            "namespace": namespace,
+            "parser_version": parser_version,
+            "folder": str(self.folder.resolve()),
+        }
+        self.entries = {}
+        self.force = False
+        self.hits = 0
+        self.misses = 0
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = {}
+            if all(data.get(k) == v for k, v in self.header.items()):
+                self.entries = data.get("entries") or {}
+
+    def reset(self):
+        """Treat every file as new/modified for this run (--full); other consumers' push markers are kept."""
+        self.force = True
+
+    def for_consumer(self, consumer: str):
+        """Same entries seen as another consumer; saving either view writes both."""
+        view = copy.copy(self)
+        view.consumer = consumer
+        return view
+
+    def key(self, file_path: Path) -> str:
+        return Path(file_path).relative_to(self.folder).as_posix()
+
+    def lookup(self, file_path: Path):
+        """Return the cached result when the file is unchanged, else None."""
+        entry = None if self.force else self.entries.get(self.key(file_path))
+        st = Path(file_path).stat()
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            self.hits += 1
+            return entry.get("result")
+        if entry and entry.get("size") == st.st_size and entry.get("sha256") == file_sha256(file_path):
+            entry["mtime_ns"] = st.st_mtime_ns
+            self.hits += 1
+            return entry.get("result")
+        self.misses += 1
+        return None
+
+    def store(self, file_path: Path, result):
+        k = self.key(file_path)
+        st = Path(file_path).stat()
+        prev = self.entries.get(k) or {}
+        self.entries[k] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": file_sha256(file_path),
+            "pushed": prev.get("pushed") or {},
+            "result": result,
+        }
+
+    def is_dirty(self, file_path: Path) -> bool:
+        entry = self.entries.get(self.key(file_path))
+        if self.force or not entry:
+            return True
+        return (entry.get("pushed") or {}).get(self.consumer) != entry.get("sha256")
+
+    def mark_pushed(self, file_paths=None):
+        keys = self.entries.keys() if file_paths is None else [self.key(p) for p in file_paths]
+        for k in keys:
+            entry = self.entries.get(k)
+            if entry:
+                entry.setdefault("pushed", {})[self.consumer] = entry.get("sha256")
+
+    def prune(self, file_paths, suffixes=None):
+        """Drop entries for files no longer in the folder; return their results.
+
+        With `suffixes`, only entries of those file types are considered, so a
+        tool that globs *.xlsx leaves another tool's *.pdf entries alone.
+        """
+        live = {self.key(p) for p in file_paths}
+        removed = {
+            k: e.get("result")
+            for k, e in self.entries.items()
+            if k not in live and (not suffixes or k.lower().endswith(tuple(suffixes)))
+        }
+        for k in removed:
+            del self.entries[k]
+        return removed
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({**self.header, "entries": self.entries}, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    def stats_line(self) -> str:
+        return f"Manifest: {self.hits} unchanged (cached), {self.misses} new/modified (parsed)"
@@ -0,0 +1,92 @@
+import threading
+from datetime import date
+
+from supabase_rest import SupabaseRest, request_ok
+
+
+FX_RATES_TABLE = "rest/v1/agent_fx_rates"
+RECOMPUTE_USD_RPC = "rest/v1/rpc/agent_catalog_recompute_usd"
+
+# Same sanity bounds the webhook applies to a fetched TRM (application/trm.ts).
+MIN_TRM = 1000
+MAX_TRM = 10000
+# What the syncs used before agent_fx_rates; only a logged fallback now.
+DEFAULT_TRM = 4200.0
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def is_likely_trm(rate) -> bool:
+    try:
+        return MIN_TRM <= float(rate) <= MAX_TRM
+    except (TypeError, ValueError):
+        return False
+
+
+def latest_usd_cop_rate(client: SupabaseRest, owner_id: str, tenant_id: str = None, on_date: date = None) -> dict:
+    """Most recent USD->COP row in agent_fx_rates on or before `on_date` (default
+    today), or None when there is no row with a plausible rate.
+
+    Results are cached per base URL, owner, tenant and date, so the pipeline
+    and its conflict re-plans resolve the rate with a single request.
+    """
+    day = (on_date or date.today()).isoformat()
+    cache_key = (client.base_url, owner_id, tenant_id, day)
+    with _cache_lock:
+        if cache_key in _cache:
+            return _cache[cache_key]
+
+    params = {
+        "select": "rate,rate_date,source",
+        "created_by": f"eq.{owner_id}",
+        "from_currency": "eq.USD",
+        "to_currency": "eq.COP",
+        "rate_date": f"lte.{day}",
+        "order": "rate_date.desc",
+        "limit": "1",
+    }
+    if tenant_id:
+        params["tenant_id"] = f"eq.{tenant_id}"
+    resp = client.get(FX_RATES_TABLE, params=params)
+    request_ok(resp)
+    rows = resp.json() if resp.text else []
+    row = rows[0] if rows else None
+    result = None
+    if row and is_likely_trm(row.get("rate")):
+        result = {"rate": float(row["rate"]), "rate_date": row.get("rate_date"), "source": row.get("source")}
+    with _cache_lock:
+        _cache[cache_key] = result
+    return result
+
+
+def resolve_trm(client: SupabaseRest, owner_id: str, explicit=None, tenant_id: str = None, fallback=DEFAULT_TRM) -> float:
+    """An explicit --trm wins; otherwise the latest agent_fx_rates rate. Prints which one is used.
+
+    Without a usable agent_fx_rates rate the sync falls back to `fallback`
+    with a warning, so dry runs and runs that write no USD price still work;
+    pass fallback=None where a guessed rate must not be written.
+    """
+    if explicit:
+        trm = float(explicit)
+        if not is_likely_trm(trm):
+            raise RuntimeError(f"TRM out of range ({MIN_TRM}-{MAX_TRM}): {trm}")
+        print(f"TRM: {trm} (explicit)")
+        return trm
+    fx = latest_usd_cop_rate(client, owner_id, tenant_id)
+    if fx is None:
+        if fallback is None:
+            raise RuntimeError(f"No usable USD/COP rate in agent_fx_rates for owner {owner_id}; pass --trm")
+        print(f"WARNING: no usable USD/COP rate in agent_fx_rates for owner {owner_id}; using fallback TRM {fallback}")
+        return float(fallback)
+    print(f"TRM: {fx['rate']} (agent_fx_rates {fx['rate_date']}, {fx.get('source') or 'unknown source'})")
+    return fx["rate"]
+
+
+def recompute_catalog_usd(client: SupabaseRest, owner_id: str, provider: str, trm: float) -> dict:
+    """Re-derive base_price_usd from source_payload.prices_cop for the whole
+    provider in one set-based statement (migration 034)."""
+    payload = {"p_created_by": owner_id, "p_provider": provider, "p_trm": trm}
+    resp = client.post(RECOMPUTE_USD_RPC, json_body=payload, timeout=300)
+    request_ok(resp, 400)
+    return resp.json() if resp.text else {}
@@ -1,16 +1,49 @@
+import argparse
+import itertools
 import json
 import os
 import re
 from pathlib import Path
 
-import openpyxl
-import requests
+from contact_state import DEFAULT_STATE, ContactState
+from schema_probe import initial_contact_status
+from sheet_columns import absent_fields, cell, header_names, iter_sheet_rows, resolve_columns
+from spill_clusters import SpilledClusters
+from supabase_rest import AdaptiveExecutor, SupabaseRest, request_ok
 
 
 SYSTEM_TENANT_ID = "0811c118-5a2f-40cb-907e-8979e0984096"
 SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
 DEFAULT_CLIENT_XLSX = "app/api/agents/channels/evolution/webhook-v2/Contactos Nuevo CRM Cliente.xlsx"
 DEFAULT_DISTRIBUTOR_XLSX = "app/api/agents/channels/evolution/webhook-v2/Contactos Nuevo CRM distribuidor.xlsx"
+# CRM_IMPORT_CLIENT_XLSX / CRM_IMPORT_DISTRIBUTOR_XLSX may also point at a
+# .csv/.tsv export (or .csv.gz/.tsv.gz), which skips openpyxl entirely.
+
+# Contact field -> header spelling(s), matched ignoring case, accents and
+# spacing. Exports have shipped the address header mis-decoded, hence the
+# extra spellings.
+CRM_COLUMNS = {
+    "name": "Contactos Nombre y apellido",
+    "phone": "Contactos Celular",
+    "email": "Contactos Correo",
+    "company": "Contactos Empresa (si aplica)",
+    "nit": "Empresas NIT",
+    "department": "Departamento",
+    "address": ("Empresas Dirección", "Empresas Direcci\ufffdn", "Empresas DirecciÃ³n"),
+    "activity": "Actividad del cliente",
+    "assigned_to": "Contactos Asignado a",
+}
+# The columns contact_key is built from.
+CRM_REQUIRED = ("name", "phone", "email", "company", "nit")
+# contact_keys per stored-row lookup (keeps the in.(...) URL short).
+STORED_KEY_CHUNK = 150
+# Rough in-memory size of one parsed contact (dict + metadata), for
+# CRM_IMPORT_MEMORY_MB.
+APPROX_ROW_BYTES = 2048
+# Identifiers that link rows into one contact even when their contact_key
+# differs (CRM_IMPORT_LINK_KEYS overrides, e.g. "phone,email" when NIT is a
+# company-wide number shared by several people).
+LINK_KEYS = ("phone", "nit", "email")
 
 
 def load_env_file(path: Path):
@@ -69,54 +102,58 @@ def city_tier_from_department(dept: str) -> str:
     return "bogota"
 
 
-def parse_rows(xlsx_path: Path, customer_type: str, tenant_id: str, created_by: str):
-    wb = openpyxl.load_workbook(xlsx_path, data_only=True)
-    ws = wb[wb.sheetnames[0]]
-
-    headers = [clean_value(h) for h in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
-    rows = []
-    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        data = {headers[idx]: clean_value(row[idx]) for idx in range(min(len(headers), len(row)))}
-
-        name = clean_value(data.get("Contactos Nombre y apellido", ""))
-        phone = normalize_phone(clean_value(data.get("Contactos Celular ", "")))
-        email = clean_value(data.get("Contactos Correo", "")).lower()
-        company = clean_value(data.get("Contactos Empresa (si aplica)", ""))
-        nit = re.sub(r"[^0-9\-]", "", clean_value(data.get("Empresas NIT", "")))
-        department = clean_value(data.get("Departamento", ""))
-        address = clean_value(data.get("Empresas Dirección", "")) or clean_value(data.get("Empresas Direccion", "")) or clean_value(data.get("Empresas Direcci�n", ""))
-        activity = clean_value(data.get("Actividad del cliente", ""))
-        assigned_to = clean_value(data.get("Contactos Asignado a", ""))
-
-        contact_key = ""
-        if phone:
-            contact_key = phone
-        elif nit:
-            contact_key = f"nit:{nit}"
-        elif email:
-            contact_key = f"email:{email}"
-        elif name and company:
-            contact_key = f"name:{normalize_key(name)}:{normalize_key(company)}"
-        else:
-            continue
-
-        is_distributor = customer_type == "distributor"
-        price_tier = "distribuidor" if is_distributor else city_tier_from_department(department)
-        metadata = {
-            "customer_type": customer_type,
-            "price_tier": price_tier,
-            "nit": nit,
-            "billing_city": department,
-            "address": address,
-            "activity": activity,
-            "assigned_to": assigned_to,
-            "source": "xlsx_crm_contacts_import",
-            "source_file": xlsx_path.name,
-            "row_number": i,
-        }
+def fallback_contact_key(name: str, company: str, nit: str, email: str) -> str:
+    """contact_key of a row without a phone ("" when nothing identifies it)."""
+    if nit:
+        return f"nit:{nit}"
+    if email:
+        return f"email:{email}"
+    if name and company:
+        return f"name:{normalize_key(name)}:{normalize_key(company)}"
+    return ""
+
+
+def iter_rows(export_path: Path, customer_type: str, tenant_id: str, created_by: str):
+    """Yield contact rows from a CRM export (XLSX, or CSV/TSV optionally
+    gzipped), streamed so memory stays flat as exports grow."""
+    sheet_rows = iter_sheet_rows(export_path)
+    try:
+        cols = resolve_columns(next(sheet_rows, ()), CRM_COLUMNS, required=CRM_REQUIRED, source=export_path.name)
+        absent = absent_fields(cols)
+        if absent:
+            print(f"{export_path.name}: columns not found (read as empty): {', '.join(header_names(CRM_COLUMNS, absent))}")
+
+        for i, row in enumerate(sheet_rows, start=2):
+            name = clean_value(cell(row, cols["name"]))
+            phone = normalize_phone(clean_value(cell(row, cols["phone"])))
+            email = clean_value(cell(row, cols["email"])).lower()
+            company = clean_value(cell(row, cols["company"]))
+            nit = re.sub(r"[^0-9\-]", "", clean_value(cell(row, cols["nit"])))
+            department = clean_value(cell(row, cols["department"]))
+            address = clean_value(cell(row, cols["address"]))
+            activity = clean_value(cell(row, cols["activity"]))
+            assigned_to = clean_value(cell(row, cols["assigned_to"]))
+
+            contact_key = phone or fallback_contact_key(name, company, nit, email)
+            if not contact_key:
+                continue
+
+            is_distributor = customer_type == "distributor"
+            price_tier = "distribuidor" if is_distributor else city_tier_from_department(department)
+            metadata = {
+                "customer_type": customer_type,
+                "price_tier": price_tier,
+                "nit": nit,
+                "billing_city": department,
+                "address": address,
+                "activity": activity,
+                "assigned_to": assigned_to,
+                "source": "xlsx_crm_contacts_import",
+                "source_file": export_path.name,
+                "row_number": i,
+            }
 
-        rows.append(
-            {
+            yield {
                 "tenant_id": tenant_id,
                 "created_by": created_by,
                 "contact_key": contact_key,
@@ -127,58 +164,290 @@ def parse_rows(xlsx_path: Path, customer_type: str, tenant_id: str, created_by:
                 "status": "analysis",
                 "metadata": metadata,
             }
-        )
-
-    return rows
-
-
-def request_ok(resp: requests.Response):
-    if 200 <= resp.status_code < 300:
-        return
-    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:600]}")
-
-
-def is_status_constraint_error(resp: requests.Response) -> bool:
-    if resp is None:
+    finally:
+        sheet_rows.close()
+
+
+def chunked(rows, size):
+    """Batches of `size` from any iterable, pulled lazily."""
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def channel_for_phone(phone: str) -> str:
+    """Colombian mobiles (57 + 3xx xxx xxxx) are reachable on WhatsApp."""
+    return "whatsapp" if len(phone) == 12 and phone.startswith("573") else "phone"
+
+
+def contact_channels(contact: dict, contact_id: str) -> list:
+    """agent_crm_contact_channels rows for one contact: its own phone and
+    email are primary, the ones merged in from linked rows are not."""
+    meta = contact.get("metadata") or {}
+    entries = []
+    for value, is_primary in [(contact.get("phone"), True)] + [(p, False) for p in meta.get("other_phones") or []]:
+        if value:
+            entries.append((channel_for_phone(value), value, is_primary))
+    for value, is_primary in [(contact.get("email"), True)] + [(e, False) for e in meta.get("other_emails") or []]:
+        if value:
+            entries.append(("email", value, is_primary))
+    return [
+        {
+            "tenant_id": contact.get("tenant_id"),
+            "created_by": contact.get("created_by"),
+            "contact_id": contact_id,
+            "channel": channel,
+            "channel_key": key,
+            "is_primary": is_primary,
+            "metadata": {"source": "xlsx_crm_contacts_import"},
+        }
+        for channel, key, is_primary in entries
+    ]
+
+
+def stored_key_candidates(contact: dict, link_keys=LINK_KEYS) -> list:
+    """contact_keys an earlier import may have stored this contact under: its
+    own, the ones merged into it and the keys its linking identifiers give.
+
+    Each of them is an identity key of a row in this contact's cluster, so no
+    other contact of the same import can match the same stored row. Keys
+    outside link_keys (name:, or a NIT shared by several people) are not
+    tried: several contacts may carry them, and which one would get the row
+    is not decidable batch by batch.
+    """
+    meta = contact.get("metadata") or {}
+    keys = [contact["contact_key"], *(meta.get("merged_keys") or [])]
+    if "phone" in link_keys:
+        keys += [p for p in [contact.get("phone"), *(meta.get("other_phones") or [])] if p]
+    if "nit" in link_keys and meta.get("nit"):
+        keys.append(f"nit:{meta['nit']}")
+    if "email" in link_keys:
+        keys += [f"email:{e}" for e in [contact.get("email"), *(meta.get("other_emails") or [])] if e]
+    return list(dict.fromkeys(keys))
+
+
+def quote_in_value(value: str) -> str:
+    """A PostgREST in.(...) list item, quoted so commas, dots and parens survive."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def fetch_stored_contacts(client: SupabaseRest, owner_id: str, keys) -> dict:
+    """{contact_key: {id, contact_key, metadata}} for the keys already stored."""
+    keys = sorted(set(keys))
+    stored = {}
+    for i in range(0, len(keys), STORED_KEY_CHUNK):
+        chunk = keys[i : i + STORED_KEY_CHUNK]
+        params = {
+            "select": "id,contact_key,metadata",
+            "created_by": f"eq.{owner_id}",
+            "contact_key": f"in.({','.join(quote_in_value(k) for k in chunk)})",
+        }
+        resp = client.get("rest/v1/agent_crm_contacts", params=params)
+        request_ok(resp, 600)
+        for row in resp.json() if resp.text else []:
+            stored[row["contact_key"]] = row
+    return stored
+
+
+def resolve_stored_key(contact: dict, stored: dict, link_keys=LINK_KEYS):
+    """Keep the contact on a row that is already stored instead of inserting a
+    new one under its canonical key. Returns (contact, retired): the contact
+    keyed on the stored row it updates, and (row, kept id) for the other
+    stored rows of the same identity, which are duplicates to retire."""
+    matches = [stored[k] for k in stored_key_candidates(contact, link_keys) if k in stored]
+    if not matches:
+        return contact, []
+    kept = min(
+        matches,
+        key=lambda r: (
+            bool((r.get("metadata") or {}).get("archived")),
+            r["contact_key"] != contact["contact_key"],
+            key_rank(r["contact_key"]),
+            r["contact_key"],
+        ),
+    )
+    if kept["contact_key"] != contact["contact_key"]:
+        meta = contact.get("metadata") or {}
+        merged = [k for k in [contact["contact_key"], *(meta.get("merged_keys") or [])] if k != kept["contact_key"]]
+        contact = {**contact, "contact_key": kept["contact_key"], "metadata": {**meta, "merged_keys": merged}}
+    return contact, [(r, kept["id"]) for r in matches if r is not kept]
+
+
+def plan_stored_keys(batch: list, stored: dict, link_keys=LINK_KEYS):
+    """resolve_stored_key for a whole batch, before anything is written.
+    `stored` is {owner_id: {contact_key: row}}. Returns (contacts, retire).
+
+    Every stored row must end up with exactly one contact, either as the row
+    it updates or as a duplicate it archives. stored_key_candidates
+    guarantees that for deduped contacts; anything else fails here rather
+    than archiving a row another contact keeps.
+    """
+    contacts = []
+    retire = {}
+    owner_of = {}
+    for contact in batch:
+        owner_id = contact["created_by"]
+        contact, dupes = resolve_stored_key(contact, stored[owner_id], link_keys)
+        for key in [contact["contact_key"], *(row["contact_key"] for row, _ in dupes)]:
+            other = owner_of.setdefault((owner_id, key), contact)
+            if other is not contact:
+                raise RuntimeError(
+                    f"Contacts {other.get('name')!r} and {contact.get('name')!r} both resolve to stored contact_key {key!r}; "
+                    "dedupe the batch before upserting"
+                )
+        for row, kept_id in dupes:
+            retire[row["id"]] = (row, kept_id)
+        contacts.append(contact)
+    return contacts, list(retire.values())
+
+
+def retire_contact(client: SupabaseRest, row: dict, merged_into: str) -> bool:
+    """Archive a duplicate row (the CRM hides metadata.archived contacts) and
+    point it at the row that carries the identity now."""
+    meta = row.get("metadata") or {}
+    if meta.get("archived") and meta.get("merged_into") == merged_into:
         return False
-    msg = (resp.text or "").lower()
-    return resp.status_code == 400 and "status_check" in msg and "agent_crm_contacts" in msg
-
-
-def chunked(arr, size):
-    for i in range(0, len(arr), size):
-        yield arr[i : i + size]
-
-
-def upsert_contacts(base_url: str, service_key: str, rows):
-    url = f"{base_url}/rest/v1/agent_crm_contacts"
-    headers = {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal,resolution=merge-duplicates",
-    }
-    params = {"on_conflict": "created_by,contact_key"}
-
-    total = 0
-    for batch in chunked(rows, 300):
-        resp = requests.post(url, headers=headers, params=params, data=json.dumps(batch, ensure_ascii=False).encode("utf-8"), timeout=120)
-        if is_status_constraint_error(resp):
-            legacy_batch = [{**r, "status": "draft"} for r in batch]
-            resp = requests.post(url, headers=headers, params=params, data=json.dumps(legacy_batch, ensure_ascii=False).encode("utf-8"), timeout=120)
-        request_ok(resp)
-        total += len(batch)
-    return total
-
-
-def dedupe_contacts(rows):
-    merged = {}
-    for row in rows:
-        key = f"{row.get('created_by','')}::{row.get('contact_key','')}"
-        if key not in merged:
-            merged[key] = row
-            continue
-        cur = merged[key]
+    resp = client.patch(
+        "rest/v1/agent_crm_contacts",
+        params={"id": f"eq.{row['id']}"},
+        json_body={"metadata": {**meta, "archived": True, "merged_into": merged_into, "archived_by": "xlsx_crm_contacts_import"}},
+        headers={"Prefer": "return=minimal"},
+    )
+    request_ok(resp, 600)
+    return True
+
+
+def upsert_contacts(client: SupabaseRest, rows, executor: AdaptiveExecutor = None, link_keys=LINK_KEYS):
+    """Upsert contacts in batches of 300; each batch gets its ids back and
+    upserts its channel rows right away. Returns (contacts, channels, retired).
+
+    Each batch first looks up the rows already stored under any key of its
+    contacts. A contact keeps the stored key, so it updates that row instead
+    of inserting a duplicate under a new canonical key, and the other stored
+    rows of the same identity are archived (see resolve_stored_key). Batches
+    only ever match stored rows of their own clusters (see
+    stored_key_candidates), so they can run in parallel.
+
+    Rows are parsed as "analysis"; databases without migration 028 get the
+    legacy "draft" instead, decided once by the schema probe.
+    """
+    status = initial_contact_status(client)
+    headers = {"Prefer": "return=representation,resolution=merge-duplicates"}
+    params = {"on_conflict": "created_by,contact_key", "select": "id,contact_key"}
+    channel_headers = {"Prefer": "return=minimal,resolution=merge-duplicates"}
+    channel_params = {"on_conflict": "created_by,channel,channel_key"}
+
+    def write(batch):
+        candidates = {}
+        for contact in batch:
+            candidates.setdefault(contact["created_by"], []).extend(stored_key_candidates(contact, link_keys))
+        stored = {owner_id: fetch_stored_contacts(client, owner_id, keys) for owner_id, keys in candidates.items()}
+
+        batch, retire = plan_stored_keys(batch, stored, link_keys)
+
+        if status != "analysis":
+            batch = [{**r, "status": status} if r.get("status") == "analysis" else r for r in batch]
+        resp = client.post("rest/v1/agent_crm_contacts", params=params, json_body=batch, headers=headers)
+        request_ok(resp, 600)
+        retired = sum(1 for row, kept_id in retire if retire_contact(client, row, kept_id))
+
+        ids = {r["contact_key"]: r["id"] for r in (resp.json() if resp.text else [])}
+        channels = {}
+        for contact in batch:
+            contact_id = ids.get(contact["contact_key"])
+            if not contact_id:
+                continue
+            for ch in contact_channels(contact, contact_id):
+                # One statement cannot upsert the same key twice; first contact wins.
+                channels.setdefault((ch["channel"], ch["channel_key"]), ch)
+        if channels:
+            resp = client.post(
+                "rest/v1/agent_crm_contact_channels",
+                params=channel_params,
+                json_body=list(channels.values()),
+                headers=channel_headers,
+            )
+            request_ok(resp, 600)
+        return len(batch), len(channels), retired
+
+    # Lazy: with a spilled dedupe only the in-flight batches are in memory.
+    tasks = (lambda b=batch: write(b) for batch in chunked(rows, 300))
+    results = executor.run(tasks) if executor else [task() for task in tasks]
+    return sum(r[0] for r in results), sum(r[1] for r in results), sum(r[2] for r in results)
+
+
+def identity_keys(row, link_keys=LINK_KEYS) -> list:
+    """Identifiers that tie a row to other rows: its own contact_key plus every
+    strong identifier it carries among `link_keys` (phone, nit, email)."""
+    meta = row.get("metadata") or {}
+    keys = [row.get("contact_key")]
+    if "phone" in link_keys and row.get("phone"):
+        keys.append(row["phone"])
+    if "nit" in link_keys and meta.get("nit"):
+        keys.append(f"nit:{meta['nit']}")
+    if "email" in link_keys and row.get("email"):
+        keys.append(f"email:{row['email']}")
+    owner = row.get("created_by", "")
+    return [f"{owner}::{k}" for k in dict.fromkeys(keys) if k]
+
+
+def key_rank(contact_key: str) -> int:
+    """Priority of a contact_key kind, same order iter_rows picks them in."""
+    for rank, prefix in enumerate(("nit:", "email:", "name:"), start=1):
+        if contact_key.startswith(prefix):
+            return rank
+    return 0
+
+
+def cluster_contacts(rows, link_keys=LINK_KEYS) -> list:
+    """Group rows that share any identifier, transitively, in one pass.
+
+    Union-find over row indexes (union by size, path halving); each
+    identifier remembers the first row that carried it. Clusters come back
+    in order of their first row, and rows within a cluster in input order.
+    """
+    rows_seen = []
+    parent = []
+    size = []
+    first_row = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, row in enumerate(rows):
+        rows_seen.append(row)
+        parent.append(i)
+        size.append(1)
+        for key in identity_keys(row, link_keys):
+            j = first_row.setdefault(key, i)
+            if j == i:
+                continue
+            a, b = find(i), find(j)
+            if a != b:
+                if size[a] < size[b]:
+                    a, b = b, a
+                parent[b] = a
+                size[a] += size[b]
+
+    clusters = {}
+    for i, row in enumerate(rows_seen):
+        clusters.setdefault(find(i), []).append(row)
+    return list(clusters.values())
+
+
+def merge_cluster(rows) -> dict:
+    """Fold a cluster into its first row: empty fields are filled from later
+    rows, distributor wins over client, and contact_key becomes the cluster's
+    strongest key (phone, then nit:, email:, name:; first seen on ties). The
+    other keys are kept in metadata.merged_keys."""
+    cur = rows[0]
+    for row in rows[1:]:
         for fld in ["name", "email", "phone", "company"]:
             if not cur.get(fld) and row.get(fld):
                 cur[fld] = row.get(fld)
@@ -192,18 +461,78 @@ def dedupe_contacts(rows):
             if v and not cur_meta.get(k):
                 cur_meta[k] = v
         cur["metadata"] = cur_meta
-        merged[key] = cur
-    return list(merged.values())
+
+    keys = list(dict.fromkeys(r["contact_key"] for r in rows))
+    if len(keys) > 1:
+        canonical = min(keys, key=key_rank)
+        cur["contact_key"] = canonical
+        cur["metadata"] = {**cur["metadata"], "merged_keys": [k for k in keys if k != canonical]}
+    for fld, extra_key in (("phone", "other_phones"), ("email", "other_emails")):
+        others = [v for v in dict.fromkeys(r.get(fld) for r in rows) if v and v != cur.get(fld)]
+        if others:
+            cur["metadata"] = {**cur["metadata"], extra_key: others}
+    return cur
+
+
+def dedupe_contacts(rows, link_keys=LINK_KEYS):
+    """One contact per identity cluster (see cluster_contacts)."""
+    return [merge_cluster(cluster) for cluster in cluster_contacts(rows, link_keys)]
+
+
+def dedupe_within_budget(rows, link_keys=LINK_KEYS, memory_mb: float = None, spill_dir: str = None):
+    """dedupe_contacts while the parsed rows fit in `memory_mb`; once they do
+    not, every row goes to a SpilledClusters store on disk instead. Returns
+    a list or the (finished) store; both iterate merged contacts in the same
+    order."""
+    if not memory_mb:
+        return dedupe_contacts(rows, link_keys)
+    limit = max(1, int(memory_mb * 1024 * 1024) // APPROX_ROW_BYTES)
+    rows = iter(rows)
+    held = list(itertools.islice(rows, limit + 1))
+    if len(held) <= limit:
+        return dedupe_contacts(held, link_keys)
+
+    print(f"More than {limit} rows for a {memory_mb:g} MB budget; deduping on disk")
+    # sqlite's page cache gets a quarter of the budget.
+    store = SpilledClusters(lambda r: identity_keys(r, link_keys), merge_cluster, spill_dir, cache_mb=memory_mb / 4)
+    try:
+        for row in held:
+            store.add(row)
+        held = None
+        for row in rows:
+            store.add(row)
+        store.finish()
+    except BaseException:
+        store.close()
+        raise
+    return store
 
 
 def main():
     load_env()
 
-    supabase_url = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip().rstrip("/")
-    service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
+    parser = argparse.ArgumentParser(description="Import CRM contact exports into agent_crm_contacts")
+    parser.add_argument(
+        "--state",
+        default=os.getenv("CRM_IMPORT_STATE", DEFAULT_STATE),
+        help="contact_key -> content hash of the last successful import; only new or changed contacts are pushed",
+    )
+    parser.add_argument("--full", action="store_true", help="Ignore the state file and push every contact")
+    args = parser.parse_args()
+
     tenant_id = (os.getenv("CRM_IMPORT_TENANT_ID") or SYSTEM_TENANT_ID).strip()
     created_by = (os.getenv("CRM_IMPORT_USER_ID") or SYSTEM_USER_ID).strip()
+    workers = int(os.getenv("CRM_IMPORT_WORKERS") or 4)
     dry_run = (os.getenv("CRM_IMPORT_DRY_RUN") or "false").strip().lower() in {"1", "true", "yes"}
+    # Unset: dedupe fully in memory. Set: past this budget the rows spill to a
+    # temporary sqlite database (in CRM_IMPORT_SPILL_DIR or the system temp dir).
+    memory_mb = float(os.getenv("CRM_IMPORT_MEMORY_MB") or 0) or None
+    spill_dir = os.getenv("CRM_IMPORT_SPILL_DIR") or None
+    link_keys_env = os.getenv("CRM_IMPORT_LINK_KEYS")
+    link_keys = LINK_KEYS if link_keys_env is None else tuple(k.strip() for k in link_keys_env.split(",") if k.strip())
+    unknown = set(link_keys) - set(LINK_KEYS)
+    if unknown:
+        raise RuntimeError(f"CRM_IMPORT_LINK_KEYS: unknown identifier(s) {sorted(unknown)}; use {', '.join(LINK_KEYS)}")
 
     client_xlsx = Path(os.getenv("CRM_IMPORT_CLIENT_XLSX") or DEFAULT_CLIENT_XLSX)
     dist_xlsx = Path(os.getenv("CRM_IMPORT_DISTRIBUTOR_XLSX") or DEFAULT_DISTRIBUTOR_XLSX)
@@ -213,29 +542,82 @@ def main():
         dist_xlsx = Path.cwd() / dist_xlsx
 
     if not client_xlsx.exists():
-        raise RuntimeError(f"Client XLSX not found: {client_xlsx}")
+        raise RuntimeError(f"Client export not found: {client_xlsx}")
     if not dist_xlsx.exists():
-        raise RuntimeError(f"Distributor XLSX not found: {dist_xlsx}")
-
-    client_rows = parse_rows(client_xlsx, "client", tenant_id, created_by)
-    dist_rows = parse_rows(dist_xlsx, "distributor", tenant_id, created_by)
-    rows = dedupe_contacts(client_rows + dist_rows)
-
-    print(f"Client rows parsed: {len(client_rows)}")
-    print(f"Distributor rows parsed: {len(dist_rows)}")
+        raise RuntimeError(f"Distributor export not found: {dist_xlsx}")
+
+    state_path = Path(args.state)
+    if not state_path.is_absolute():
+        state_path = Path.cwd() / state_path
+    target = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip().rstrip("/")
+    state = ContactState(state_path, target, created_by, tenant_id)
+    if args.full:
+        state.reset()
+
+    # Both exports stream straight into the dedupe; only merged contacts are held.
+    parsed = {"client": 0, "distributor": 0}
+
+    def counted(rows, customer_type):
+        for row in rows:
+            parsed[customer_type] += 1
+            yield row
+
+    rows = dedupe_within_budget(
+        itertools.chain(
+            counted(iter_rows(client_xlsx, "client", tenant_id, created_by), "client"),
+            counted(iter_rows(dist_xlsx, "distributor", tenant_id, created_by), "distributor"),
+        ),
+        link_keys,
+        memory_mb,
+        spill_dir,
+    )
+    try:
+        report_and_upsert(rows, parsed, link_keys, state, dry_run, workers)
+    finally:
+        state.close()
+        if isinstance(rows, SpilledClusters):
+            rows.close()
+
+
+def report_and_upsert(rows, parsed: dict, link_keys, state: ContactState, dry_run: bool, workers: int):
+    linked = widest = channel_rows = 0
+    changes = {"new": 0, "changed": 0, "unchanged": 0}
+    for r in rows:
+        merged_keys = r["metadata"].get("merged_keys")
+        if merged_keys:
+            linked += 1
+            widest = max(widest, len(merged_keys) + 1)
+        status = state.record(r)
+        changes[status] += 1
+        if status != "unchanged":
+            channel_rows += len(contact_channels(r, None))
+
+    print(f"Client rows parsed: {parsed['client']}")
+    print(f"Distributor rows parsed: {parsed['distributor']}")
     print(f"Total rows parsed: {len(rows)}")
+    print(f"Contacts linked across keys ({', '.join(link_keys) or 'none'}): {linked} (widest: {widest} keys)")
+    print(f"Contacts to push: {changes['new']} new, {changes['changed']} changed ({changes['unchanged']} unchanged since last import)")
+    print(f"Channel rows to push: {channel_rows}")
     if rows:
-        print("Sample:", json.dumps(rows[:2], ensure_ascii=False)[:900])
+        print("Sample:", json.dumps(list(itertools.islice(rows, 2)), ensure_ascii=False)[:900])
 
     if dry_run:
         print("Dry run enabled, no DB write executed.")
         return
 
-    if not supabase_url or not service_key:
-        raise RuntimeError("Missing SUPABASE_URL/NEXT_PUBLIC_SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
-
-    upserted = upsert_contacts(supabase_url, service_key, rows)
-    print(f"Upserted rows: {upserted}")
+    if changes["new"] or changes["changed"]:
+        client = SupabaseRest.from_env(timeout_sec=120)
+        executor = AdaptiveExecutor(client, workers)
+        upserted, channels, retired = upsert_contacts(client, (r for r in rows if state.needs_push(r)), executor, link_keys)
+        print(f"Upserted rows: {upserted}")
+        print(f"Upserted channel rows: {channels}")
+        print(f"Duplicate stored contacts archived: {retired}")
+        print(executor.summary_line())
+        print(client.stats_line())
+    else:
+        print("Nothing to push.")
+    # Only after every batch went through; a failed run re-pushes its changes next time.
+    state.save()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,28 @@
+import itertools
 import json
 import os
 import re
+from collections import Counter
 from pathlib import Path
 
-import openpyxl
-import requests
+from catalog_sync import DEFAULT_PAGE_SIZE, classify_patch, diff_kind, iter_catalog_rows
+from fx_rates import resolve_trm
+from sheet_columns import cell, is_delimited, iter_sheet_rows
+from supabase_rest import SupabaseRest, request_ok
 
 
 SYSTEM_TENANT_ID = "0811c118-5a2f-40cb-907e-8979e0984096"
 SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
 DEFAULT_PROVIDER = "ohaus_colombia"
 DEFAULT_XLSX = "app/api/agents/channels/evolution/webhook/Lista de precios ohaus IA y productos .xlsx"
+# CATALOG_IMPORT_XLSX may also point at a .csv/.tsv export (or .csv.gz/.tsv.gz).
+PRODUCT_URL_BASE = "https://catalogo.ohaus.local/modelo"
+APPLY_IMPORT_RPC = "rest/v1/rpc/agent_catalog_apply_import"
+
+# What the price list owns on an existing catalog row (see plan_import).
+OWNED_COLUMNS = ("brand", "category", "name", "slug", "specs_text", "specs_json", "is_active")
+OWNED_SOURCE_KEYS = ("import_source", "family", "model", "capacity", "resolution", "prices_cop")
+EXISTING_COLUMNS = ("product_url", *OWNED_COLUMNS, "source_payload", "base_price_usd")
 
 
 def load_env_file(path: Path):
@@ -33,6 +45,10 @@ def load_env():
     load_env_file(root / ".env")
 
 
+def model_url(model: str) -> str:
+    return f"{PRODUCT_URL_BASE}/{model}"
+
+
 def normalize(text: str) -> str:
     return re.sub(r"\s+", " ", (text or "").strip().lower())
 
@@ -79,20 +95,37 @@ def num(v):
     return round(n, 2) if n > 0 else None
 
 
-def parse_xlsx(xlsx_path: Path, tenant_id: str, created_by: str, provider: str):
-    wb = openpyxl.load_workbook(xlsx_path, data_only=True)
-    ws = wb[wb.sheetnames[0]]
-
+def num_es(v):
+    """num() for COP prices typed as text in es-CO: "." groups thousands and
+    "," is the decimal mark, so "$ 500.000" is 500000 and "1.234.567,50" is
+    1234567.5. A separator only counts as grouping when it splits off groups
+    of exactly three digits, so "12.5" and "1,5" stay decimals; COP prices
+    never carry three decimals, so "500,000" is 500000 too."""
+    if v is None:
+        return None
+    s = re.sub(r"[^0-9,.-]", "", str(v))
+    if re.fullmatch(r"-?\d{1,3}(\.\d{3})+(,\d*)?", s):
+        s = s.replace(".", "")
+    elif re.fullmatch(r"-?\d{1,3}(,\d{3})+", s):
+        s = s.replace(",", "")
+    return num(s)
+
+
+def parse_xlsx(xlsx_path: Path, tenant_id: str, created_by: str, provider: str, trm: float):
+    """Parse the price list. Columns are positional: family, model, capacity,
+    resolution, then COP prices for Antioquia, Bogota and distributors. A
+    CSV/TSV export (optionally gzipped) with the same layout is read too."""
+    # Delimited exports carry prices as text formatted for es-CO; XLSX cells are numbers.
+    price = num_es if is_delimited(xlsx_path) else num
     rows = []
-    seen_urls = set()
-    for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        family = str(row[0] or "").strip()
-        model = str(row[1] or "").strip()
-        capacity = str(row[2] or "").strip()
-        resolution = str(row[3] or "").strip()
-        price_antioquia = num(row[4])
-        price_bogota = num(row[5])
-        price_dist = num(row[6])
+    for row in itertools.islice(iter_sheet_rows(xlsx_path), 1, None):
+        family = str(cell(row, 0) or "").strip()
+        model = str(cell(row, 1) or "").strip()
+        capacity = str(cell(row, 2) or "").strip()
+        resolution = str(cell(row, 3) or "").strip()
+        price_antioquia = price(cell(row, 4))
+        price_bogota = price(cell(row, 5))
+        price_dist = price(cell(row, 6))
 
         if not model:
             continue
@@ -101,13 +134,9 @@ def parse_xlsx(xlsx_path: Path, tenant_id: str, created_by: str, provider: str):
             continue
 
         category = category_from_family(family)
-        product_url = f"https://catalogo.ohaus.local/modelo/{model}"
-        if product_url in seen_urls:
-            product_url = f"{product_url}-{i}"
-        seen_urls.add(product_url)
 
         price_ref = price_bogota or price_antioquia or price_dist or 0
-        approx_usd = round(price_ref / 4200, 6) if price_ref > 0 else 0
+        approx_usd = round(price_ref / trm, 6) if price_ref > 0 else 0
 
         specs_text = f"Familia: {family}; Capacidad: {capacity}; Resolucion: {resolution}"
         rows.append(
@@ -119,7 +148,7 @@ def parse_xlsx(xlsx_path: Path, tenant_id: str, created_by: str, provider: str):
                 "category": category,
                 "name": model,
                 "slug": slugify(model),
-                "product_url": product_url,
+                "product_url": model_url(model),
                 "image_url": None,
                 "summary": f"{family} | Capacidad {capacity} | Resolucion {resolution}"[:500],
                 "description": specs_text,
@@ -152,93 +181,181 @@ def parse_xlsx(xlsx_path: Path, tenant_id: str, created_by: str, provider: str):
             }
         )
 
+    assign_product_urls(rows)
     return rows
 
 
-def supabase_headers(service_key: str):
-    return {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-    }
-
-
-def request_ok(resp: requests.Response):
-    if 200 <= resp.status_code < 300:
-        return
-    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:400]}")
-
-
-def chunked(arr, size):
-    for i in range(0, len(arr), size):
-        yield arr[i : i + size]
+def variant_slug(source_payload: dict) -> str:
+    parts = (source_payload.get("family"), source_payload.get("capacity"), source_payload.get("resolution"))
+    return slugify(" ".join(str(p) for p in parts if p)) or "variante"
+
+
+def variant_key(name: str, source_payload: dict) -> tuple:
+    """What identifies a price-list entry whatever product_url it was stored under."""
+    return (normalize(name), *(normalize(str(source_payload.get(k) or "")) for k in ("family", "capacity", "resolution")))
+
+
+def url_order(url: str) -> list:
+    """Sort key that puts model before model-2 and model-9 before model-10."""
+    return [int(p) if p.isdigit() else p for p in re.split(r"(\d+)", url or "")]
+
+
+def assign_product_urls(rows):
+    """Give every price-list entry a product_url derived from its own content.
+
+    A model listed once gets the plain model URL; a model listed several
+    times gets model--<family-capacity-resolution> for each entry, and
+    entries identical even on those fields are numbered -2, -3... in file
+    order. So the URL an entry would get changes when its model gains or
+    loses a sibling: these URLs only name new rows, and plan_import matches
+    entries to stored rows on their content first.
+    """
+    counts = Counter(r["product_url"] for r in rows)
+    seen = set()
+    for r in rows:
+        url = r["product_url"]
+        if counts[url] > 1:
+            url = f"{url}--{variant_slug(r['source_payload'])}"
+        base, n = url, 2
+        while url in seen:
+            url = f"{base}-{n}"
+            n += 1
+        seen.add(url)
+        r["product_url"] = url
+
+
+def source_of(row: dict) -> dict:
+    return row.get("source_payload") if isinstance(row.get("source_payload"), dict) else {}
+
+
+def plan_import(rows, existing: dict):
+    """Diff parsed rows against the current catalog (existing: product_url -> row).
+
+    Entries are matched to stored rows on model, family, capacity and
+    resolution first, so a stored row keeps its id and product_url when its
+    model gains a sibling or it still carries a legacy row-number URL; only
+    entries with no such row fall back to their product_url (an edited
+    entry). New rows whose product_url is already taken are numbered on.
+
+    Returns (inserts, updates, deactivate_ids, unchanged). Existing rows only
+    get the columns the price list owns; summary, description and image or
+    datasheet URLs written by the other OHAUS syncs are left untouched.
+    base_price_usd is only rewritten when the list prices moved.
+    """
+    taken = set(existing)
+    by_variant = {}
+    for current in sorted(existing.values(), key=lambda r: url_order(r.get("product_url"))):
+        by_variant.setdefault(variant_key(current.get("name"), source_of(current)), []).append(current)
+    matched = []
+    for row in rows:
+        candidates = by_variant.get(variant_key(row["name"], row["source_payload"])) or []
+        # Identical variants: prefer the stored row that already has these prices.
+        prices = row["source_payload"].get("prices_cop")
+        current = next((c for c in candidates if source_of(c).get("prices_cop") == prices), None)
+        current = current or (candidates[0] if candidates else None)
+        if current is not None:
+            candidates.remove(current)
+            existing.pop(current.get("product_url"), None)
+        matched.append(current)
+    matched = [current or existing.pop(row["product_url"], None) for row, current in zip(rows, matched)]
+
+    inserts = []
+    updates = []
+    unchanged = 0
+    for row, current in zip(rows, matched):
+        if current is None:
+            base, n = row["product_url"], 2
+            while row["product_url"] in taken:
+                row["product_url"] = f"{base}-{n}"
+                n += 1
+            taken.add(row["product_url"])
+            inserts.append(row)
+            continue
+        current_source = source_of(current)
+        patch_obj = {col: row.get(col) for col in OWNED_COLUMNS}
+        patch_obj["source_payload"] = {
+            **current_source,
+            **{k: row["source_payload"].get(k) for k in OWNED_SOURCE_KEYS},
+        }
+        if diff_kind(row["source_payload"].get("prices_cop"), current_source.get("prices_cop")) is not None:
+            patch_obj["base_price_usd"] = row.get("base_price_usd")
+        if classify_patch(current, patch_obj) == "unchanged":
+            unchanged += 1
+            continue
+        updates.append({"id": current["id"], "patch": patch_obj})
+    deactivate = [r["id"] for r in existing.values() if r.get("is_active")]
+    return inserts, updates, deactivate, unchanged
 
 
 def main():
     load_env()
-    supabase_url = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip()
-    service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
-    if not supabase_url or not service_key:
-        raise RuntimeError("Missing SUPABASE_URL/NEXT_PUBLIC_SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
+    client = SupabaseRest.from_env(timeout_sec=120)
 
     tenant_id = (os.getenv("CATALOG_IMPORT_TENANT_ID") or SYSTEM_TENANT_ID).strip()
     created_by = (os.getenv("CATALOG_IMPORT_USER_ID") or SYSTEM_USER_ID).strip()
     provider = (os.getenv("CATALOG_IMPORT_PROVIDER") or DEFAULT_PROVIDER).strip()
+    page_size = int(os.getenv("CATALOG_IMPORT_PAGE_SIZE") or DEFAULT_PAGE_SIZE)
+    dry_run = (os.getenv("CATALOG_IMPORT_DRY_RUN") or "false").strip().lower() in {"1", "true", "yes"}
     xlsx_path = Path(os.getenv("CATALOG_IMPORT_XLSX") or DEFAULT_XLSX)
     if not xlsx_path.is_absolute():
         xlsx_path = Path.cwd() / xlsx_path
     if not xlsx_path.exists():
-        raise RuntimeError(f"XLSX file not found: {xlsx_path}")
+        raise RuntimeError(f"Price list not found: {xlsx_path}")
 
-    rows = parse_xlsx(xlsx_path, tenant_id, created_by, provider)
+    trm = resolve_trm(client, created_by, os.getenv("CATALOG_IMPORT_TRM"), tenant_id)
+    rows = parse_xlsx(xlsx_path, tenant_id, created_by, provider, trm)
     if not rows:
-        raise RuntimeError("No products parsed from XLSX")
+        raise RuntimeError("No products parsed from price list")
 
     print(f"Parsed rows: {len(rows)}")
     print("Sample:", json.dumps(rows[:3], ensure_ascii=False)[:700])
 
-    base = supabase_url.rstrip("/") + "/rest/v1"
-    headers = supabase_headers(service_key)
-
-    # Read old ids
-    sel_params = {
-        "select": "id",
+    filters = {
         "tenant_id": f"eq.{tenant_id}",
         "created_by": f"eq.{created_by}",
         "provider": f"eq.{provider}",
-        "limit": "20000",
     }
-    r = requests.get(f"{base}/agent_product_catalog", headers=headers, params=sel_params, timeout=60)
-    request_ok(r)
-    old_ids = [x.get("id") for x in (r.json() or []) if x.get("id")]
-
-    # Delete variants first
-    if old_ids:
-        for batch in chunked(old_ids, 300):
-            p = {"catalog_id": f"in.({','.join(batch)})"}
-            rv = requests.delete(f"{base}/agent_product_variants", headers=headers, params=p, timeout=60)
-            if rv.status_code >= 400 and "relation" not in (rv.text or "").lower():
-                raise RuntimeError(f"Failed deleting variants: {rv.status_code} {rv.text[:300]}")
-
-    # Delete old catalog
-    del_params = {
-        "tenant_id": f"eq.{tenant_id}",
-        "created_by": f"eq.{created_by}",
-        "provider": f"eq.{provider}",
-    }
-    rd = requests.delete(f"{base}/agent_product_catalog", headers=headers, params=del_params, timeout=120)
-    request_ok(rd)
+    existing = {r.get("product_url"): r for r in iter_catalog_rows(client, EXISTING_COLUMNS, filters, page_size)}
+    print(f"Catalog rows: {len(existing)}")
+
+    inserts, updates, deactivate, unchanged = plan_import(rows, existing)
+    print(f"New models: {len(inserts)}")
+    print(f"Changed models: {len(updates)}")
+    print(f"Unchanged models (skipped): {unchanged}")
+    print(f"Models no longer listed (to deactivate): {len(deactivate)}")
+
+    if dry_run:
+        print("Dry run enabled, no DB write executed.")
+        print(client.stats_line())
+        return
 
-    # Insert new rows
-    inserted = 0
-    for batch in chunked(rows, 250):
-        ri = requests.post(f"{base}/agent_product_catalog", headers=headers, json=batch, timeout=120)
-        request_ok(ri)
-        inserted += len(batch)
-        print(f"Inserted {inserted}/{len(rows)}")
+    if inserts or updates or deactivate:
+        # One RPC call = one transaction: readers never see a partially applied import.
+        payload = {
+            "p_tenant_id": tenant_id,
+            "p_created_by": created_by,
+            "p_provider": provider,
+            "p_insert": inserts,
+            "p_update": updates,
+            "p_deactivate": deactivate,
+        }
+        resp = client.post(APPLY_IMPORT_RPC, json_body=payload, timeout=300)
+        request_ok(resp, 400)
+        applied = resp.json() if resp.text else {}
+        # What the database did (migration 031), which can differ from the plan above.
+        print(f"Inserted rows: {applied.get('inserted', 0)}")
+        print(f"Updated rows: {applied.get('updated', 0)}")
+        print(f"Deactivated rows: {applied.get('deactivated', 0)}")
+        skipped = applied.get("skipped") or []
+        if skipped:
+            print(f"New models not inserted (product_url already in the tenant catalog): {len(skipped)}")
+            for url in skipped[:20]:
+                print(f"SKIPPED: product_url={url}")
+            print(client.stats_line())
+            raise SystemExit(1)
 
     print("Import completed")
+    print(client.stats_line())
 
 
 if __name__ == "__main__":
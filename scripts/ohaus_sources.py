@@ -0,0 +1,640 @@
+import mimetypes
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import openpyxl
+
+from file_manifest import FileManifest
+from quote_workbook import extract_quote_workbook, load_image_bytes, norm_model
+from sheet_columns import absent_fields, cell, header_names, resolve_columns
+from supabase_rest import SupabaseRest, request_ok
+
+
+# Each OHAUS source turns a catalog row plus its parsed input into a patch.
+# The unified pipeline (sync-ohaus-catalog.py) applies them in this order,
+# each on top of the previous result, so later sources win on the fields
+# they share:
+#   cotizaciones  descriptions and Bogota price scraped from quote workbooks
+#   assets        datasheet/image URLs uploaded from the Cotizaciones folder
+#   template      curated commercial descriptions, family and explicit URLs
+#   prices        the official price list: prices_cop and base_price_usd
+SOURCE_ORDER = ("cotizaciones", "assets", "template", "prices")
+
+ASSETS_MODEL_RE = re.compile(r"\b([A-Z]{1,5}\d[\dA-Z/-]{0,14})\b")
+
+
+def norm_text(v: str) -> str:
+    return re.sub(r"\s+", " ", str(v or "").strip())
+
+
+def source_payload_of(row: dict) -> dict:
+    return row.get("source_payload") if isinstance(row.get("source_payload"), dict) else {}
+
+
+# --- Price list ("Lista de precios ohaus IA.xlsx") ---------------------------
+
+
+def parse_number(value):
+    s = str(value or "").strip()
+    if not s:
+        return None
+    s = re.sub(r"[^0-9,.-]", "", s)
+    if not s:
+        return None
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s:
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        n = float(s)
+    except Exception:
+        return None
+    return round(n, 2) if n > 0 else None
+
+
+def parse_price_list_xlsx(file_path: Path):
+    wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
+    ws = wb[wb.sheetnames[0]]
+
+    out = {}
+    for row in ws.iter_rows(min_row=3, values_only=True):
+        family = str(row[0] or "").strip()
+        model = str(row[1] or "").strip()
+        capacity = str(row[2] or "").strip()
+        resolution = str(row[3] or "").strip()
+        antioquia = parse_number(row[4])
+        bogota = parse_number(row[5])
+        dist = parse_number(row[6])
+
+        if not model:
+            continue
+
+        key = norm_model(model)
+        if not key:
+            continue
+
+        if not (antioquia or bogota or dist):
+            continue
+
+        out[key] = {
+            "model": model,
+            "family": family,
+            "capacity": capacity,
+            "resolution": resolution,
+            "prices_cop": {
+                "antioquia": antioquia,
+                "bogota": bogota,
+                "distribuidor": dist,
+            },
+            "price_cop_selected": bogota or antioquia or dist,
+        }
+
+    wb.close()
+    return out
+
+
+def reference_price_cop(prices_cop) -> float:
+    """The COP price base_price_usd follows: Bogota, then Antioquia, then
+    Distribuidor (the order migration 034 recomputes with)."""
+    prices_cop = prices_cop if isinstance(prices_cop, dict) else {}
+    for region in ("bogota", "antioquia", "distribuidor"):
+        try:
+            price = float(prices_cop.get(region) or 0)
+        except (TypeError, ValueError):
+            continue
+        if price > 0:
+            return price
+    return 0.0
+
+
+def usd_price_fields(row: dict, prices_cop: dict, trm: float, now_iso: str) -> dict:
+    """base_price_usd for COP prices a source is about to write, only when they
+    move the reference price or the row has no USD price yet. A TRM move alone
+    is left to --recompute-usd, so a daily rate does not change every row."""
+    stored = source_payload_of(row).get("prices_cop")
+    merged = {**(stored if isinstance(stored, dict) else {}), **prices_cop}
+    price_cop = reference_price_cop(merged)
+    if price_cop <= 0 or trm <= 0:
+        return {}
+    if row.get("base_price_usd") not in (None, "") and price_cop == reference_price_cop(stored):
+        return {}
+    return {
+        "base_price_usd": round(price_cop / trm, 6),
+        "price_currency": "USD",
+        "last_price_update": now_iso,
+    }
+
+
+def price_list_patch(row: dict, incoming: dict, trm: float, now_iso: str):
+    price_cop = float(incoming.get("price_cop_selected") or 0)
+    if price_cop <= 0:
+        return None
+
+    # Only the keys the price list owns; the RPC deep-merges them into
+    # source_payload, so prices_cop regions it does not list are kept.
+    source_patch = {
+        "import_source": "Lista de precios ohaus IA.xlsx",
+        "prices_cop": dict(incoming.get("prices_cop", {})),
+        "price_list_synced_at": now_iso,
+    }
+    for k in ("family", "capacity", "resolution"):
+        if incoming.get(k):
+            source_patch[k] = incoming.get(k)
+
+    return {
+        "source_payload": source_patch,
+        **usd_price_fields(row, source_patch["prices_cop"], trm, now_iso),
+    }
+
+
+# --- Quote template (plantilla_descripcion_cotizaciones_ohausfinal.xlsx) ----
+
+
+def norm(s: str) -> str:
+    s = str(s or "").strip().lower()
+    return re.sub(r"[^a-z0-9]+", "", s)
+
+
+EMPTY_MARKERS = {"-", "--", "n/a", "na", "none", "null"}
+
+
+def clean(v):
+    s = str(v or "").strip()
+    if s in EMPTY_MARKERS:
+        return ""
+    return s
+
+
+def _parse_number(s: str):
+    if not s:
+        return None
+    s = re.sub(r"[^0-9,.-]", "", s)
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s:
+        s = s.replace(",", ".")
+    try:
+        return float(s)
+    except Exception:
+        return None
+
+
+def num(v):
+    n = _parse_number(clean(v))
+    return round(n, 2) if n is not None and n > 0 else None
+
+
+# The template audit reads cells its own way, as it always has: empty markers
+# match in any case ("N/A" is blank) and 0 is a price to check, not a blank.
+def audit_clean(v):
+    s = str(v or "").strip()
+    if s.lower() in EMPTY_MARKERS:
+        return ""
+    return s
+
+
+def audit_num(v):
+    n = _parse_number(audit_clean(v))
+    return None if n is None else round(n, 2)
+
+
+# Template field -> header. Only "modelo" is required; other absent columns read as empty.
+TEMPLATE_COLUMNS = {
+    "modelo": "modelo",
+    "summary": "descripcion_comercial_corta",
+    "description": "descripcion_comercial_larga",
+    "family": "familia",
+    "brand": "marca",
+    "image_url": "imagen_url",
+    "datasheet_url": "ficha_pdf_url",
+    "price_bogota": "precio_bogota_cop",
+    "price_antioquia": "precio_antioquia_cop",
+    "price_distribuidor": "precio_distribuidor_cop",
+}
+
+
+def iter_template_rows(xlsx_path: Path):
+    """Yield (key, row) per template model, streaming the sheet in read-only
+    mode so memory does not grow with the workbook's cell count."""
+    wb = openpyxl.load_workbook(xlsx_path, data_only=True, read_only=True)
+    try:
+        ws = wb[wb.sheetnames[0]]
+        rows = ws.iter_rows(values_only=True)
+        cols = resolve_columns(next(rows, ()), TEMPLATE_COLUMNS, required=("modelo",), source=Path(xlsx_path).name)
+        absent = absent_fields(cols)
+        if absent:
+            print(f"{Path(xlsx_path).name}: columns not found (read as empty): {', '.join(header_names(TEMPLATE_COLUMNS, absent))}")
+
+        for i, row in enumerate(rows, start=2):
+            model = clean(cell(row, cols["modelo"]))
+            key = norm(model)
+            if not key:
+                continue
+            desc_short = clean(cell(row, cols["summary"]))
+            desc_long = clean(cell(row, cols["description"]))
+            yield key, {
+                "modelo": model,
+                "summary": desc_short,
+                "description": desc_long or desc_short,
+                "family": clean(cell(row, cols["family"])),
+                "brand": clean(cell(row, cols["brand"])),
+                "image_url": clean(cell(row, cols["image_url"])),
+                "datasheet_url": clean(cell(row, cols["datasheet_url"])),
+                "prices_cop": {
+                    "bogota": num(cell(row, cols["price_bogota"])),
+                    "antioquia": num(cell(row, cols["price_antioquia"])),
+                    "distribuidor": num(cell(row, cols["price_distribuidor"])),
+                },
+                "_row": i,
+                "_raw": {field: cell(row, idx) for field, idx in cols.items()},
+            }
+    finally:
+        wb.close()
+
+
+def parse_template_rows(xlsx_path: Path):
+    return dict(iter_template_rows(xlsx_path))
+
+
+def template_patch(row: dict, tpl: dict):
+    tpl_prices = tpl.get("prices_cop") or {}
+    source_patch = {}
+    for k, v in (
+        ("family", tpl.get("family")),
+        ("quote_description", tpl.get("description")),
+        ("descripcion_comercial_corta", tpl.get("summary")),
+        ("descripcion_comercial_larga", tpl.get("description")),
+    ):
+        if v:
+            source_patch[k] = v
+    prices = {region: price for region, price in tpl_prices.items() if price is not None}
+    if prices:
+        source_patch["prices_cop"] = prices
+
+    patch_obj = {}
+    if source_patch:
+        patch_obj["source_payload"] = source_patch
+    for col in ("summary", "description", "image_url", "datasheet_url"):
+        if tpl.get(col):
+            patch_obj[col] = tpl.get(col)
+    return patch_obj
+
+
+# Catalog columns audit_template() compares against.
+TEMPLATE_AUDIT_COLUMNS = ("name", "summary", "description", "image_url", "datasheet_url", "source_payload")
+
+
+def audit_expected(tpl: dict) -> dict:
+    """The template row as the audit reads it, from the raw cells."""
+    raw = tpl.get("_raw") or {}
+    summary = audit_clean(raw.get("summary"))
+    return {
+        "summary": summary,
+        "description": audit_clean(raw.get("description")) or summary,
+        "family": audit_clean(raw.get("family")),
+        "image_url": audit_clean(raw.get("image_url")),
+        "datasheet_url": audit_clean(raw.get("datasheet_url")),
+        "price_bogota": audit_num(raw.get("price_bogota")),
+        "price_antioquia": audit_num(raw.get("price_antioquia")),
+        "price_distribuidor": audit_num(raw.get("price_distribuidor")),
+    }
+
+
+def audit_template(template: dict, rows_by_key: dict):
+    """Compare parsed template rows with catalog rows keyed by norm(name).
+
+    Returns (missing_models, mismatches); only fields the template fills
+    are checked. Both sides are read with audit_clean/audit_num, so "N/A"
+    in any case is blank and a 0 price is checked.
+    """
+    missing_models = []
+    mismatches = []
+    for key, tpl in template.items():
+        model = tpl.get("modelo") or key
+        row = rows_by_key.get(key)
+        if not row:
+            missing_models.append(model)
+            continue
+
+        payload = source_payload_of(row)
+        prices = payload.get("prices_cop") if isinstance(payload.get("prices_cop"), dict) else {}
+        got = {
+            "summary": audit_clean(row.get("summary")),
+            "description": audit_clean(row.get("description")),
+            "family": audit_clean(payload.get("family")),
+            "image_url": audit_clean(row.get("image_url")),
+            "datasheet_url": audit_clean(row.get("datasheet_url")),
+            "price_bogota": audit_num(prices.get("bogota")),
+            "price_antioquia": audit_num(prices.get("antioquia")),
+            "price_distribuidor": audit_num(prices.get("distribuidor")),
+        }
+
+        for field, expected in audit_expected(tpl).items():
+            if expected in (None, ""):
+                continue
+            if isinstance(expected, float) or isinstance(got[field], float):
+                if float(expected or 0) != float(got[field] or 0):
+                    mismatches.append(f"{model}: {field} expected={expected} got={got[field]}")
+            elif norm(str(expected)) != norm(str(got[field])):
+                mismatches.append(f"{model}: {field} expected='{expected}' got='{got[field]}'")
+    return missing_models, mismatches
+
+
+def report_template_audit(missing_models, mismatches, max_errors: int = 40):
+    """Print audit results; exit non-zero on any MISSING/MISMATCH so CI can gate on it."""
+    print(f"Missing models in DB: {len(missing_models)}")
+    print(f"Field mismatches: {len(mismatches)}")
+    lines = [f"MISSING: {m}" for m in missing_models] + [f"MISMATCH: {mm}" for mm in mismatches]
+    for line in lines[: max(0, max_errors)]:
+        print(line)
+    if lines:
+        raise SystemExit(1)
+    print("Audit OK: XLS and DB are aligned.")
+
+
+# --- Cotizaciones folder: quote content --------------------------------------
+
+
+def quote_score(data: dict) -> int:
+    return len(str(data.get("description") or "")) + (1000 if data.get("price_cop") else 0)
+
+
+def parse_files(files, parse_workers: int = 1):
+    """Parse XLSX files, fanning out to a process pool when parse_workers > 1.
+
+    Results come back in input order, so the merge below sees exactly the
+    same sequence as the serial loop.
+    """
+    if parse_workers > 1 and len(files) > 1:
+        chunksize = max(1, len(files) // (parse_workers * 4))
+        with ProcessPoolExecutor(max_workers=parse_workers) as pool:
+            return list(pool.map(extract_quote_workbook, files, chunksize=chunksize))
+    return [extract_quote_workbook(f) for f in files]
+
+
+def build_folder_index(folder: Path, manifest: FileManifest = None, parse_workers: int = 1):
+    files = sorted(folder.glob("*.xlsx"))
+    by_key = {}
+    dirty_keys = set()
+    parsed = 0
+    if manifest is not None:
+        for removed in manifest.prune(files, suffixes=(".xlsx",)).values():
+            if removed and removed.get("model_key"):
+                dirty_keys.add(removed["model_key"])
+
+    results = [manifest.lookup(f) if manifest is not None else None for f in files]
+    todo = [i for i, data in enumerate(results) if data is None]
+    for i, data in zip(todo, parse_files([files[i] for i in todo], parse_workers)):
+        results[i] = data
+        if manifest is not None:
+            manifest.store(files[i], data)
+
+    for file_path, data in zip(files, results):
+        key = data.get("model_key")
+        if not key:
+            continue
+        parsed += 1
+        if manifest is None or manifest.is_dirty(file_path):
+            dirty_keys.add(key)
+        prev = by_key.get(key)
+        if not prev:
+            by_key[key] = data
+            continue
+        if quote_score(data) > quote_score(prev):
+            by_key[key] = data
+    return by_key, len(files), parsed, dirty_keys
+
+
+def quote_is_clean(row: dict, key: str, incoming: dict, dirty_keys) -> bool:
+    """Unchanged, already-pushed XLSX: skip unless the row was never synced from this file."""
+    return key not in dirty_keys and source_payload_of(row).get("quote_xlsx_file") == incoming.get("xlsx_file")
+
+
+def quote_patch(row: dict, incoming: dict, trm: float, now_iso: str):
+    model = str(row.get("name") or "").strip()
+    description = norm_text(incoming.get("description"))
+    price_cop = incoming.get("price_cop")
+
+    source_patch = {
+        "import_source": "Ohaus/Cotizaciones",
+        "quote_xlsx_file": incoming.get("xlsx_file"),
+        "cotizaciones_synced_at": now_iso,
+    }
+    if incoming.get("model") or not source_payload_of(row).get("quote_model"):
+        source_patch["quote_model"] = incoming.get("model") or model
+    if description:
+        source_patch["quote_description"] = description
+        source_patch["descripcion_comercial_larga"] = description
+    if price_cop:
+        source_patch["prices_cop"] = {"bogota": price_cop}
+
+    patch_obj = {
+        "source_payload": source_patch,
+    }
+
+    if description:
+        patch_obj["description"] = description
+        patch_obj["summary"] = description.replace("\n", " ")[:500]
+
+    if price_cop:
+        patch_obj.update(usd_price_fields(row, source_patch["prices_cop"], trm, now_iso))
+
+    return patch_obj
+
+
+# --- Cotizaciones folder: datasheet PDFs and product images ------------------
+
+
+def asset_model_from_filename(file_name: str) -> str:
+    stem = Path(file_name).stem
+    clean_name = re.sub(r"^\d+\.", "", stem).strip()
+    clean_name = re.sub(r"\b(ficha|tecnica|tecnico|datasheet|data\s*sheet|cotizacion|cotizacion)\b", " ", clean_name, flags=re.I)
+    clean_name = re.sub(r"\s+", " ", clean_name).strip(" -_")
+    found = ASSETS_MODEL_RE.findall(clean_name.upper())
+    if found:
+        ranked = sorted(found, key=lambda x: (len(norm_model(x)), x.count("-"), x), reverse=True)
+        return ranked[0]
+    parts = [p for p in re.split(r"\s+", clean_name) if p]
+    return parts[-1].upper() if parts else ""
+
+
+def prefix_id_from_filename(file_name: str) -> str:
+    m = re.match(r"^(\d+)\.", str(file_name or "").strip())
+    return m.group(1) if m else ""
+
+
+def extract_workbook(xlsx_path: Path, manifest: FileManifest = None):
+    cached = manifest.lookup(xlsx_path) if manifest is not None else None
+    if cached is not None:
+        return cached
+    try:
+        data = extract_quote_workbook(xlsx_path)
+    except Exception:
+        # Unreadable workbook: fall back to the file name, and leave it out of
+        # the shared manifest so the content sync still reports the error.
+        return {"cell_model": "", "image": None}
+    if manifest is not None:
+        manifest.store(xlsx_path, data)
+    return data
+
+
+def choose_best_pdf(files):
+    if not files:
+        return None
+    ranked = []
+    for p in files:
+        name = p.name.lower()
+        score = 0
+        if "ficha" in name:
+            score += 20
+        if "datasheet" in name or "data sheet" in name:
+            score += 12
+        if "manual" in name or "brochure" in name:
+            score -= 10
+        score -= len(name) // 40
+        ranked.append((score, p))
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    return ranked[0][1]
+
+
+def build_assets_index(folder: Path, manifest: FileManifest = None):
+    xlsx_files = sorted(folder.glob("*.xlsx"))
+    pdf_files = sorted(folder.glob("*.pdf"))
+    if manifest is not None:
+        # Only the PDF entries are ours to drop: the content sync reads the
+        # pruned .xlsx entries to find models whose quote file was removed.
+        manifest.prune(pdf_files, suffixes=(".pdf",))
+
+    by_key = {}
+    key_by_prefix = {}
+    for x in xlsx_files:
+        cached = extract_workbook(x, manifest)
+        model = cached.get("cell_model") or asset_model_from_filename(x.name)
+        key = norm_model(model)
+        if not key:
+            continue
+        if key not in by_key:
+            by_key[key] = {"model": model, "xlsx": None, "pdfs": []}
+        by_key[key]["xlsx"] = x
+        by_key[key]["image"] = cached.get("image")
+        pref = prefix_id_from_filename(x.name)
+        if pref:
+            key_by_prefix[pref] = key
+
+    pdf_dirty = set()
+    for p in pdf_files:
+        pref = prefix_id_from_filename(p.name)
+        key = key_by_prefix.get(pref, "") if pref else ""
+        model = ""
+        if not key:
+            model = asset_model_from_filename(p.name)
+            key = norm_model(model)
+        if manifest is not None:
+            cached = manifest.lookup(p)
+            if cached is None or cached.get("key") != key:
+                manifest.store(p, {"key": key})
+                pdf_dirty.add(p)
+            elif manifest.is_dirty(p):
+                pdf_dirty.add(p)
+        if not key:
+            continue
+        if key not in by_key:
+            by_key[key] = {"model": model, "xlsx": None, "pdfs": []}
+        by_key[key]["pdfs"].append(p)
+
+    out = {}
+    for key, row in by_key.items():
+        pdf = choose_best_pdf(row.get("pdfs") or [])
+        xlsx = row.get("xlsx")
+        out[key] = {
+            "model": row.get("model") or key,
+            "xlsx": xlsx,
+            "pdf": pdf,
+            "image": row.get("image"),
+            "xlsx_dirty": bool(xlsx) and (manifest is None or manifest.is_dirty(xlsx)),
+            "pdf_dirty": bool(pdf) and (manifest is None or pdf in pdf_dirty),
+        }
+    return out
+
+
+def ensure_bucket(client: SupabaseRest, bucket: str):
+    payload = {"id": bucket, "name": bucket, "public": True}
+    resp = client.post("storage/v1/bucket", json_body=payload, timeout=60)
+    if resp.status_code in (200, 201):
+        return
+    if resp.status_code in (400, 409):
+        return
+    request_ok(resp, 800)
+
+
+def public_object_url(client: SupabaseRest, bucket: str, object_path: str) -> str:
+    object_path = object_path.replace("\\", "/").lstrip("/")
+    return client.url(f"storage/v1/object/public/{bucket}/{object_path}")
+
+
+def upload_object(client: SupabaseRest, bucket: str, object_path: str, blob: bytes, mime_type: str):
+    object_path = object_path.replace("\\", "/").lstrip("/")
+    headers = {"Content-Type": mime_type, "x-upsert": "true"}
+    resp = client.post(f"storage/v1/object/{bucket}/{object_path}", data=blob, headers=headers, timeout=180)
+    if resp.status_code not in (200, 201):
+        request_ok(resp, 800)
+    return public_object_url(client, bucket, object_path)
+
+
+def asset_object_paths(key: str, assets: dict) -> dict:
+    """Storage object paths for the assets a model publishes, by catalog column."""
+    paths = {}
+    if assets.get("pdf"):
+        paths["datasheet_url"] = f"datasheets/{key}.pdf"
+    image_meta = assets.get("image") if assets.get("xlsx") else None
+    if image_meta:
+        paths["image_url"] = f"images/{key}{str(image_meta.get('ext') or '.png')}"
+    return paths
+
+
+def asset_uploads(client: SupabaseRest, bucket: str, key: str, assets: dict) -> list:
+    """Upload tasks for new/modified files only. Image bytes are read back
+    from the workbook when the task runs, not while planning."""
+    paths = asset_object_paths(key, assets)
+    tasks = []
+    pdf_path = assets.get("pdf")
+    if "datasheet_url" in paths and assets.get("pdf_dirty") and pdf_path.exists():
+        tasks.append(
+            lambda p=pdf_path, o=paths["datasheet_url"]: upload_object(client, bucket, o, p.read_bytes(), "application/pdf")
+        )
+    if "image_url" in paths and assets.get("xlsx_dirty"):
+        image_meta = assets.get("image")
+        mime = mimetypes.types_map.get(Path(paths["image_url"]).suffix.lower(), "image/png")
+        tasks.append(
+            lambda x=assets.get("xlsx"), i=image_meta, o=paths["image_url"], m=mime: upload_object(
+                client, bucket, o, load_image_bytes(x, i), m
+            )
+        )
+    return tasks
+
+
+def assets_patch(row: dict, key: str, assets: dict, object_url):
+    """Point datasheet_url/image_url at the uploaded objects; `object_url`
+    maps an object path to the URL written (or a dry-run placeholder)."""
+    patch_obj = {col: object_url(path) for col, path in asset_object_paths(key, assets).items()}
+    if not patch_obj:
+        return None
+    model = str(row.get("name") or "").strip()
+    pdf_path = assets.get("pdf")
+    # quote_xlsx_file and quote_model belong to the content sync (quote_patch),
+    # which may pick another workbook for the model; writing them here too
+    # would flip them on every run of either sync.
+    source_patch = {"import_source": "Ohaus/Cotizaciones assets"}
+    if not source_payload_of(row).get("quote_model"):
+        source_patch["quote_model"] = assets.get("model") or model
+    if pdf_path:
+        source_patch["quote_pdf_file"] = pdf_path.name
+    patch_obj["source_payload"] = source_patch
+    return patch_obj
@@ -0,0 +1,166 @@
+import re
+import zipfile
+from pathlib import Path
+
+import openpyxl
+
+from file_manifest import DEFAULT_MANIFEST_DIR
+from xlsx_images import image_bytes, pick_product_image
+
+
+# Bump when the extraction output changes so cached manifests are discarded.
+EXTRACT_VERSION = 1
+# Both Cotizaciones syncs cache extract_quote_workbook() results in this manifest.
+MANIFEST_NAMESPACE = "cotizaciones-workbooks"
+DEFAULT_MANIFEST = f"{DEFAULT_MANIFEST_DIR}/cotizaciones-manifest.json"
+
+MODEL_RE = re.compile(r"\b([A-Z]{1,5}\d[\dA-Z/-]{0,12})\b")
+# The assets sync reads the model from the quote header cells with a wider pattern.
+CELL_MODEL_RE = re.compile(r"\b([A-Z]{1,5}\d[\dA-Z/-]{0,14})\b")
+MODEL_CELLS = ((5, 2), (6, 2), (5, 4))
+
+
+def norm_model(v: str) -> str:
+    return re.sub(r"[^A-Z0-9]", "", str(v or "").upper())
+
+
+def parse_money(value) -> float | None:
+    s = str(value or "").strip()
+    if not s:
+        return None
+    s = re.sub(r"[^0-9,.-]", "", s)
+    if not s:
+        return None
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    elif "," in s:
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        n = float(s)
+    except Exception:
+        return None
+    return round(n, 2) if n > 0 else None
+
+
+def model_from_filename(file_name: str) -> str:
+    stem = Path(file_name).stem
+    clean = re.sub(r"^\d+\.", "", stem).strip()
+    found = MODEL_RE.findall(clean.upper())
+    if found:
+        return found[-1]
+    tokens = [t for t in re.split(r"\s+", clean) if t]
+    if not tokens:
+        return ""
+    return tokens[-1].upper()
+
+
+def iter_sheet_cells(ws, max_rows=180, max_cols=14):
+    for r, row in enumerate(
+        ws.iter_rows(min_row=1, max_row=max_rows, min_col=1, max_col=max_cols, values_only=True),
+        start=1,
+    ):
+        row_vals = []
+        for c, v in enumerate(row, start=1):
+            if v is None:
+                continue
+            s = str(v).strip()
+            if not s:
+                continue
+            row_vals.append((c, s))
+        if row_vals:
+            yield r, row_vals
+
+
+def model_from_cells(cells: dict) -> str:
+    for rc in MODEL_CELLS:
+        m = CELL_MODEL_RE.findall(cells.get(rc, "").upper())
+        if m:
+            return m[0]
+    return ""
+
+
+def extract_quote_workbook(xlsx_path: Path):
+    """Read everything both Cotizaciones syncs need from one quote workbook.
+
+    The first sheet is scanned once (read-only) for the content fields
+    (model, description, price candidates) and the B5/B6/D5 header cells the
+    assets sync keys on; the image choice comes from the zip drawing parts.
+    Image bytes are not included, so the result can be cached as JSON; use
+    load_image_bytes() with the returned "image" to fetch them.
+    """
+    wb = openpyxl.load_workbook(xlsx_path, data_only=True, read_only=True)
+    ws = wb[wb.sheetnames[0]]
+
+    model_candidates = []
+    description_candidates = []
+    price_candidates = []
+    header_cells = {}
+
+    for r, row_vals in iter_sheet_cells(ws):
+        row_text = " | ".join(v for _, v in row_vals)
+
+        for c, value in row_vals:
+            if (r, c) in MODEL_CELLS:
+                header_cells[(r, c)] = value
+
+            up = value.upper()
+            for m in MODEL_RE.findall(up):
+                if m.startswith("SAP"):
+                    continue
+                model_candidates.append(m)
+
+            if len(value) >= 40 and ("sap" in value.lower() or "marca" in value.lower()):
+                description_candidates.append(value)
+            elif "\n" in value and len(value) >= 40:
+                description_candidates.append(value)
+
+            if "$" in value or re.search(r"\b\d{1,3}(?:\.\d{3}){1,4}\b", value):
+                money = parse_money(value)
+                if money and money > 1000:
+                    price_candidates.append(money)
+
+        if "descripcion" in row_text.lower() and len(row_vals) >= 2:
+            long_cell = sorted(row_vals, key=lambda x: len(x[1]), reverse=True)[0][1]
+            if len(long_cell) >= 30:
+                description_candidates.append(long_cell)
+
+    wb.close()
+
+    file_model = model_from_filename(xlsx_path.name)
+    model = file_model
+    if not norm_model(model) and model_candidates:
+        ranked = sorted(model_candidates, key=lambda x: (len(x), x.count("/"), x), reverse=True)
+        if norm_model(ranked[0]):
+            model = ranked[0]
+
+    description = ""
+    if description_candidates:
+        description = max(description_candidates, key=lambda x: len(x)).strip()
+        description = re.sub(r"\n{3,}", "\n\n", description)
+
+    price_cop = max(price_candidates) if price_candidates else None
+
+    try:
+        image = pick_product_image(xlsx_path, with_bytes=False)
+    except Exception:
+        image = None
+
+    return {
+        "model": model.strip(),
+        "model_key": norm_model(model),
+        "file_model": file_model,
+        "cell_model": model_from_cells(header_cells),
+        "description": description,
+        "price_cop": price_cop,
+        "price_candidates": price_candidates,
+        "image": image,
+        "xlsx_file": xlsx_path.name,
+    }
+
+
+def load_image_bytes(xlsx_path: Path, image: dict) -> bytes:
+    with zipfile.ZipFile(xlsx_path) as zf:
+        return image_bytes(zf, image.get("media"), image.get("format"))
@@ -0,0 +1,124 @@
+import threading
+
+from supabase_rest import SupabaseRest, request_ok
+
+
+CONTACTS_TABLE = "agent_crm_contacts"
+# Pipeline statuses since migration 028, and the ones 024 shipped with.
+CONTACT_STATUSES = ("analysis", "study", "quote", "purchase_order", "invoicing")
+LEGACY_CONTACT_STATUSES = ("draft", "sent", "won", "lost")
+# No auth.users row has this id, so a probe insert always fails; which error
+# comes back tells whether the status check passed.
+PROBE_OWNER_ID = "00000000-0000-0000-0000-000000000000"
+
+# Columns the scripts rely on that later migrations added.
+COLUMN_MIGRATIONS = {
+    ("agent_product_catalog", "datasheet_url"): "025_add_catalog_datasheet_url.sql",
+    ("agent_product_catalog", "model_key"): "030_add_catalog_model_key.sql",
+    ("agent_product_catalog", "row_version"): "033_add_catalog_row_version.sql",
+}
+
+# RPCs the scripts call, with the migration that creates them and arguments
+# that make a call a no-op.
+RPC_MIGRATIONS = {
+    "agent_catalog_merge_patch": ("032_create_catalog_merge_patch_rpc.sql", {"p_items": []}),
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(client: SupabaseRest, key, probe):
+    cache_key = (client.base_url, *key)
+    with _cache_lock:
+        if cache_key in _cache:
+            return _cache[cache_key]
+    value = probe()
+    with _cache_lock:
+        _cache[cache_key] = value
+    return value
+
+
+def _error_code(resp) -> str:
+    try:
+        return str((resp.json() or {}).get("code") or "")
+    except ValueError:
+        return ""
+
+
+def has_column(client: SupabaseRest, table: str, column: str) -> bool:
+    """Whether `table.column` exists, via an empty select (no rows read)."""
+
+    def probe():
+        resp = client.get(f"rest/v1/{table}", params={"select": column, "limit": "0"})
+        if resp.status_code == 400 and _error_code(resp) == "42703":
+            return False
+        request_ok(resp)
+        return True
+
+    return _cached(client, ("column", table, column), probe)
+
+
+def require_columns(client: SupabaseRest, table: str, columns):
+    """Fail fast, naming the migration, when a column from COLUMN_MIGRATIONS is missing."""
+    missing = [c for c in columns if (table, c) in COLUMN_MIGRATIONS and not has_column(client, table, c)]
+    if missing:
+        needed = ", ".join(f"{table}.{c} ({COLUMN_MIGRATIONS[(table, c)]})" for c in missing)
+        raise RuntimeError(f"Database is missing column(s) {needed}; apply the migration(s) first")
+
+
+def has_rpc(client: SupabaseRest, name: str) -> bool:
+    """Whether PostgREST exposes function `name`, via a no-op call."""
+
+    def probe():
+        resp = client.post(f"rest/v1/rpc/{name}", json_body=RPC_MIGRATIONS[name][1])
+        if resp.status_code == 404:
+            return False
+        request_ok(resp)
+        return True
+
+    return _cached(client, ("rpc", name), probe)
+
+
+def require_rpc(client: SupabaseRest, name: str):
+    """Fail fast, naming the migration, when an RPC from RPC_MIGRATIONS is missing."""
+    if not has_rpc(client, name):
+        raise RuntimeError(f"Database is missing function {name} ({RPC_MIGRATIONS[name][0]}); apply the migration first")
+
+
+def _status_allowed(client: SupabaseRest, status: str) -> bool:
+    row = {"created_by": PROBE_OWNER_ID, "contact_key": "schema-probe", "status": status}
+    resp = client.post(f"rest/v1/{CONTACTS_TABLE}", json_body=[row], headers={"Prefer": "return=minimal"})
+    code = _error_code(resp)
+    if code == "23514":
+        return False
+    if code == "23503":
+        return True
+    if 200 <= resp.status_code < 300:
+        # Only possible without the auth.users foreign key; do not leave the row behind.
+        client.delete(
+            f"rest/v1/{CONTACTS_TABLE}",
+            params={"created_by": f"eq.{PROBE_OWNER_ID}", "contact_key": "eq.schema-probe"},
+        )
+        return True
+    request_ok(resp)
+    raise RuntimeError(f"Unexpected response probing {CONTACTS_TABLE}.status: HTTP {resp.status_code} {resp.text[:300]}")
+
+
+def contact_statuses(client: SupabaseRest) -> tuple:
+    """The status set agent_crm_contacts accepts: the 028 one or the legacy
+    024 one, told apart by probing the first status of each."""
+
+    def probe():
+        if _status_allowed(client, CONTACT_STATUSES[0]):
+            return CONTACT_STATUSES
+        if _status_allowed(client, LEGACY_CONTACT_STATUSES[0]):
+            return LEGACY_CONTACT_STATUSES
+        raise RuntimeError(f"{CONTACTS_TABLE}.status accepts neither {CONTACT_STATUSES[0]!r} nor {LEGACY_CONTACT_STATUSES[0]!r}")
+
+    return _cached(client, ("contact_statuses",), probe)
+
+
+def initial_contact_status(client: SupabaseRest) -> str:
+    """"analysis" on databases with migration 028, else the legacy "draft"."""
+    return contact_statuses(client)[0]
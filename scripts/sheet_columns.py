@@ -0,0 +1,129 @@
+import csv
+import gzip
+import re
+import unicodedata
+from pathlib import Path
+
+import openpyxl
+
+
+# Delimited exports: .csv/.tsv/.txt, optionally gzip-compressed (.csv.gz).
+DELIMITED_SUFFIXES = {".csv": None, ".txt": None, ".tsv": "\t"}
+SNIFF_DELIMITERS = ",;\t|"  # ties go to the first
+SNIFF_BYTES = 64 * 1024
+
+
+def header_key(value) -> str:
+    """Compare headers ignoring case, accents, spacing and punctuation.
+
+    A mis-decoded accent (U+FFFD) just drops out, so list that spelling as an
+    alias when an export is known to carry it.
+    """
+    s = unicodedata.normalize("NFKD", str(value or ""))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return re.sub(r"[^a-z0-9]+", "", s.lower())
+
+
+def resolve_columns(headers, fields: dict, required=(), source: str = "sheet") -> dict:
+    """Resolve the header row once into {field: column index}.
+
+    `fields` maps each field to a header spelling or a tuple of aliases; the
+    first header matching any alias wins. Optional fields that are absent map
+    to None. Missing required fields raise with the headers that were found.
+    """
+    by_key = {}
+    for idx, header in enumerate(headers):
+        key = header_key(header)
+        if key:
+            by_key.setdefault(key, idx)
+
+    columns = {}
+    for field, aliases in fields.items():
+        if isinstance(aliases, str):
+            aliases = (aliases,)
+        columns[field] = next((by_key[header_key(a)] for a in aliases if header_key(a) in by_key), None)
+
+    missing = [field for field in required if columns.get(field) is None]
+    if missing:
+        expected = ", ".join(repr(h) for h in header_names(fields, missing))
+        found = ", ".join(repr(h) for h in headers if h not in (None, ""))
+        raise RuntimeError(f"{source}: missing column(s) {expected}; headers found: {found or '(none)'}")
+    return columns
+
+
+def header_names(fields: dict, names) -> list:
+    """Primary header spelling of each field in `names`."""
+    return [fields[f] if isinstance(fields[f], str) else fields[f][0] for f in names]
+
+
+def absent_fields(columns: dict) -> list:
+    return [field for field, idx in columns.items() if idx is None]
+
+
+def cell(row, idx):
+    """Value at `idx`, or None when the column is absent or the row is short."""
+    if idx is None or idx >= len(row):
+        return None
+    return row[idx]
+
+
+def sheet_format(path) -> tuple:
+    """(suffix, gzipped) for an export path, e.g. (".csv", True) for x.csv.gz."""
+    suffixes = [x.lower() for x in Path(path).suffixes]
+    gzipped = bool(suffixes) and suffixes[-1] == ".gz"
+    if gzipped:
+        suffixes = suffixes[:-1]
+    return (suffixes[-1] if suffixes else ""), gzipped
+
+
+def is_delimited(path) -> bool:
+    """Whether iter_sheet_rows reads `path` as CSV/TSV (cells come back as text)."""
+    return sheet_format(path)[0] in DELIMITED_SUFFIXES
+
+
+def _open_text(path, gzipped: bool):
+    """Open a delimited export as text. UTF-8 (with or without BOM) unless the
+    first block does not decode, in which case it is an Excel "CSV" save in
+    cp1252."""
+    opener = gzip.open if gzipped else open
+    with opener(path, "rb") as fh:
+        head = fh.read(SNIFF_BYTES)
+    encoding = "utf-8-sig"
+    try:
+        head.decode(encoding)
+    except UnicodeDecodeError as exc:
+        # A multi-byte character cut at the block edge is still UTF-8.
+        if exc.start < len(head) - 3:
+            encoding = "cp1252"
+    return opener(path, "rt", encoding=encoding, errors="replace", newline="")
+
+
+def _iter_delimited(path, delimiter, gzipped: bool):
+    with _open_text(path, gzipped) as fh:
+        if delimiter is None:
+            # Spanish-locale Excel saves ";"-separated CSV; the header row tells.
+            header = fh.readline()
+            fh.seek(0)
+            delimiter = max(SNIFF_DELIMITERS, key=header.count) if header else ","
+        yield from csv.reader(fh, delimiter=delimiter)
+
+
+def _iter_workbook(path):
+    wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
+    try:
+        yield from wb[wb.sheetnames[0]].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def iter_sheet_rows(path):
+    """Stream the rows (header included) of an XLSX, CSV or TSV export, the
+    delimited ones optionally gzipped. XLSX yields the first sheet with cell
+    values typed; delimited files yield lists of strings, which the importers'
+    normalizers already accept."""
+    suffix, gzipped = sheet_format(path)
+    if is_delimited(path):
+        return _iter_delimited(path, DELIMITED_SUFFIXES[suffix], gzipped)
+    if gzipped:
+        raise RuntimeError(f"Unsupported compressed export (expected .csv.gz or .tsv.gz): {path}")
+    return _iter_workbook(path)
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from array import array
+
+
+INSERT_BATCH = 5000
+
+
+class SpilledClusters:
+    """Union-find clustering with the rows and the identifier index on disk.
+
+    Same algorithm and output order as cluster_contacts in
+    import-crm-contacts-xlsx.py, but rows (as JSON) and the identifier ->
+    first row map live in a temporary sqlite3 database. Memory holds three
+    int64 slots per row (parent, size, cluster label) and sqlite's page cache.
+
+    Feed rows with add(), call finish() once, then iterate the merged rows
+    (as often as needed) and close() to delete the database.
+    """
+
+    def __init__(self, identity_keys, merge, directory: str = None, cache_mb: int = 64):
+        self.identity_keys = identity_keys
+        self.merge = merge
+        self._dir = tempfile.mkdtemp(prefix="crm-dedupe-", dir=directory)
+        self.db = sqlite3.connect(os.path.join(self._dir, "clusters.db"))
+        self.db.execute("pragma journal_mode = off")
+        self.db.execute("pragma synchronous = off")
+        self.db.execute(f"pragma cache_size = {-max(1, int(cache_mb)) * 1024}")
+        self.db.execute("create table rows (idx integer primary key, data text not null)")
+        self.db.execute("create table ids (key text primary key, idx integer not null) without rowid")
+        self.parent = array("q")
+        self.size = array("q")
+        self._pending = []
+        self.merged = 0
+
+    def _find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _flush(self):
+        if self._pending:
+            self.db.executemany("insert into rows (idx, data) values (?, ?)", self._pending)
+            self._pending = []
+
+    def add(self, row: dict):
+        i = len(self.parent)
+        self.parent.append(i)
+        self.size.append(1)
+        cur = self.db.cursor()
+        for key in self.identity_keys(row):
+            cur.execute("insert or ignore into ids (key, idx) values (?, ?)", (key, i))
+            if cur.rowcount:
+                continue
+            j = cur.execute("select idx from ids where key = ?", (key,)).fetchone()[0]
+            a, b = self._find(i), self._find(j)
+            if a != b:
+                if self.size[a] < self.size[b]:
+                    a, b = b, a
+                self.parent[b] = a
+                self.size[a] += self.size[b]
+        self._pending.append((i, json.dumps(row, ensure_ascii=False)))
+        if len(self._pending) >= INSERT_BATCH:
+            self._flush()
+
+    def finish(self):
+        """Label every row with the first row of its cluster, then merge the
+        clusters in first-row order into the `merged` table."""
+        self._flush()
+        n = len(self.parent)
+        label = array("q", [-1]) * n
+
+        def labels():
+            for i in range(n):
+                root = self._find(i)
+                if label[root] < 0:
+                    label[root] = i
+                yield i, label[root]
+
+        self.db.execute("create table clusters (idx integer primary key, label integer not null)")
+        self.db.executemany("insert into clusters (idx, label) values (?, ?)", labels())
+        self.db.execute("create index clusters_label on clusters (label, idx)")
+        self.db.execute("create table merged (seq integer primary key, data text not null)")
+
+        def merged():
+            group, current = [], None
+            rows = self.db.execute(
+                "select c.label, r.data from clusters c join rows r on r.idx = c.idx order by c.label, c.idx"
+            )
+            for lbl, data in rows:
+                if lbl != current and group:
+                    yield (json.dumps(self.merge(group), ensure_ascii=False),)
+                    group = []
+                current = lbl
+                group.append(json.loads(data))
+            if group:
+                yield (json.dumps(self.merge(group), ensure_ascii=False),)
+
+        self.db.executemany("insert into merged (data) values (?)", merged())
+        self.db.execute("drop table rows")
+        self.db.execute("drop table ids")
+        self.db.commit()
+        self.merged = self.db.execute("select count(*) from merged").fetchone()[0]
+        self.parent = self.size = None
+
+    def __len__(self):
+        return self.merged
+
+    def __iter__(self):
+        for (data,) in self.db.execute("select data from merged order by seq"):
+            yield json.loads(data)
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 16
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+def request_ok(resp: requests.Response, limit: int = 700):
+    if 200 <= resp.status_code < 300:
+        return
+    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:limit]}")
+
+
+def load_env_file(path: Path):
+    if not path.exists():
+        return
+    for raw in path.read_text(encoding="utf-8").splitlines():
+        line = raw.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        k, v = line.split("=", 1)
+        k = k.strip()
+        v = v.strip().strip('"').strip("'")
+        if k and k not in os.environ:
+            os.environ[k] = v
+
+
+def load_env():
+    """.env.local, then .env, from the working directory; the environment wins."""
+    root = Path.cwd()
+    load_env_file(root / ".env.local")
+    load_env_file(root / ".env")
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+class SupabaseRest:
+    """Keep-alive Supabase REST/storage client shared by the scripts/ sync tools.
+
+    One requests.Session with a pooled HTTPAdapter, so thousands of per-row
+    calls reuse a handful of TLS connections. Transient failures (connection
+    errors, 429/5xx) are retried with backoff; every call is timed and counted.
+    All writes issued by the scripts are keyed (id filter, on_conflict or
+    x-upsert), so retrying POST/PATCH is safe.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        service_key: str,
+        timeout_sec: float = DEFAULT_READ_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        backoff: float = 0.5,
+        verbose: bool = False,
+    ):
+        self.base_url = base_url.strip().rstrip("/")
+        self.service_key = service_key.strip()
+        self.timeout_sec = timeout_sec
+        self.verbose = verbose
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD", "POST", "PATCH", "PUT", "DELETE"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"apikey": self.service_key, "Authorization": f"Bearer {self.service_key}"})
+
+        self._lock = threading.Lock()
+        self._observers = []
+        self.stats = {"requests": 0, "retries": 0, "errors": 0, "elapsed_sec": 0.0, "by_method": {}}
+
+    @classmethod
+    def from_env(cls, timeout_sec: float = DEFAULT_READ_TIMEOUT, **kwargs):
+        base_url = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip().rstrip("/")
+        service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
+        if not base_url or not service_key:
+            raise RuntimeError("Missing SUPABASE_URL/NEXT_PUBLIC_SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
+        kwargs.setdefault("retries", env_int("SUPABASE_HTTP_RETRIES", DEFAULT_RETRIES))
+        kwargs.setdefault("pool_size", env_int("SUPABASE_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+        kwargs.setdefault("verbose", (os.getenv("SUPABASE_HTTP_VERBOSE") or "").strip().lower() in {"1", "true", "yes"})
+        return cls(base_url, service_key, timeout_sec=timeout_sec, **kwargs)
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, params=None, json_body=None, data=None, headers=None, timeout=None):
+        if json_body is not None:
+            data = json.dumps(json_body, ensure_ascii=False).encode("utf-8")
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        read_timeout = timeout if timeout is not None else self.timeout_sec
+
+        started = time.perf_counter()
+        try:
+            resp = self.session.request(
+                method,
+                self.url(path),
+                params=params,
+                data=data,
+                headers=headers,
+                timeout=(DEFAULT_CONNECT_TIMEOUT, read_timeout),
+            )
+        except requests.RequestException:
+            self._record(method, time.perf_counter() - started, 0, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+
+        retry_state = getattr(resp.raw, "retries", None)
+        history = getattr(retry_state, "history", None) or ()
+        retried = len(history)
+        throttled = resp.status_code in THROTTLE_STATUSES or any(getattr(h, "status", None) in THROTTLE_STATUSES for h in history)
+        self._record(method, elapsed, retried, error=resp.status_code >= 400)
+        for observer in list(self._observers):
+            observer(resp.status_code, elapsed, throttled)
+        if self.verbose:
+            print(f"[http] {method} {path} -> {resp.status_code} in {elapsed * 1000:.0f}ms" + (f" ({retried} retries)" if retried else ""))
+        return resp
+
+    def get(self, path: str, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path: str, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path: str, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def add_observer(self, fn):
+        with self._lock:
+            self._observers.append(fn)
+
+    def remove_observer(self, fn):
+        with self._lock:
+            if fn in self._observers:
+                self._observers.remove(fn)
+
+    def _record(self, method: str, elapsed: float, retried: int, error: bool):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["retries"] += retried
+            self.stats["elapsed_sec"] += elapsed
+            if error:
+                self.stats["errors"] += 1
+            per = self.stats["by_method"].setdefault(method, {"count": 0, "elapsed_sec": 0.0})
+            per["count"] += 1
+            per["elapsed_sec"] += elapsed
+
+    def stats_line(self) -> str:
+        s = self.stats
+        n = s["requests"]
+        avg_ms = (s["elapsed_sec"] / n * 1000) if n else 0.0
+        methods = ", ".join(f"{m} {v['count']}" for m, v in sorted(s["by_method"].items()))
+        return (
+            f"HTTP requests: {n} ({methods or '-'}), retries: {s['retries']}, errors: {s['errors']}, "
+            f"time: {s['elapsed_sec']:.2f}s, avg: {avg_ms:.0f}ms"
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class AdaptiveExecutor:
+    """Run independent write tasks (catalog batches, CRM batches, uploads) on a
+    bounded thread pool.
+
+    Concurrency follows AIMD: any 429/503 seen by the client halves the
+    in-flight limit, and every `increase_after` responses under
+    `target_latency_sec` add one slot back, up to `workers`. Tasks must touch
+    disjoint rows/objects so the end state matches the serial loop; results
+    come back in task order and the first task exception is re-raised after
+    in-flight work drains.
+    """
+
+    def __init__(self, client: SupabaseRest, workers: int = 4, target_latency_sec: float = 2.0, increase_after: int = 8):
+        self.client = client
+        self.max_workers = max(1, int(workers or 1))
+        self.target_latency_sec = target_latency_sec
+        self.increase_after = max(1, increase_after)
+        self.limit = self.max_workers
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._healthy = 0
+        self.last_run = {}
+
+    def _on_response(self, status: int, elapsed: float, throttled: bool):
+        with self._cond:
+            if throttled:
+                self.last_run["throttled"] = self.last_run.get("throttled", 0) + 1
+                self.limit = max(1, self.limit // 2)
+                self._healthy = 0
+            elif elapsed <= self.target_latency_sec and status < 500:
+                self._healthy += 1
+                if self._healthy >= self.increase_after and self.limit < self.max_workers:
+                    self.limit += 1
+                    self._healthy = 0
+            else:
+                self._healthy = 0
+            self._cond.notify_all()
+
+    def _acquire(self):
+        with self._cond:
+            while self._inflight >= self.limit:
+                self._cond.wait(0.5)
+            self._inflight += 1
+
+    def _release(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def _call(self, task):
+        try:
+            return task()
+        finally:
+            self._release()
+
+    def run(self, tasks):
+        """`tasks` may be a lazy iterable: tasks are pulled only as slots free
+        up, so a generator of batches is never materialized all at once."""
+        results = []
+        errors = []
+        self.last_run = {"tasks": 0, "throttled": 0}
+        requests_before = self.client.stats["requests"]
+        started = time.perf_counter()
+
+        def collect(futures, pending):
+            for fut in futures:
+                idx = pending.pop(fut)
+                if fut.exception() is not None:
+                    errors.append(fut.exception())
+                else:
+                    results[idx] = fut.result()
+
+        self.client.add_observer(self._on_response)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                pending = {}
+                for i, task in enumerate(tasks):
+                    results.append(None)
+                    self.last_run["tasks"] = i + 1
+                    self._acquire()
+                    pending[pool.submit(self._call, task)] = i
+                    collect([f for f in pending if f.done()], pending)
+                    if errors:
+                        break
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    collect(done, pending)
+        finally:
+            self.client.remove_observer(self._on_response)
+
+        elapsed = time.perf_counter() - started
+        reqs = self.client.stats["requests"] - requests_before
+        self.last_run.update(
+            {
+                "elapsed_sec": elapsed,
+                "requests": reqs,
+                "rps": reqs / elapsed if elapsed > 0 else 0.0,
+                "final_limit": self.limit,
+            }
+        )
+        if errors:
+            raise errors[0]
+        return results
+
+    def summary_line(self) -> str:
+        r = self.last_run
+        return (
+            f"Write executor: {r.get('tasks', 0)} tasks, {r.get('requests', 0)} requests in {r.get('elapsed_sec', 0.0):.2f}s "
+            f"({r.get('rps', 0.0):.1f} req/s), workers: {self.max_workers}, final limit: {r.get('final_limit', self.limit)}, "
+            f"throttled: {r.get('throttled', 0)}"
+        )
@@ -1,19 +1,123 @@
-import subprocess
-import sys
+import os
+from pathlib import Path
 
+from catalog_sync import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_PAGE_SIZE,
+    VERSION_COLUMN,
+    bulk_patch_catalog,
+    classify_patch,
+    diff_line,
+    expand_patch,
+    iter_catalog_rows_by_keys,
+    new_diff_counts,
+    report_failures,
+)
+from ohaus_sources import TEMPLATE_AUDIT_COLUMNS, audit_template, norm, parse_template_rows, report_template_audit, template_patch
+from supabase_rest import AdaptiveExecutor, SupabaseRest
 
-def run(cmd: list[str]):
-    print("Running:", " ".join(cmd))
-    proc = subprocess.run(cmd)
-    if proc.returncode != 0:
-        raise SystemExit(proc.returncode)
+
+SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
+DEFAULT_PROVIDER = "ohaus_colombia"
+DEFAULT_XLSX = "app/api/agents/channels/evolution/webhook-v2/plantilla_descripcion_cotizaciones_ohausfinal.xlsx"
+
+
+def load_env_file(path: Path):
+    if not path.exists():
+        return
+    for raw in path.read_text(encoding="utf-8").splitlines():
+        line = raw.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        k, v = line.split("=", 1)
+        k = k.strip()
+        v = v.strip().strip('"').strip("'")
+        if k and k not in os.environ:
+            os.environ[k] = v
+
+
+def load_env():
+    root = Path.cwd()
+    load_env_file(root / ".env.local")
+    load_env_file(root / ".env")
+
+
+def replan_template(row: dict, template: dict):
+    """Patch for a row re-read after a write conflict; None (drop it) when a
+    concurrent rename means it no longer matches a template model."""
+    tpl = template.get(norm(str(row.get("name") or "")))
+    return template_patch(row, tpl) if tpl else None
 
 
 def main():
-    py = sys.executable
-    run([py, "scripts/import-ohaus-quote-template-xlsx.py"])
-    run([py, "scripts/audit-ohaus-quote-template-sync.py"])
-    print("Sync + audit completed OK.")
+    load_env()
+    owner_id = (os.getenv("QUOTE_TEMPLATE_OWNER_ID") or SYSTEM_USER_ID).strip()
+    provider = (os.getenv("QUOTE_TEMPLATE_PROVIDER") or DEFAULT_PROVIDER).strip()
+    batch_size = int(os.getenv("QUOTE_TEMPLATE_BATCH_SIZE") or DEFAULT_BATCH_SIZE)
+    workers = int(os.getenv("QUOTE_TEMPLATE_WORKERS") or 4)
+    page_size = int(os.getenv("QUOTE_TEMPLATE_PAGE_SIZE") or DEFAULT_PAGE_SIZE)
+    max_errors = int(os.getenv("QUOTE_TEMPLATE_AUDIT_MAX_ERRORS") or 40)
+    dry_run = (os.getenv("QUOTE_TEMPLATE_DRY_RUN") or "false").strip().lower() in {"1", "true", "yes"}
+
+    xlsx_path = Path(os.getenv("QUOTE_TEMPLATE_XLSX") or DEFAULT_XLSX)
+    if not xlsx_path.is_absolute():
+        xlsx_path = Path.cwd() / xlsx_path
+    if not xlsx_path.exists():
+        raise RuntimeError(f"Template XLSX not found: {xlsx_path}")
+    client = SupabaseRest.from_env(timeout_sec=120)
+
+    template = parse_template_rows(xlsx_path)
+    filters = {"created_by": f"eq.{owner_id}", "provider": f"eq.{provider}"}
+
+    rows_by_key = {}
+    updates = []
+    catalog_count = 0
+    diff_counts = new_diff_counts()
+    for row in iter_catalog_rows_by_keys(client, (*TEMPLATE_AUDIT_COLUMNS, VERSION_COLUMN), filters, template.keys(), page_size=page_size):
+        catalog_count += 1
+        key = norm(str(row.get("name") or ""))
+        tpl = template.get(key)
+        if not tpl:
+            continue
+        rows_by_key[key] = row
+        patch_obj = template_patch(row, tpl)
+        status = classify_patch(row, expand_patch(row, patch_obj))
+        diff_counts[status] += 1
+        if status != "unchanged":
+            updates.append((row, patch_obj))
+
+    print(f"Template models: {len(template)}")
+    print(f"Catalog rows fetched for template models: {catalog_count}")
+    print(diff_line(diff_counts))
+    print(f"Rows to update: {len(updates)}")
+
+    if dry_run:
+        print("Dry run enabled, no DB write executed; auditing the current catalog.")
+    elif updates:
+        executor = AdaptiveExecutor(client, workers)
+        returned = []
+        written, failures = bulk_patch_catalog(
+            client,
+            updates,
+            batch_size,
+            executor,
+            returned=returned,
+            replan=lambda row: replan_template(row, template),
+        )
+        print(f"Updated rows: {written}")
+        print(executor.summary_line())
+        report_failures(failures)
+
+        # Audit the rows read above overlaid with what the upsert echoed back,
+        # instead of re-reading the catalog.
+        by_id = {r.get("id"): r for r in returned}
+        for key, row in rows_by_key.items():
+            if row.get("id") in by_id:
+                rows_by_key[key] = {**row, **by_id[row.get("id")]}
+
+    print(client.stats_line())
+    missing_models, mismatches = audit_template(template, rows_by_key)
+    report_template_audit(missing_models, mismatches, max_errors)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,272 @@
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from catalog_sync import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_PAGE_SIZE,
+    MERGE_PATCH_FUNCTION,
+    VERSION_COLUMN,
+    bulk_patch_catalog,
+    catalog_model_key,
+    classify_patch,
+    diff_line,
+    expand_patch,
+    iter_catalog_rows_by_keys,
+    merge_patch,
+    new_diff_counts,
+    report_failures,
+)
+from file_manifest import FileManifest
+from fx_rates import resolve_trm
+from ohaus_sources import (
+    SOURCE_ORDER,
+    asset_uploads,
+    assets_patch,
+    build_assets_index,
+    build_folder_index,
+    ensure_bucket,
+    parse_price_list_xlsx,
+    parse_template_rows,
+    price_list_patch,
+    public_object_url,
+    quote_is_clean,
+    quote_patch,
+    template_patch,
+)
+from quote_workbook import DEFAULT_MANIFEST, EXTRACT_VERSION, MANIFEST_NAMESPACE
+from schema_probe import require_rpc
+from supabase_rest import AdaptiveExecutor, SupabaseRest, load_env
+
+
+SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
+DEFAULT_PROVIDER = "ohaus_colombia"
+DEFAULT_PRICE_FILE = "app/api/agents/channels/evolution/webhook-v2/Lista de precios ohaus IA.xlsx"
+DEFAULT_TEMPLATE_XLSX = "app/api/agents/channels/evolution/webhook-v2/plantilla_descripcion_cotizaciones_ohausfinal.xlsx"
+DEFAULT_FOLDER = "app/api/agents/channels/evolution/webhook/Ohaus/Cotizaciones"
+DEFAULT_BUCKET = "ohaus-cotizaciones"
+# Union of what every source reads or diffs against.
+CATALOG_COLUMNS = (
+    "name",
+    "summary",
+    "description",
+    "source_payload",
+    "base_price_usd",
+    "price_currency",
+    "image_url",
+    "datasheet_url",
+    VERSION_COLUMN,
+)
+
+
+def resolve(path_str: str) -> Path:
+    path = Path(path_str)
+    return path if path.is_absolute() else Path.cwd() / path
+
+
+def parse_sources_arg(value: str):
+    names = [s.strip() for s in str(value or "").split(",") if s.strip()]
+    unknown = [s for s in names if s not in SOURCE_ORDER]
+    if unknown:
+        raise RuntimeError(f"Unknown source(s): {', '.join(unknown)}; expected any of {', '.join(SOURCE_ORDER)}")
+    return [s for s in SOURCE_ORDER if s in names]
+
+
+def main():
+    load_env()
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Refresh the OHAUS catalog from every source in one pass: one catalog read, one write per changed row. "
+            f"Sources are merged per model in precedence order {' < '.join(SOURCE_ORDER)} (later wins)."
+        )
+    )
+    parser.add_argument("--sources", default=os.getenv("OHAUS_SYNC_SOURCES", ",".join(SOURCE_ORDER)))
+    parser.add_argument("--price-file", default=os.getenv("OHAUS_PRICE_FILE", DEFAULT_PRICE_FILE))
+    parser.add_argument("--template-xlsx", default=os.getenv("QUOTE_TEMPLATE_XLSX") or DEFAULT_TEMPLATE_XLSX)
+    parser.add_argument("--folder", default=os.getenv("OHAUS_COTIZACIONES_FOLDER", DEFAULT_FOLDER))
+    parser.add_argument("--bucket", default=os.getenv("OHAUS_COTIZACIONES_BUCKET", DEFAULT_BUCKET))
+    parser.add_argument("--owner-id", default=os.getenv("QUOTE_TEMPLATE_OWNER_ID", SYSTEM_USER_ID))
+    parser.add_argument("--provider", default=os.getenv("QUOTE_TEMPLATE_PROVIDER", DEFAULT_PROVIDER))
+    parser.add_argument(
+        "--trm",
+        type=float,
+        default=float(os.getenv("OHAUS_SYNC_TRM") or 0) or None,
+        help="USD/COP rate. Default: latest agent_fx_rates rate for the owner (4200 with a warning if there is none)",
+    )
+    parser.add_argument("--http-timeout", type=float, default=float(os.getenv("OHAUS_SYNC_HTTP_TIMEOUT") or 90))
+    parser.add_argument("--manifest", default=os.getenv("OHAUS_COTIZACIONES_MANIFEST", DEFAULT_MANIFEST))
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest: re-parse and re-push every Cotizaciones file")
+    parser.add_argument("--parse-workers", type=int, default=int(os.getenv("OHAUS_PARSE_WORKERS") or 1))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("OHAUS_SYNC_WORKERS") or 4))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("OHAUS_SYNC_BATCH_SIZE") or DEFAULT_BATCH_SIZE))
+    parser.add_argument("--page-size", type=int, default=int(os.getenv("OHAUS_SYNC_PAGE_SIZE") or DEFAULT_PAGE_SIZE))
+    parser.add_argument("--apply", action="store_true", help="Upload assets and write changes. Default is dry-run")
+    args = parser.parse_args()
+
+    sources = parse_sources_arg(args.sources)
+    if not sources:
+        raise RuntimeError("No sources selected")
+
+    # Parsed input per source, keyed by catalog model_key.
+    inputs = {}
+    parse_started = time.perf_counter()
+
+    if "prices" in sources:
+        price_file = resolve(args.price_file)
+        if not price_file.exists():
+            raise RuntimeError(f"Price file not found: {price_file}")
+        inputs["prices"] = parse_price_list_xlsx(price_file)
+        print(f"Price list: {len(inputs['prices'])} models ({price_file.name})")
+
+    if "template" in sources:
+        template_xlsx = resolve(args.template_xlsx)
+        if not template_xlsx.exists():
+            raise RuntimeError(f"Template XLSX not found: {template_xlsx}")
+        inputs["template"] = {catalog_model_key(k): v for k, v in parse_template_rows(template_xlsx).items()}
+        print(f"Template: {len(inputs['template'])} models ({template_xlsx.name})")
+
+    manifest = None
+    dirty_keys = set()
+    if "cotizaciones" in sources or "assets" in sources:
+        folder = resolve(args.folder)
+        if not folder.exists():
+            raise RuntimeError(f"Folder not found: {folder}")
+        manifest = FileManifest(resolve(args.manifest), folder, MANIFEST_NAMESPACE, EXTRACT_VERSION, consumer="content")
+        if args.full:
+            manifest.reset()
+        if "cotizaciones" in sources:
+            by_key, total_xlsx, _parsed, dirty_keys = build_folder_index(folder, manifest, args.parse_workers)
+            inputs["cotizaciones"] = by_key
+            print(f"Cotizaciones: {len(by_key)} models from {total_xlsx} XLSX, {len(dirty_keys)} new/modified")
+        if "assets" in sources:
+            inputs["assets"] = build_assets_index(folder, manifest.for_consumer("assets"))
+            print(f"Assets: {len(inputs['assets'])} models")
+        print(manifest.stats_line())
+
+    print(f"Parse phase: {time.perf_counter() - parse_started:.2f}s")
+
+    keys = set()
+    for data in inputs.values():
+        keys.update(data.keys())
+
+    client = SupabaseRest.from_env(timeout_sec=args.http_timeout)
+    trm = resolve_trm(client, args.owner_id, args.trm) if {"prices", "cotizaciones"} & set(sources) else None
+    if args.apply:
+        # Before the bucket and the uploads, so a missing RPC leaves no objects without rows.
+        require_rpc(client, MERGE_PATCH_FUNCTION)
+        if "assets" in sources:
+            ensure_bucket(client, args.bucket)
+
+    def object_url(object_path: str) -> str:
+        if args.apply:
+            return public_object_url(client, args.bucket, object_path)
+        return f"(dry-run) {object_path}"
+
+    now_iso = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    filters = {"created_by": f"eq.{args.owner_id}", "provider": f"eq.{args.provider}"}
+
+    updates = []
+    uploads = []
+    pushed_assets = []
+    catalog_count = 0
+    matched_keys = set()
+    clean_rows = 0
+    touched = {s: 0 for s in sources}
+    diff_counts = new_diff_counts()
+
+    # Each source patches the result of the previous ones, so the row is
+    # read-modify-written once no matter how many sources touch it. Returns
+    # (combined patch, sources that patched the row, cotizaciones skipped as clean).
+    def plan_row(row):
+        key = catalog_model_key(row.get("name"))
+        working = dict(row)
+        combined = {}
+        touched_by = []
+        clean = False
+        for source in sources:
+            incoming = inputs[source].get(key)
+            if not incoming:
+                continue
+            if source == "prices":
+                patch_obj = price_list_patch(working, incoming, trm, now_iso)
+            elif source == "template":
+                patch_obj = template_patch(working, incoming)
+            elif source == "cotizaciones":
+                if quote_is_clean(working, key, incoming, dirty_keys):
+                    clean = True
+                    continue
+                patch_obj = quote_patch(working, incoming, trm, now_iso)
+            else:
+                patch_obj = assets_patch(working, key, incoming, object_url)
+            if not patch_obj:
+                continue
+            touched_by.append(source)
+            working = merge_patch(working, patch_obj)
+            combined = merge_patch(combined, patch_obj)
+        return combined, touched_by, clean
+
+    for row in iter_catalog_rows_by_keys(client, CATALOG_COLUMNS, filters, keys, page_size=args.page_size):
+        catalog_count += 1
+        key = catalog_model_key(row.get("name"))
+        matched_keys.add(key)
+
+        assets = inputs.get("assets", {}).get(key)
+        if assets:
+            pushed_assets.extend(p for p in (assets.get("pdf"), assets.get("xlsx")) if p)
+            if args.apply:
+                uploads.extend(asset_uploads(client, args.bucket, key, assets))
+
+        combined, touched_by, clean = plan_row(row)
+        clean_rows += int(clean)
+        for source in touched_by:
+            touched[source] += 1
+        if not combined:
+            continue
+        status = classify_patch(row, expand_patch(row, combined))
+        diff_counts[status] += 1
+        if status == "unchanged":
+            continue
+        updates.append((row, combined))
+
+    print(f"Input models: {len(keys)}")
+    print(f"Catalog rows fetched: {catalog_count}")
+    print(f"Input models not in catalog: {len(keys - matched_keys)}")
+    print("Rows touched per source: " + ", ".join(f"{s} {touched[s]}" for s in sources))
+    if "cotizaciones" in sources:
+        print(f"Cotizaciones rows skipped (XLSX unchanged since last push): {clean_rows}")
+    print(diff_line(diff_counts))
+    print(f"Rows to write: {len(updates)}")
+
+    if not args.apply:
+        # Manifest not saved: pruned entries of removed files must survive until --apply.
+        print("Dry run mode. Use --apply to upload assets and write changes.")
+        print(client.stats_line())
+        return
+
+    executor = AdaptiveExecutor(client, args.workers)
+    if uploads:
+        executor.run(uploads)
+        print(f"Uploaded objects: {len(uploads)}")
+        print(executor.summary_line())
+
+    written, failures = bulk_patch_catalog(client, updates, args.batch_size, executor, replan=lambda row: plan_row(row)[0])
+
+    if manifest is not None:
+        if not failures:
+            if "cotizaciones" in sources:
+                manifest.mark_pushed()
+            if "assets" in sources:
+                manifest.for_consumer("assets").mark_pushed(pushed_assets)
+        manifest.save()
+
+    print(f"Updated rows: {written}")
+    print(executor.summary_line())
+    print(client.stats_line())
+    report_failures(failures)
+
+
+if __name__ == "__main__":
+    main()
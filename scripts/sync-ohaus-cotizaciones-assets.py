@@ -1,21 +1,32 @@
 import argparse
-import json
-import mimetypes
 import os
-import re
 from pathlib import Path
 
-import openpyxl
-import requests
+from catalog_sync import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_PAGE_SIZE,
+    MERGE_PATCH_FUNCTION,
+    VERSION_COLUMN,
+    bulk_patch_catalog,
+    classify_patch,
+    diff_line,
+    expand_patch,
+    iter_catalog_rows_by_keys,
+    new_diff_counts,
+    report_failures,
+)
+from file_manifest import FileManifest
+from ohaus_sources import asset_uploads, assets_patch, build_assets_index, ensure_bucket, public_object_url
+from quote_workbook import DEFAULT_MANIFEST, EXTRACT_VERSION, MANIFEST_NAMESPACE, norm_model
+from schema_probe import require_rpc
+from supabase_rest import AdaptiveExecutor, SupabaseRest
 
 
 SYSTEM_USER_ID = "841263c6-196d-49cd-b5ba-aae0b097014f"
 DEFAULT_PROVIDER = "ohaus_colombia"
 DEFAULT_FOLDER = "app/api/agents/channels/evolution/webhook/Ohaus/Cotizaciones"
 DEFAULT_BUCKET = "ohaus-cotizaciones"
-
-
-MODEL_RE = re.compile(r"\b([A-Z]{1,5}\d[\dA-Z/-]{0,14})\b")
+CATALOG_COLUMNS = ("name", "source_payload", "image_url", "datasheet_url", VERSION_COLUMN)
 
 
 def load_env_file(path: Path):
@@ -38,234 +49,9 @@ def load_env():
     load_env_file(root / ".env")
 
 
-def norm_model(v: str) -> str:
-    return re.sub(r"[^A-Z0-9]", "", str(v or "").upper())
-
-
-def model_from_filename(file_name: str) -> str:
-    stem = Path(file_name).stem
-    clean = re.sub(r"^\d+\.", "", stem).strip()
-    clean = re.sub(r"\b(ficha|tecnica|tecnico|datasheet|data\s*sheet|cotizacion|cotizacion)\b", " ", clean, flags=re.I)
-    clean = re.sub(r"\s+", " ", clean).strip(" -_")
-    found = MODEL_RE.findall(clean.upper())
-    if found:
-        ranked = sorted(found, key=lambda x: (len(norm_model(x)), x.count("-"), x), reverse=True)
-        return ranked[0]
-    parts = [p for p in re.split(r"\s+", clean) if p]
-    return parts[-1].upper() if parts else ""
-
-
-def prefix_id_from_filename(file_name: str) -> str:
-    m = re.match(r"^(\d+)\.", str(file_name or "").strip())
-    return m.group(1) if m else ""
-
-
-def model_from_xlsx_cell(xlsx_path: Path) -> str:
-    try:
-        wb = openpyxl.load_workbook(xlsx_path, data_only=True, read_only=True)
-        ws = wb[wb.sheetnames[0]]
-        candidates = [
-            str(ws.cell(5, 2).value or "").strip(),
-            str(ws.cell(6, 2).value or "").strip(),
-            str(ws.cell(5, 4).value or "").strip(),
-        ]
-        wb.close()
-    except Exception:
-        return ""
-    for c in candidates:
-        m = MODEL_RE.findall(c.upper())
-        if m:
-            return m[0]
-    return ""
-
-
-def pick_embedded_product_image(xlsx_path: Path):
-    try:
-        wb = openpyxl.load_workbook(xlsx_path, data_only=True)
-        ws = wb[wb.sheetnames[0]]
-        images = list(getattr(ws, "_images", []) or [])
-        if not images:
-            wb.close()
-            return None
-
-        best = None
-        best_score = -10**9
-        for img in images:
-            w = int(getattr(img, "width", 0) or 0)
-            h = int(getattr(img, "height", 0) or 0)
-            if w <= 0 or h <= 0:
-                continue
-
-            anc = getattr(img, "anchor", None)
-            fr = getattr(anc, "_from", None)
-            row = int(getattr(fr, "row", 0) or 0)
-            col = int(getattr(fr, "col", 0) or 0)
-
-            area = w * h
-            ratio = w / max(1, h)
-            score = 0
-            if 3 <= row <= 16:
-                score += 60
-            if col <= 4:
-                score += 30
-            if 0.55 <= ratio <= 1.9:
-                score += 35
-            if w >= 220 and h >= 220:
-                score += 20
-            if w > 1000 and h < 700:
-                score -= 120
-            if row <= 1:
-                score -= 50
-            score += min(40, area // 6000)
-
-            if score > best_score:
-                best_score = score
-                best = img
-
-        if not best:
-            wb.close()
-            return None
-
-        raw = best._data()
-        ext = str(getattr(best, "path", "") or "").lower()
-        if ext.endswith(".jpg") or ext.endswith(".jpeg"):
-            suffix = ".jpg"
-        elif ext.endswith(".webp"):
-            suffix = ".webp"
-        else:
-            suffix = ".png"
-        wb.close()
-        return {"bytes": raw, "ext": suffix, "score": best_score}
-    except Exception:
-        return None
-
-
-def choose_best_pdf(files):
-    if not files:
-        return None
-    ranked = []
-    for p in files:
-        name = p.name.lower()
-        score = 0
-        if "ficha" in name:
-            score += 20
-        if "datasheet" in name or "data sheet" in name:
-            score += 12
-        if "manual" in name or "brochure" in name:
-            score -= 10
-        score -= len(name) // 40
-        ranked.append((score, p))
-    ranked.sort(key=lambda x: x[0], reverse=True)
-    return ranked[0][1]
-
-
-def build_assets_index(folder: Path):
-    by_key = {}
-    key_by_prefix = {}
-    for x in sorted(folder.glob("*.xlsx")):
-        model = model_from_xlsx_cell(x) or model_from_filename(x.name)
-        key = norm_model(model)
-        if not key:
-            continue
-        if key not in by_key:
-            by_key[key] = {"model": model, "xlsx": None, "pdfs": []}
-        by_key[key]["xlsx"] = x
-        pref = prefix_id_from_filename(x.name)
-        if pref:
-            key_by_prefix[pref] = key
-
-    for p in sorted(folder.glob("*.pdf")):
-        pref = prefix_id_from_filename(p.name)
-        key = key_by_prefix.get(pref, "") if pref else ""
-        model = ""
-        if not key:
-            model = model_from_filename(p.name)
-            key = norm_model(model)
-        if not key:
-            continue
-        if key not in by_key:
-            by_key[key] = {"model": model, "xlsx": None, "pdfs": []}
-        by_key[key]["pdfs"].append(p)
-
-    out = {}
-    for key, row in by_key.items():
-        pdf = choose_best_pdf(row.get("pdfs") or [])
-        out[key] = {
-            "model": row.get("model") or key,
-            "xlsx": row.get("xlsx"),
-            "pdf": pdf,
-        }
-    return out
-
-
-def request_ok(resp: requests.Response):
-    if 200 <= resp.status_code < 300:
-        return
-    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:800]}")
-
-
-def ensure_bucket(base_url: str, service_key: str, bucket: str):
-    url = f"{base_url}/storage/v1/bucket"
-    headers = {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {"id": bucket, "name": bucket, "public": True}
-    resp = requests.post(url, headers=headers, data=json.dumps(payload).encode("utf-8"), timeout=60)
-    if resp.status_code in (200, 201):
-        return
-    if resp.status_code in (400, 409):
-        return
-    request_ok(resp)
-
-
-def upload_object(base_url: str, service_key: str, bucket: str, object_path: str, blob: bytes, mime_type: str):
-    object_path = object_path.replace("\\", "/").lstrip("/")
-    url = f"{base_url}/storage/v1/object/{bucket}/{object_path}"
-    headers = {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": mime_type,
-        "x-upsert": "true",
-    }
-    resp = requests.post(url, headers=headers, data=blob, timeout=180)
-    if resp.status_code not in (200, 201):
-        request_ok(resp)
-    return f"{base_url}/storage/v1/object/public/{bucket}/{object_path}"
-
-
-def get_catalog_rows(base_url: str, service_key: str, owner_id: str, provider: str):
-    url = f"{base_url}/rest/v1/agent_product_catalog"
-    headers = {"apikey": service_key, "Authorization": f"Bearer {service_key}"}
-    params = {
-        "select": "id,name,source_payload,image_url,datasheet_url",
-        "created_by": f"eq.{owner_id}",
-        "provider": f"eq.{provider}",
-        "limit": "10000",
-    }
-    resp = requests.get(url, headers=headers, params=params, timeout=90)
-    request_ok(resp)
-    return resp.json() if resp.text else []
-
-
-def patch_catalog_row(base_url: str, service_key: str, row_id: str, patch_obj: dict):
-    url = f"{base_url}/rest/v1/agent_product_catalog"
-    headers = {
-        "apikey": service_key,
-        "Authorization": f"Bearer {service_key}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-    }
-    params = {"id": f"eq.{row_id}"}
-    resp = requests.patch(
-        url,
-        headers=headers,
-        params=params,
-        data=json.dumps(patch_obj, ensure_ascii=False).encode("utf-8"),
-        timeout=90,
-    )
-    request_ok(resp)
+def get_catalog_rows(client: SupabaseRest, owner_id: str, provider: str, keys, page_size: int = DEFAULT_PAGE_SIZE):
+    filters = {"created_by": f"eq.{owner_id}", "provider": f"eq.{provider}"}
+    return iter_catalog_rows_by_keys(client, CATALOG_COLUMNS, filters, keys, page_size=page_size)
 
 
 def main():
@@ -275,13 +61,15 @@ def main():
     parser.add_argument("--bucket", default=os.getenv("OHAUS_COTIZACIONES_BUCKET", DEFAULT_BUCKET))
     parser.add_argument("--owner-id", default=os.getenv("QUOTE_TEMPLATE_OWNER_ID", SYSTEM_USER_ID))
     parser.add_argument("--provider", default=os.getenv("QUOTE_TEMPLATE_PROVIDER", DEFAULT_PROVIDER))
+    parser.add_argument("--manifest", default=os.getenv("OHAUS_COTIZACIONES_MANIFEST", DEFAULT_MANIFEST))
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest: re-read and re-upload every file")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("OHAUS_SYNC_WORKERS") or 4))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("OHAUS_SYNC_BATCH_SIZE") or DEFAULT_BATCH_SIZE))
+    parser.add_argument("--page-size", type=int, default=int(os.getenv("OHAUS_SYNC_PAGE_SIZE") or DEFAULT_PAGE_SIZE))
     parser.add_argument("--apply", action="store_true", help="Apply changes (default dry-run)")
     args = parser.parse_args()
 
-    base_url = (os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL") or "").strip().rstrip("/")
-    service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
-    if not base_url or not service_key:
-        raise RuntimeError("Missing SUPABASE_URL/NEXT_PUBLIC_SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
+    client = SupabaseRest.from_env(timeout_sec=90)
 
     folder = Path(args.folder)
     if not folder.is_absolute():
@@ -289,82 +77,66 @@ def main():
     if not folder.exists():
         raise RuntimeError(f"Folder not found: {folder}")
 
-    index = build_assets_index(folder)
-    catalog = get_catalog_rows(base_url, service_key, args.owner_id, args.provider)
+    manifest_path = Path(args.manifest)
+    if not manifest_path.is_absolute():
+        manifest_path = Path.cwd() / manifest_path
+    manifest = FileManifest(manifest_path, folder, MANIFEST_NAMESPACE, EXTRACT_VERSION, consumer="assets")
+    if args.full:
+        manifest.reset()
+
+    index = build_assets_index(folder, manifest)
+    catalog = get_catalog_rows(client, args.owner_id, args.provider, index.keys(), args.page_size)
 
     print(f"Folder: {folder}")
     print(f"Models in folder index: {len(index)}")
-    print(f"Catalog rows: {len(catalog)}")
+    print(manifest.stats_line())
 
     if args.apply:
-        ensure_bucket(base_url, service_key, args.bucket)
+        # Before the bucket and the uploads, so a missing RPC leaves no objects without rows.
+        require_rpc(client, MERGE_PATCH_FUNCTION)
+        ensure_bucket(client, args.bucket)
+
+    def object_url(object_path: str) -> str:
+        if args.apply:
+            return public_object_url(client, args.bucket, object_path)
+        return f"(dry-run) {object_path}"
 
     updates = []
+    uploads = []
+    pushed_files = []
     misses = 0
-    missed_models = []
+    catalog_count = 0
+    matched_keys = set()
+    diff_counts = new_diff_counts()
     for row in catalog:
+        catalog_count += 1
         model = str(row.get("name") or "").strip()
         key = norm_model(model)
         assets = index.get(key)
         if not assets:
             misses += 1
-            missed_models.append(model)
             continue
+        matched_keys.add(key)
 
-        pdf_path = assets.get("pdf")
-        xlsx_path = assets.get("xlsx")
-        next_datasheet_url = ""
-        next_image_url = ""
-
-        if args.apply and pdf_path and pdf_path.exists():
-            pdf_bytes = pdf_path.read_bytes()
-            next_datasheet_url = upload_object(
-                base_url,
-                service_key,
-                args.bucket,
-                f"datasheets/{key}.pdf",
-                pdf_bytes,
-                "application/pdf",
-            )
-        elif pdf_path:
-            next_datasheet_url = f"(dry-run) datasheets/{key}.pdf"
+        pushed_files.extend(p for p in (assets.get("pdf"), assets.get("xlsx")) if p)
+        if args.apply:
+            uploads.extend(asset_uploads(client, args.bucket, key, assets))
 
-        img = pick_embedded_product_image(xlsx_path) if xlsx_path and xlsx_path.exists() else None
-        if args.apply and img:
-            ext = str(img.get("ext") or ".png")
-            mime = mimetypes.types_map.get(ext.lower(), "image/png")
-            next_image_url = upload_object(
-                base_url,
-                service_key,
-                args.bucket,
-                f"images/{key}{ext}",
-                img.get("bytes") or b"",
-                mime,
-            )
-        elif img:
-            next_image_url = f"(dry-run) images/{key}{str(img.get('ext') or '.png')}"
-
-        patch_obj = {}
-        if next_datasheet_url:
-            patch_obj["datasheet_url"] = next_datasheet_url
-        if next_image_url:
-            patch_obj["image_url"] = next_image_url
-
-        source_payload = row.get("source_payload") if isinstance(row.get("source_payload"), dict) else {}
+        patch_obj = assets_patch(row, key, assets, object_url)
         if patch_obj:
-            patch_obj["source_payload"] = {
-                **source_payload,
-                "import_source": "Ohaus/Cotizaciones assets",
-                "quote_model": assets.get("model") or model,
-                "quote_xlsx_file": xlsx_path.name if xlsx_path else source_payload.get("quote_xlsx_file"),
-                "quote_pdf_file": pdf_path.name if pdf_path else source_payload.get("quote_pdf_file"),
-            }
-            updates.append((str(row.get("id")), model, patch_obj, bool(pdf_path), bool(img)))
+            status = classify_patch(row, expand_patch(row, patch_obj))
+            diff_counts[status] += 1
+            if status == "unchanged":
+                continue
+            updates.append((row, model, patch_obj, "datasheet_url" in patch_obj, "image_url" in patch_obj))
 
-    print(f"Catalog rows matched: {len(catalog) - misses}")
-    print(f"Catalog rows without folder match: {misses}")
+    missed_models = [index[k].get("model") or k for k in index if k not in matched_keys]
+    print(f"Catalog rows fetched for folder models: {catalog_count}")
+    print(f"Catalog rows matched: {catalog_count - misses}")
+    print(f"Folder models not in catalog: {len(missed_models)}")
     if missed_models:
         print("Missing models:", ", ".join(sorted(missed_models)[:12]))
+    print(diff_line(diff_counts))
     print(f"Rows prepared to update: {len(updates)}")
     print(f"Rows with PDF: {sum(1 for _, _, _, has_pdf, _ in updates if has_pdf)}")
     print(f"Rows with image from XLSX: {sum(1 for _, _, _, _, has_img in updates if has_img)}")
@@ -374,13 +146,31 @@ def main():
         print("Sample model:", sample[1])
 
     if not args.apply:
+        # Manifest not saved: pruned entries of removed files must survive until --apply.
         print("Dry run mode. Use --apply to upload and patch DB.")
+        print(client.stats_line())
         return
 
-    for row_id, _model, patch_obj, _has_pdf, _has_img in updates:
-        patch_catalog_row(base_url, service_key, row_id, patch_obj)
+    executor = AdaptiveExecutor(client, args.workers)
+    executor.run(uploads)
+    print(f"Uploaded objects: {len(uploads)}")
+    print(executor.summary_line())
+
+    def replan(row):
+        key = norm_model(str(row.get("name") or ""))
+        return assets_patch(row, key, index[key], object_url) if key in index else None
+
+    items = [(row, patch_obj) for row, _model, patch_obj, _has_pdf, _has_img in updates]
+    written, failures = bulk_patch_catalog(client, items, args.batch_size, executor, replan=replan)
+
+    if not failures:
+        manifest.mark_pushed(pushed_files)
+    manifest.save()
 
-    print(f"Updated rows: {len(updates)}")
+    print(f"Updated rows: {written}")
+    print(executor.summary_line())
+    print(client.stats_line())
+    report_failures(failures)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+import posixpath
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from xml.etree import ElementTree as ET
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+
+NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+    "xdr": "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+}
+R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+# openpyxl walks anchors grouped by type in this order; keep it so ties resolve the same way.
+ANCHOR_TAGS = ("absoluteAnchor", "oneCellAnchor", "twoCellAnchor")
+
+
+def read_rels(zf: zipfile.ZipFile, part: str) -> dict:
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+    if rels_path not in zf.NameToInfo:
+        return {}
+    out = {}
+    for rel in ET.fromstring(zf.read(rels_path)).findall("rel:Relationship", NS):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target") or ""
+        target = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        out[rel.get("Id")] = (rel.get("Type") or "", target)
+    return out
+
+
+def first_sheet_part(zf: zipfile.ZipFile) -> str:
+    workbook = next((t for typ, t in read_rels(zf, "").values() if typ.endswith("/officeDocument")), "xl/workbook.xml")
+    sheet = ET.fromstring(zf.read(workbook)).find("main:sheets/main:sheet", NS)
+    if sheet is None:
+        return ""
+    return read_rels(zf, workbook).get(sheet.get(R_ID), ("", ""))[1]
+
+
+def iter_sheet_pictures(zf: zipfile.ZipFile, sheet_part: str):
+    """Yield (media_part, anchor_row, anchor_col) for pictures drawn on a sheet.
+
+    Rows/cols are the 0-based <xdr:from> cell, as openpyxl exposes them on
+    anchor._from; absolute anchors report 0/0.
+    """
+    for typ, drawing in read_rels(zf, sheet_part).values():
+        if not typ.endswith("/drawing") or drawing not in zf.NameToInfo:
+            continue
+        rels = read_rels(zf, drawing)
+        root = ET.fromstring(zf.read(drawing))
+        for tag in ANCHOR_TAGS:
+            for anchor in root.findall(f"xdr:{tag}", NS):
+                pic = anchor.find("xdr:pic", NS)
+                if pic is None:
+                    pic = anchor.find("xdr:grpSp/xdr:pic", NS)
+                blip = pic.find("xdr:blipFill/a:blip", NS) if pic is not None else None
+                rel = rels.get(blip.get(R_EMBED)) if blip is not None else None
+                if not rel or not rel[0].endswith("/image") or rel[1] not in zf.NameToInfo:
+                    continue
+                fr = anchor.find("xdr:from", NS)
+                row = int(fr.findtext("xdr:row", "0", NS)) if fr is not None else 0
+                col = int(fr.findtext("xdr:col", "0", NS)) if fr is not None else 0
+                yield rel[1], row, col
+
+
+def image_header(zf: zipfile.ZipFile, media_part: str):
+    """Return (format, width, height) reading only the image header from the zip stream."""
+    with zf.open(media_part) as fh:
+        with PILImage.open(fh) as img:
+            return (img.format or "png").lower(), int(img.width), int(img.height)
+
+
+def score_image(w: int, h: int, row: int, col: int) -> int:
+    area = w * h
+    ratio = w / max(1, h)
+    score = 0
+    if 3 <= row <= 16:
+        score += 60
+    if col <= 4:
+        score += 30
+    if 0.55 <= ratio <= 1.9:
+        score += 35
+    if w >= 220 and h >= 220:
+        score += 20
+    if w > 1000 and h < 700:
+        score -= 120
+    if row <= 1:
+        score -= 50
+    score += min(40, area // 6000)
+    return score
+
+
+def suffix_for_format(fmt: str) -> str:
+    if fmt in ("jpg", "jpeg"):
+        return ".jpg"
+    if fmt == "webp":
+        return ".webp"
+    return ".png"
+
+
+def image_bytes(zf: zipfile.ZipFile, media_part: str, fmt: str) -> bytes:
+    raw = zf.read(media_part)
+    if fmt in ("gif", "jpeg", "png"):
+        return raw
+    out = BytesIO()
+    with PILImage.open(BytesIO(raw)) as img:
+        img.save(out, format="png")
+    return out.getvalue()
+
+
+def pick_product_image(xlsx_path: Path, with_bytes: bool = True):
+    """Pick the product photo embedded in a quote workbook's first sheet.
+
+    Reads the drawing XML and xl/media headers straight from the .xlsx zip;
+    only the winning image is decompressed in full, and only when
+    `with_bytes` is set. Scoring, tie-breaking and byte output match the
+    openpyxl (ws._images) implementation it replaces: gif/jpeg/png bytes are
+    returned as stored, other formats re-encoded as PNG.
+    """
+    if PILImage is None:
+        return None
+    with zipfile.ZipFile(xlsx_path) as zf:
+        sheet_part = first_sheet_part(zf)
+        if not sheet_part:
+            return None
+
+        best = None
+        best_score = -10**9
+        for media_part, row, col in iter_sheet_pictures(zf, sheet_part):
+            try:
+                fmt, w, h = image_header(zf, media_part)
+            except Exception:
+                continue
+            if fmt == "wmf" or w <= 0 or h <= 0:
+                continue
+            score = score_image(w, h, row, col)
+            if score > best_score:
+                best_score = score
+                best = (media_part, fmt)
+
+        if not best:
+            return None
+
+        media_part, fmt = best
+        out = {"ext": suffix_for_format(fmt), "score": best_score, "media": media_part, "format": fmt}
+        if with_bytes:
+            out["bytes"] = image_bytes(zf, media_part, fmt)
+        return out
@@ -0,0 +1,9 @@
+-- Normalized model key for targeted catalog lookups from the OHAUS sync scripts.
+-- Same normalization as norm_model() in scripts/: uppercase, keep only A-Z and 0-9.
+
+alter table if exists agent_product_catalog
+  add column if not exists model_key text
+  generated always as (regexp_replace(upper(coalesce(name, '')), '[^A-Z0-9]', '', 'g')) stored;
+
+create index if not exists idx_agent_product_catalog_owner_provider_model_key
+  on agent_product_catalog(created_by, provider, model_key);
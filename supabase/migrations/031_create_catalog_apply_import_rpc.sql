@@ -0,0 +1,98 @@
+-- Apply a price-list import diff to agent_product_catalog in one transaction.
+-- scripts/import-ohaus-pricelist-xlsx.py computes the diff (new, changed and
+-- removed models keyed on tenant_id + product_url) and sends it here, so the
+-- quoting bot reads either the previous catalog or the new one, never a mix.
+-- The result carries the rows actually written; inserts whose product_url is
+-- already taken in the tenant (another owner or provider, or a concurrent
+-- import) are not written and come back in "skipped". The tenant is matched
+-- with "is not distinct from" so rows without a tenant are found too.
+
+create or replace function agent_catalog_apply_import(
+  p_tenant_id uuid,
+  p_created_by uuid,
+  p_provider text,
+  p_insert jsonb default '[]'::jsonb,
+  p_update jsonb default '[]'::jsonb,
+  p_deactivate uuid[] default '{}'
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_inserted integer := 0;
+  v_updated integer := 0;
+  v_deactivated integer := 0;
+  v_skipped text[];
+begin
+  with incoming as (
+    select r.*
+    from jsonb_populate_recordset(null::agent_product_catalog, coalesce(p_insert, '[]'::jsonb)) r
+  ),
+  inserted as (
+    insert into agent_product_catalog (
+      tenant_id, created_by, provider, brand, category, name, slug, product_url,
+      image_url, summary, description, standards, methods, specs_text, specs_json,
+      source_payload, is_active, base_price_usd, price_currency, last_price_update, datasheet_url
+    )
+    select
+      p_tenant_id, p_created_by, p_provider, r.brand, r.category, r.name, r.slug, r.product_url,
+      r.image_url, r.summary, r.description, coalesce(r.standards, '{}'), coalesce(r.methods, '{}'),
+      r.specs_text, coalesce(r.specs_json, '{}'::jsonb), coalesce(r.source_payload, '{}'::jsonb),
+      coalesce(r.is_active, true), r.base_price_usd, coalesce(r.price_currency, 'USD'),
+      r.last_price_update, r.datasheet_url
+    from incoming r
+    where not exists (
+      select 1
+      from agent_product_catalog c
+      where c.tenant_id is not distinct from p_tenant_id
+        and c.product_url = r.product_url
+    )
+    on conflict (tenant_id, product_url) do nothing
+    returning product_url
+  )
+  select
+    (select count(*) from inserted),
+    coalesce(
+      (
+        select array_agg(i.product_url order by i.product_url)
+        from incoming i
+        where not exists (select 1 from inserted n where n.product_url = i.product_url)
+      ),
+      '{}'
+    )
+  into v_inserted, v_skipped;
+
+  -- Each update item is {"id": ..., "patch": {...}}; columns absent from the
+  -- patch keep their current value.
+  update agent_product_catalog c
+  set (brand, category, name, slug, specs_text, specs_json, source_payload, is_active, base_price_usd, updated_at) = (
+    select r.brand, r.category, r.name, r.slug, r.specs_text, r.specs_json, r.source_payload, r.is_active, r.base_price_usd, now()
+    from jsonb_populate_record(c, u.item->'patch') r
+  )
+  from jsonb_array_elements(coalesce(p_update, '[]'::jsonb)) as u(item)
+  where c.id = (u.item->>'id')::uuid
+    and c.tenant_id is not distinct from p_tenant_id
+    and c.created_by = p_created_by
+    and c.provider = p_provider;
+  get diagnostics v_updated = row_count;
+
+  update agent_product_catalog c
+  set is_active = false, updated_at = now()
+  where c.id = any(coalesce(p_deactivate, '{}'))
+    and c.tenant_id is not distinct from p_tenant_id
+    and c.created_by = p_created_by
+    and c.provider = p_provider
+    and c.is_active;
+  get diagnostics v_deactivated = row_count;
+
+  return jsonb_build_object(
+    'inserted', v_inserted,
+    'updated', v_updated,
+    'deactivated', v_deactivated,
+    'skipped', to_jsonb(v_skipped)
+  );
+end;
+$$;
+
+revoke execute on function agent_catalog_apply_import(uuid, uuid, text, jsonb, jsonb, uuid[]) from public, anon, authenticated;
+grant execute on function agent_catalog_apply_import(uuid, uuid, text, jsonb, jsonb, uuid[]) to service_role;
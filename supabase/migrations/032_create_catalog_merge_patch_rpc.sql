@@ -0,0 +1,59 @@
+-- Partial updates for agent_product_catalog from the OHAUS sync scripts.
+-- Each sync sends only the source_payload keys it owns (e.g.
+-- {"prices_cop": {"bogota": ...}}) and they are deep-merged into the stored
+-- document here, so concurrent syncs no longer overwrite each other's keys
+-- and the full payload is not shipped back and forth.
+
+-- Objects merge key by key, recursively; any other patch value (including
+-- JSON null) replaces the stored one. A SQL NULL patch leaves `a` unchanged.
+-- Mirrored by deep_merge() in scripts/catalog_sync.py.
+create or replace function jsonb_deep_merge(a jsonb, b jsonb)
+returns jsonb
+language plpgsql
+immutable
+as $$
+declare
+  k text;
+  v jsonb;
+  merged jsonb;
+begin
+  if b is null then
+    return a;
+  end if;
+  if jsonb_typeof(a) is distinct from 'object' or jsonb_typeof(b) <> 'object' then
+    return b;
+  end if;
+  merged := a;
+  for k, v in select key, value from jsonb_each(b) loop
+    if jsonb_typeof(merged->k) = 'object' and jsonb_typeof(v) = 'object' then
+      merged := jsonb_set(merged, array[k], jsonb_deep_merge(merged->k, v));
+    else
+      merged := merged || jsonb_build_object(k, v);
+    end if;
+  end loop;
+  return merged;
+end;
+$$;
+
+-- p_items is [{"id": ..., "patch": {...}}, ...]. Columns absent from a patch
+-- keep their current value; source_payload is deep-merged. Returns the
+-- updated rows so callers can verify the write without re-reading.
+create or replace function agent_catalog_merge_patch(p_items jsonb)
+returns setof agent_product_catalog
+language sql
+as $$
+  update agent_product_catalog c
+  set (summary, description, image_url, datasheet_url, base_price_usd, price_currency, last_price_update, source_payload, updated_at) = (
+    select
+      r.summary, r.description, r.image_url, r.datasheet_url, r.base_price_usd, r.price_currency, r.last_price_update,
+      jsonb_deep_merge(coalesce(c.source_payload, '{}'::jsonb), u.item->'patch'->'source_payload'),
+      now()
+    from jsonb_populate_record(c, (u.item->'patch') - 'source_payload') r
+  )
+  from jsonb_array_elements(coalesce(p_items, '[]'::jsonb)) as u(item)
+  where c.id = (u.item->>'id')::uuid
+  returning c.*;
+$$;
+
+revoke execute on function agent_catalog_merge_patch(jsonb) from public, anon, authenticated;
+grant execute on function agent_catalog_merge_patch(jsonb) to service_role;
@@ -0,0 +1,45 @@
+-- Optimistic concurrency for agent_product_catalog writers.
+-- row_version is bumped by a trigger on every update, whoever the writer is,
+-- so the OHAUS syncs can send the version they read and detect a concurrent
+-- write instead of overwriting it. This is what lets them run in parallel.
+
+alter table if exists agent_product_catalog
+  add column if not exists row_version bigint not null default 0;
+
+create or replace function bump_agent_product_catalog_row_version()
+returns trigger as $$
+begin
+  new.row_version = old.row_version + 1;
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists bump_agent_product_catalog_row_version on agent_product_catalog;
+create trigger bump_agent_product_catalog_row_version
+  before update on agent_product_catalog
+  for each row execute function bump_agent_product_catalog_row_version();
+
+-- Same as 032, plus an optional "version" per item: the item only applies if
+-- the row still has that row_version. Items that do not come back in the
+-- result were skipped (conflict or deleted row); the caller re-reads and
+-- re-plans them.
+create or replace function agent_catalog_merge_patch(p_items jsonb)
+returns setof agent_product_catalog
+language sql
+as $$
+  update agent_product_catalog c
+  set (summary, description, image_url, datasheet_url, base_price_usd, price_currency, last_price_update, source_payload, updated_at) = (
+    select
+      r.summary, r.description, r.image_url, r.datasheet_url, r.base_price_usd, r.price_currency, r.last_price_update,
+      jsonb_deep_merge(coalesce(c.source_payload, '{}'::jsonb), u.item->'patch'->'source_payload'),
+      now()
+    from jsonb_populate_record(c, (u.item->'patch') - 'source_payload') r
+  )
+  from jsonb_array_elements(coalesce(p_items, '[]'::jsonb)) as u(item)
+  where c.id = (u.item->>'id')::uuid
+    and (u.item->'version' is null or c.row_version = (u.item->>'version')::bigint)
+  returning c.*;
+$$;
+
+revoke execute on function agent_catalog_merge_patch(jsonb) from public, anon, authenticated;
+grant execute on function agent_catalog_merge_patch(jsonb) to service_role;
@@ -0,0 +1,44 @@
+-- Re-derive base_price_usd from the COP list prices for a whole provider in
+-- one statement, so a daily TRM move does not need one PATCH per product.
+-- Used by `scripts/sync-ohaus-prices-from-list.py --recompute-usd`.
+-- The reference price is the same one the sync scripts use: Bogota, then
+-- Antioquia, then Distribuidor.
+
+create or replace function agent_catalog_recompute_usd(p_created_by uuid, p_provider text, p_trm numeric)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_updated integer := 0;
+begin
+  if p_trm is null or p_trm <= 0 then
+    raise exception 'p_trm must be a positive rate, got %', p_trm;
+  end if;
+
+  with priced as (
+    select c.id, round(ref.price_cop / p_trm, 2) as usd
+    from agent_product_catalog c
+    cross join lateral (
+      select coalesce(
+        nullif(case when jsonb_typeof(c.source_payload->'prices_cop'->'bogota') = 'number' then (c.source_payload->'prices_cop'->>'bogota')::numeric end, 0),
+        nullif(case when jsonb_typeof(c.source_payload->'prices_cop'->'antioquia') = 'number' then (c.source_payload->'prices_cop'->>'antioquia')::numeric end, 0),
+        nullif(case when jsonb_typeof(c.source_payload->'prices_cop'->'distribuidor') = 'number' then (c.source_payload->'prices_cop'->>'distribuidor')::numeric end, 0)
+      ) as price_cop
+    ) ref
+    where c.created_by = p_created_by
+      and c.provider = p_provider
+      and ref.price_cop > 0
+  )
+  update agent_product_catalog c
+  set base_price_usd = priced.usd, price_currency = 'USD', last_price_update = now(), updated_at = now()
+  from priced
+  where c.id = priced.id
+    and c.base_price_usd is distinct from priced.usd;
+  get diagnostics v_updated = row_count;
+
+  return jsonb_build_object('updated', v_updated, 'trm', p_trm);
+end;
+$$;
+
+revoke execute on function agent_catalog_recompute_usd(uuid, text, numeric) from public, anon, authenticated;
+grant execute on function agent_catalog_recompute_usd(uuid, text, numeric) to service_role;
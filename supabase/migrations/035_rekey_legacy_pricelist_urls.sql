@@ -0,0 +1,85 @@
+-- One-off: re-key price-list rows that still carry a row-number product_url.
+-- The importer used to give the second and later entries of a model
+-- ".../modelo/{model}-{sheet row}", which changed whenever rows moved. It now
+-- gives every entry of a repeated model ".../modelo/{model}--{variant}", the
+-- variant being the slug of family, capacity and resolution (variant_slug()
+-- in scripts/import-ohaus-pricelist-xlsx.py), with -2, -3... for entries that
+-- are identical on those fields. The importer matches stored rows on content,
+-- so this only brings the old URLs in line; ids are kept.
+--
+-- Every row of a model that has a legacy row is re-keyed, the plain
+-- ".../modelo/{model}" one included. Rows whose new URL is already taken in
+-- the tenant are left as they are.
+
+with pricelist as (
+  select
+    c.id,
+    c.tenant_id,
+    c.created_by,
+    c.provider,
+    c.name,
+    case
+      when c.product_url = 'https://catalogo.ohaus.local/modelo/' || c.name then 0
+      else substring(c.product_url from length('https://catalogo.ohaus.local/modelo/' || c.name || '-') + 1)::bigint
+    end as sheet_row,
+    coalesce(
+      nullif(
+        left(
+          trim(both '-' from regexp_replace(
+            lower(concat_ws(' ',
+              nullif(c.source_payload->>'family', ''),
+              nullif(c.source_payload->>'capacity', ''),
+              nullif(c.source_payload->>'resolution', ''))),
+            '[^a-z0-9]+', '-', 'g')),
+          140),
+        ''),
+      'variante'
+    ) as variant
+  from agent_product_catalog c
+  where c.source_payload->>'import_source' = 'Lista de precios ohaus IA y productos .xlsx'
+    and (
+      c.product_url = 'https://catalogo.ohaus.local/modelo/' || c.name
+      or (
+        left(c.product_url, length('https://catalogo.ohaus.local/modelo/' || c.name || '-'))
+          = 'https://catalogo.ohaus.local/modelo/' || c.name || '-'
+        and substring(c.product_url from length('https://catalogo.ohaus.local/modelo/' || c.name || '-') + 1) ~ '^[0-9]+$'
+      )
+    )
+),
+legacy_models as (
+  select distinct tenant_id, created_by, provider, name
+  from pricelist
+  where sheet_row > 0
+),
+numbered as (
+  select
+    p.id,
+    p.tenant_id,
+    'https://catalogo.ohaus.local/modelo/' || p.name || '--' || p.variant as base_url,
+    row_number() over (
+      partition by p.tenant_id, p.name, p.variant
+      order by p.created_by, p.provider, p.sheet_row
+    ) as n
+  from pricelist p
+  join legacy_models m
+    on m.tenant_id is not distinct from p.tenant_id
+   and m.created_by = p.created_by
+   and m.provider = p.provider
+   and m.name = p.name
+),
+target as (
+  select id, tenant_id, case when n = 1 then base_url else base_url || '-' || n end as product_url
+  from numbered
+)
+update agent_product_catalog c
+set product_url = t.product_url, updated_at = now()
+from target t
+where c.id = t.id
+  and c.product_url <> t.product_url
+  and not exists (
+    select 1
+    from agent_product_catalog o
+    where o.tenant_id is not distinct from t.tenant_id
+      and o.product_url = t.product_url
+      and o.id <> t.id
+  );
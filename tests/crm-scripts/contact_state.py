@@ -0,0 +1,72 @@
+"""Checks for the CRM import's incremental state (scripts/contact_state.py).
+
+Run with: python tests/crm-scripts/contact_state.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from contact_state import ContactState  # noqa: E402
+
+
+def contact(key, name, row_number=2):
+    return {"contact_key": key, "name": name, "metadata": {"row_number": row_number, "source_file": "a.xlsx"}}
+
+
+def open_state(path, target="https://a.supabase.co"):
+    return ContactState(path, target, "owner", "tenant")
+
+
+def run():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "crm" / "state.sqlite3"
+
+        state = open_state(path)
+        assert [state.record(contact(k, k)) for k in ("a", "b", "c")] == ["new", "new", "new"]
+        assert state.needs_push(contact("a", "a"))
+        state.save()
+        state.close()
+
+        # Moved rows are unchanged, edits are changed, dropped contacts leave the state.
+        state = open_state(path)
+        assert state.record(contact("a", "a", row_number=40)) == "unchanged"
+        assert state.record(contact("b", "B")) == "changed"
+        assert state.record(contact("d", "d")) == "new"
+        assert not state.needs_push(contact("a", "a", row_number=40))
+        assert state.needs_push(contact("b", "B")) and state.needs_push(contact("d", "d"))
+        state.close()  # not saved, like a dry run or a failed push
+
+        state = open_state(path)
+        assert state.record(contact("b", "B")) == "changed"
+        state.save()
+        state.close()
+        state = open_state(path)
+        assert state.record(contact("c", "c")) == "new"
+        assert state.record(contact("b", "B")) == "unchanged"
+        state.close()
+
+        # Another target or --full starts empty.
+        state = open_state(path, target="https://b.supabase.co")
+        assert state.record(contact("b", "B")) == "new"
+        state.close()
+        state = open_state(path)
+        state.reset()
+        assert state.record(contact("b", "B")) == "new"
+        state.close()
+
+        legacy = Path(tmp) / "contacts-state.json"
+        legacy.write_text('{"format": 1, "contacts": {}}', encoding="utf-8")
+        try:
+            open_state(legacy)
+        except RuntimeError as exc:
+            assert "not a sqlite3 contact state" in str(exc), exc
+        else:
+            raise AssertionError("JSON state was opened as sqlite")
+
+    print("contact_state: ok")
+
+
+if __name__ == "__main__":
+    run()
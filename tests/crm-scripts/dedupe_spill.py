@@ -0,0 +1,88 @@
+"""Checks that deduping on disk (scripts/spill_clusters.py) merges contacts
+exactly like the in-memory cluster_contacts path of the CRM import.
+
+Run with: python tests/crm-scripts/dedupe_spill.py
+"""
+import copy
+import random
+import runpy
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+crm = runpy.run_path(str(SCRIPTS / "import-crm-contacts-xlsx.py"), run_name="crm")
+from spill_clusters import SpilledClusters  # noqa: E402
+
+OWNER = "11111111-1111-1111-1111-111111111111"
+
+
+def contact_rows(n, seed=7):
+    """Rows shaped like iter_rows output, with shared phones, NITs and emails
+    chaining people into clusters, some only transitively."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        phone = f"57300{rng.randrange(n // 2):07d}" if rng.random() < 0.7 else ""
+        email = f"p{rng.randrange(n // 2)}@x.co" if rng.random() < 0.5 else ""
+        nit = str(900000 + rng.randrange(n // 4)) if rng.random() < 0.3 else ""
+        key = phone or (f"nit:{nit}" if nit else "") or (f"email:{email}" if email else "") or f"name:person_{i}:co"
+        customer_type = "distributor" if rng.random() < 0.1 else "client"
+        rows.append(
+            {
+                "created_by": OWNER,
+                "contact_key": key,
+                "name": f"Person {i}" if rng.random() < 0.8 else "",
+                "phone": phone or None,
+                "email": email or None,
+                "company": f"Co {i % 11}",
+                "metadata": {"nit": nit or None, "customer_type": customer_type, "row_number": i + 2},
+            }
+        )
+    return rows
+
+
+def test_spilled_merge_matches_in_memory_merge():
+    for link_keys in (crm["LINK_KEYS"], ("phone", "email")):
+        rows = contact_rows(3000)
+        expected = crm["dedupe_contacts"](copy.deepcopy(rows), link_keys)
+        assert len(expected) < len(rows) and any(c["metadata"].get("merged_keys") for c in expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SpilledClusters(lambda r: crm["identity_keys"](r, link_keys), crm["merge_cluster"], tmp, cache_mb=1)
+            try:
+                for row in copy.deepcopy(rows):
+                    store.add(row)
+                store.finish()
+                assert len(store) == len(expected)
+                assert list(store) == expected
+                assert list(store) == expected, "the store iterates more than once"
+            finally:
+                store.close()
+            assert not list(Path(tmp).iterdir()), "close() leaves the spill directory behind"
+
+
+def test_budget_switches_to_disk_without_changing_the_result():
+    rows = contact_rows(1500, seed=11)
+    expected = crm["dedupe_contacts"](copy.deepcopy(rows))
+    # 1 MB holds 512 rows at APPROX_ROW_BYTES, so this run spills.
+    with tempfile.TemporaryDirectory() as tmp:
+        out = crm["dedupe_within_budget"](iter(copy.deepcopy(rows)), memory_mb=1, spill_dir=tmp)
+        try:
+            assert isinstance(out, SpilledClusters)
+            assert list(out) == expected
+        finally:
+            out.close()
+    assert crm["dedupe_within_budget"](copy.deepcopy(rows), memory_mb=64) == expected
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("dedupe_spill: ok")
+
+
+if __name__ == "__main__":
+    run()
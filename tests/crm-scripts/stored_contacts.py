@@ -0,0 +1,267 @@
+"""Checks for how the CRM import maps contacts onto rows already stored.
+
+Runs the importer's parse -> dedupe -> upsert path against an in-memory
+fake of the PostgREST endpoints it calls.
+
+Run with: python tests/crm-scripts/stored_contacts.py
+"""
+import itertools
+import json
+import runpy
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+crm = runpy.run_path(str(SCRIPTS / "import-crm-contacts-xlsx.py"), run_name="crm")
+from supabase_rest import AdaptiveExecutor  # noqa: E402
+
+OWNER = "11111111-1111-1111-1111-111111111111"
+HEADER = (
+    "Contactos Nombre y apellido,Contactos Celular,Contactos Correo,Contactos Empresa (si aplica),Empresas NIT,"
+    "Departamento,Empresas Dirección,Actividad del cliente,Contactos Asignado a"
+)
+_clients = itertools.count()
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.text = "" if body is None else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def parse_in_list(value: str) -> list:
+    """Values of a PostgREST in.("a","b") filter, as quote_in_value writes them."""
+    out, cur, quoted, escaped = [], "", False, False
+    for ch in value[len("in.(") : -1]:
+        if escaped:
+            cur += ch
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            out.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    return out + [cur]
+
+
+class FakeCrm:
+    """agent_crm_contacts and agent_crm_contact_channels behind the calls
+    upsert_contacts makes. Like Postgres, one upsert statement may not touch
+    the same (created_by, contact_key) twice."""
+
+    def __init__(self, stored=()):
+        self.base_url = f"fake://crm-{next(_clients)}"
+        self.stats = {"requests": 0}
+        self.contacts = {}
+        self.channels = {}
+        self.posted_keys = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        for row in stored:
+            self._insert({"created_by": OWNER, "metadata": {}, **row})
+
+    def _insert(self, row):
+        row = {**row, "id": row.get("id") or f"c{next(self._ids)}"}
+        self.contacts[(row["created_by"], row["contact_key"])] = row
+        return row
+
+    def add_observer(self, fn):
+        pass
+
+    def remove_observer(self, fn):
+        pass
+
+    def get(self, path, params=None, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            assert path == "rest/v1/agent_crm_contacts", path
+            keys = set(parse_in_list(params["contact_key"]))
+            owner = params["created_by"][len("eq.") :]
+            rows = [r for (o, k), r in self.contacts.items() if o == owner and k in keys]
+            return FakeResponse(200, [{c: r.get(c) for c in params["select"].split(",")} for r in rows])
+
+    def post(self, path, params=None, json_body=None, headers=None, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            if path == "rest/v1/agent_crm_contact_channels":
+                for ch in json_body:
+                    self.channels[(ch["created_by"], ch["channel"], ch["channel_key"])] = ch
+                return FakeResponse(201)
+            assert path == "rest/v1/agent_crm_contacts", path
+            if json_body[0]["created_by"].startswith("00000000"):
+                return FakeResponse(409, {"code": "23503", "message": "foreign key violation"})
+            keys = [(r["created_by"], r["contact_key"]) for r in json_body]
+            self.posted_keys.append([k for _, k in keys])
+            if len(set(keys)) != len(keys):
+                return FakeResponse(400, {"code": "21000", "message": "ON CONFLICT DO UPDATE command cannot affect row a second time"})
+            out = []
+            for r in json_body:
+                current = self.contacts.get((r["created_by"], r["contact_key"]))
+                row = {**current, **r} if current else self._insert(r)
+                self.contacts[(r["created_by"], r["contact_key"])] = row
+                out.append({"id": row["id"], "contact_key": row["contact_key"]})
+            return FakeResponse(201, out)
+
+    def patch(self, path, params=None, json_body=None, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            row_id = params["id"][len("eq.") :]
+            for row in self.contacts.values():
+                if row["id"] == row_id:
+                    row.update(json_body)
+            return FakeResponse(204)
+
+    def by_key(self, key):
+        return self.contacts.get((OWNER, key))
+
+    def state(self):
+        """End state keyed on contact_key, with row ids replaced by keys."""
+        key_of = {r["id"]: k for (_, k), r in self.contacts.items()}
+        out = {}
+        for (_, key), row in self.contacts.items():
+            meta = dict(row.get("metadata") or {})
+            if "merged_into" in meta:
+                meta["merged_into"] = key_of[meta["merged_into"]]
+            out[key] = {"name": row.get("name"), "phone": row.get("phone"), "email": row.get("email"), "metadata": meta}
+        return out
+
+
+def contacts_from_csv(lines, link_keys=crm["LINK_KEYS"]) -> list:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "clientes.csv"
+        path.write_text("\n".join([HEADER, *lines]) + "\n", encoding="utf-8")
+        return crm["dedupe_contacts"](list(crm["iter_rows"](path, "client", "t", OWNER)), link_keys)
+
+
+def import_into(client, contacts, link_keys=crm["LINK_KEYS"], workers=0):
+    contacts = json.loads(json.dumps(contacts))
+    executor = AdaptiveExecutor(client, workers) if workers else None
+    return crm["upsert_contacts"](client, contacts, executor, link_keys)
+
+
+def test_pre_phone_rows_are_updated_not_duplicated():
+    client = FakeCrm(stored=[{"contact_key": "nit:900"}, {"contact_key": "email:c@x.co"}])
+    contacts = contacts_from_csv(["Ana,3001112233,a@x.co,CoA,900,Antioquia,,,", "Cata,3003334455,c@x.co,CoC,,Antioquia,,,"])
+    assert [c["contact_key"] for c in contacts] == ["573001112233", "573003334455"]
+
+    upserted, _channels, retired = import_into(client, contacts)
+    assert (upserted, retired) == (2, 0)
+    assert sorted(k for _, k in client.contacts) == ["email:c@x.co", "nit:900"]
+    assert client.by_key("nit:900")["phone"] == "573001112233"
+    assert client.by_key("nit:900")["metadata"]["merged_keys"] == ["573001112233"]
+    assert client.by_key("email:c@x.co")["name"] == "Cata"
+
+
+def test_shared_name_key_is_not_claimed_twice():
+    # Three people named Ana Perez at Acme: only the one without a phone is
+    # keyed on the name, so only she may update the stored name: row.
+    client = FakeCrm(stored=[{"contact_key": "name:ana_perez:acme", "name": "Ana Perez"}])
+    lines = ["Ana Perez,3001112233,,Acme,,Bogota,,,", "Ana Perez,,,Acme,,Bogota,,,", "Ana Perez,3009998877,,Acme,,Bogota,,,"]
+    contacts = contacts_from_csv(lines)
+
+    import_into(client, contacts)
+    assert all(len(set(keys)) == len(keys) for keys in client.posted_keys), client.posted_keys
+    assert sorted(k for _, k in client.contacts) == ["573001112233", "573009998877", "name:ana_perez:acme"]
+    assert client.by_key("name:ana_perez:acme")["phone"] is None
+    assert not client.by_key("name:ana_perez:acme")["metadata"].get("archived")
+
+
+def test_shared_nit_outside_link_keys_is_not_claimed():
+    # NIT left out of the link keys: two people of one company keep their own
+    # phone rows and the company-wide nit: row from the old import is left alone.
+    client = FakeCrm(stored=[{"contact_key": "nit:905", "name": "Old"}])
+    link_keys = ("phone", "email")
+    contacts = contacts_from_csv(["Dani,3004445566,d@x.co,CoD,905,Bogota,,,", "Eva,3005556677,e@x.co,CoD,905,Bogota,,,"], link_keys)
+
+    import_into(client, contacts, link_keys, workers=4)
+    assert sorted(k for _, k in client.contacts) == ["573004445566", "573005556677", "nit:905"]
+    assert client.by_key("nit:905")["name"] == "Old"
+
+
+def test_duplicates_are_archived_into_the_kept_row():
+    client = FakeCrm(stored=[{"contact_key": "573002223344"}, {"contact_key": "nit:901"}, {"contact_key": "email:b@x.co"}])
+    contacts = contacts_from_csv(["Beto,3002223344,b@x.co,CoB,901,Antioquia,,,"])
+
+    upserted, _channels, retired = import_into(client, contacts)
+    assert (upserted, retired) == (1, 2)
+    kept = client.by_key("573002223344")
+    assert kept["name"] == "Beto" and not kept["metadata"].get("archived")
+    for key in ("nit:901", "email:b@x.co"):
+        meta = client.by_key(key)["metadata"]
+        assert meta["archived"] is True and meta["merged_into"] == kept["id"], meta
+
+    # A second run finds the same rows and archives nothing new.
+    before = client.state()
+    assert import_into(client, contacts)[2] == 0
+    assert client.state() == before
+
+
+def test_archived_row_is_only_kept_when_nothing_else_matches():
+    archived = {"archived": True, "merged_into": "c9"}
+    client = FakeCrm(stored=[{"contact_key": "nit:902", "metadata": archived}, {"contact_key": "email:f@x.co", "metadata": archived}])
+    contacts = contacts_from_csv(["Fede,3006667788,f@x.co,CoF,902,Antioquia,,,"])
+
+    assert import_into(client, contacts)[2] == 1
+    kept = client.by_key("nit:902")
+    assert kept["name"] == "Fede" and not kept["metadata"].get("archived")
+    assert client.by_key("email:f@x.co")["metadata"]["merged_into"] == kept["id"]
+
+
+def test_conflicting_batch_fails_before_any_write():
+    # Not deduped: both contacts carry the same linked email, so both would
+    # resolve to the stored email: row. Nothing may be written or archived.
+    client = FakeCrm(stored=[{"contact_key": "email:g@x.co"}])
+    rows = [dict(c, metadata=dict(c["metadata"])) for c in contacts_from_csv(["Gina,3007778899,g@x.co,CoG,,Bogota,,,"])]
+    rows.append({**rows[0], "contact_key": "573001110000", "phone": "573001110000", "name": "Gabi"})
+    before = client.state()
+    try:
+        import_into(client, rows)
+    except RuntimeError as exc:
+        assert "email:g@x.co" in str(exc), exc
+    else:
+        raise AssertionError("conflicting batch was written")
+    assert client.posted_keys == [] and client.state() == before
+
+
+def test_parallel_run_matches_serial_run():
+    lines, stored = [], []
+    for i in range(700):
+        phone = f"300{i:07d}" if i % 3 else ""
+        email = f"p{i}@x.co" if i % 4 else ""
+        nit = str(900000 + i // 2) if i % 5 == 0 else ""
+        lines.append(f"Person {i},{phone},{email},Co {i % 7},{nit},Antioquia,,,")
+        if i % 6 == 1:
+            stored.append({"contact_key": f"email:p{i}@x.co"})
+        if i % 10 == 0:
+            stored.append({"contact_key": f"name:person_{i}:co_{i % 7}"})
+        if i % 9 == 1 and phone:
+            stored.append({"contact_key": f"57{phone}"})
+    lines += [f"Person {i} bis,,{f'p{i}@x.co'},Co,,Bogota,,," for i in range(1, 700, 50)]
+    contacts = contacts_from_csv(lines)
+
+    serial, parallel = FakeCrm(stored), FakeCrm(stored)
+    totals = import_into(serial, contacts)
+    assert totals[2] > 0, totals
+    assert import_into(parallel, contacts, workers=4) == totals
+    assert serial.state() == parallel.state()
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("stored_contacts: ok")
+
+
+if __name__ == "__main__":
+    run()
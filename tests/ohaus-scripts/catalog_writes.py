@@ -0,0 +1,193 @@
+"""Checks for catalog writes through agent_catalog_merge_patch (scripts/catalog_sync.py)
+and the schema probes that guard them (scripts/schema_probe.py).
+
+Runs bulk_patch_catalog against an in-memory fake of the RPC and of the
+catalog table.
+
+Run with: python tests/ohaus-scripts/catalog_writes.py
+"""
+import itertools
+import json
+import sys
+import threading
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from catalog_sync import CATALOG_TABLE, MERGE_PATCH_RPC, VERSION_COLUMN, bulk_patch_catalog, merge_patch  # noqa: E402
+from schema_probe import require_columns  # noqa: E402
+from supabase_rest import AdaptiveExecutor  # noqa: E402
+
+_clients = itertools.count()
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None):
+        self.status_code = status_code
+        self.text = "" if body is None else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeCatalog:
+    """agent_product_catalog plus agent_catalog_merge_patch (migrations 032/033).
+
+    Like the RPC, one call is one statement: an item that violates a
+    constraint (here an empty name) fails the whole batch, and items whose
+    version no longer matches are left out of the result. `before_write`
+    runs once, just before the first batch, to stage a concurrent writer.
+    """
+
+    def __init__(self, rows, rpc=True, columns=None):
+        self.base_url = f"fake://catalog-{next(_clients)}"
+        self.stats = {"requests": 0}
+        self.rows = {r["id"]: {VERSION_COLUMN: 0, **r} for r in rows}
+        self.rpc = rpc
+        self.columns = columns
+        self.batches = []
+        self.before_write = None
+        self._lock = threading.Lock()
+
+    def add_observer(self, fn):
+        pass
+
+    def remove_observer(self, fn):
+        pass
+
+    def get(self, path, params=None, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            if params.get("limit") == "0":
+                if self.columns is not None and params["select"] not in self.columns:
+                    return FakeResponse(400, {"code": "42703", "message": "column does not exist"})
+                return FakeResponse(200, [])
+            assert path == CATALOG_TABLE, path
+            ids = params["id"][len("in.(") : -1].split(",")
+            select = params["select"].split(",")
+            return FakeResponse(200, [{c: self.rows[i].get(c) for c in select} for i in ids if i in self.rows])
+
+    def post(self, path, params=None, json_body=None, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            assert path == MERGE_PATCH_RPC, path
+            if not self.rpc:
+                return FakeResponse(404, {"code": "PGRST202", "message": "Could not find the function"})
+            items = json_body["p_items"]
+            if not items:
+                return FakeResponse(200, [])
+            if self.before_write:
+                hook, self.before_write = self.before_write, None
+                hook(self)
+            self.batches.append([item["id"] for item in items])
+            if any("name" in item["patch"] and not item["patch"]["name"] for item in items):
+                return FakeResponse(400, {"code": "23502", "message": 'null value in column "name"'})
+            out = []
+            for item in items:
+                row = self.rows.get(item["id"])
+                if row is None or ("version" in item and item["version"] != row[VERSION_COLUMN]):
+                    continue
+                row.update(merge_patch(row, item["patch"]))
+                row[VERSION_COLUMN] += 1
+                out.append({c: row.get(c) for c in params["select"].split(",")})
+            return FakeResponse(200, out)
+
+    def concurrent_write(self, row_id, **changes):
+        row = self.rows[row_id]
+        row.update(merge_patch(row, changes))
+        row[VERSION_COLUMN] += 1
+
+
+def catalog(n):
+    return [{"id": f"r{i}", "name": f"M{i}", "summary": "", "source_payload": {"family": "F"}} for i in range(n)]
+
+
+def test_bisect_names_only_the_rejected_row():
+    client = FakeCatalog(catalog(8))
+    items = [(dict(r), {"summary": f"s{i}"}) for i, r in enumerate(catalog(8))]
+    items[5] = (items[5][0], {"name": ""})
+    returned = []
+
+    written, failures = bulk_patch_catalog(client, items, batch_size=8, returned=returned)
+    assert written == 7, written
+    assert [(f["id"], f["model"]) for f in failures] == [("r5", "M5")], failures
+    assert failures[0]["error"].startswith("HTTP 400"), failures
+    assert sorted(r["id"] for r in returned) == sorted(f"r{i}" for i in range(8) if i != 5)
+    # Every good row is written exactly once; the bad one never.
+    assert [client.rows[f"r{i}"][VERSION_COLUMN] for i in range(8)] == [1, 1, 1, 1, 1, 0, 1, 1]
+    assert client.batches[0] == [f"r{i}" for i in range(8)] and len(client.batches) < 16, client.batches
+
+
+def test_conflicts_are_replanned_on_the_fresh_row():
+    rows = catalog(6)
+    client = FakeCatalog(rows)
+    items = [(dict(client.rows[r["id"]]), {"source_payload": {"quote_model": r["name"]}}) for r in rows]
+
+    def concurrent_writer(c):
+        c.concurrent_write("r1", source_payload={"prices_cop": {"bogota": 100}})
+        c.concurrent_write("r2", name="Renamed")
+        del c.rows["r3"]
+
+    client.before_write = concurrent_writer
+    seen = []
+
+    def replan(row):
+        seen.append(row["id"])
+        # A row renamed away from its model is dropped, not failed.
+        return None if row["name"] == "Renamed" else {"source_payload": {"quote_model": row["name"]}}
+
+    written, failures = bulk_patch_catalog(client, items, batch_size=2, executor=AdaptiveExecutor(client, 3), replan=replan)
+    assert sorted(seen) == ["r1", "r2"], seen
+    assert written == 4, written
+    assert failures == [{"id": "r3", "model": "M3", "error": "row no longer exists"}], failures
+    # The concurrent write and the re-planned patch both survive.
+    assert client.rows["r1"]["source_payload"] == {"family": "F", "prices_cop": {"bogota": 100}, "quote_model": "M1"}
+    assert "quote_model" not in client.rows["r2"]["source_payload"]
+
+
+def test_conflicts_without_replan_are_failures():
+    client = FakeCatalog(catalog(2))
+    items = [(dict(client.rows[f"r{i}"]), {"summary": "x"}) for i in range(2)]
+    client.before_write = lambda c: c.concurrent_write("r0", summary="theirs")
+
+    written, failures = bulk_patch_catalog(client, items)
+    assert written == 1
+    assert failures == [{"id": "r0", "model": "M0", "error": "row changed concurrently (version conflict)"}], failures
+    assert client.rows["r0"]["summary"] == "theirs"
+
+
+def test_missing_rpc_fails_before_any_write():
+    client = FakeCatalog(catalog(3), rpc=False)
+    try:
+        bulk_patch_catalog(client, [(r, {"summary": "x"}) for r in catalog(3)])
+    except RuntimeError as exc:
+        assert "032_create_catalog_merge_patch_rpc.sql" in str(exc), exc
+    else:
+        raise AssertionError("wrote without the merge RPC")
+    assert client.batches == []
+    # Nothing to write: no probe, no error.
+    assert bulk_patch_catalog(FakeCatalog([], rpc=False), []) == (0, [])
+
+
+def test_missing_column_names_its_migration_once_probed():
+    client = FakeCatalog([], columns={"name", "model_key"})
+    try:
+        require_columns(client, "agent_product_catalog", ("name", "model_key", VERSION_COLUMN))
+    except RuntimeError as exc:
+        assert "agent_product_catalog.row_version (033_add_catalog_row_version.sql)" in str(exc), exc
+    else:
+        raise AssertionError("missing row_version was not reported")
+    probes = client.stats["requests"]
+    require_columns(client, "agent_product_catalog", ("model_key",))
+    assert client.stats["requests"] == probes, "column probes are cached per client"
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("catalog_writes: ok")
+
+
+if __name__ == "__main__":
+    run()
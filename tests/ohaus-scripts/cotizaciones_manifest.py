@@ -0,0 +1,112 @@
+"""Checks for the Cotizaciones manifest shared by the content and assets syncs.
+
+Run with: python tests/ohaus-scripts/cotizaciones_manifest.py
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from file_manifest import FileManifest  # noqa: E402
+from ohaus_sources import build_assets_index, build_folder_index  # noqa: E402
+from quote_workbook import EXTRACT_VERSION, MANIFEST_NAMESPACE  # noqa: E402
+
+
+def open_manifest(tmp: Path, folder: Path, consumer="content"):
+    return FileManifest(tmp / "manifest.json", folder, MANIFEST_NAMESPACE, EXTRACT_VERSION, consumer=consumer)
+
+
+def test_each_consumer_stays_dirty_until_its_own_push():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        folder = tmp / "Cotizaciones"
+        folder.mkdir()
+        xlsx = folder / "101 PX224.xlsx"
+        xlsx.write_bytes(b"v1")
+
+        content = open_manifest(tmp, folder)
+        assert content.lookup(xlsx) is None
+        content.store(xlsx, {"model_key": "PX224"})
+        content.mark_pushed()
+        assets = content.for_consumer("assets")
+        assert not content.is_dirty(xlsx) and assets.is_dirty(xlsx)
+        assets.mark_pushed([xlsx])
+        content.save()
+
+        # Touched but identical: still a hit and still pushed, for both.
+        xlsx.write_bytes(b"v1")
+        content = open_manifest(tmp, folder)
+        assert content.lookup(xlsx) == {"model_key": "PX224"}
+        assert not content.is_dirty(xlsx) and not content.for_consumer("assets").is_dirty(xlsx)
+
+        # Edited: dirty for everyone until each pushes again.
+        xlsx.write_bytes(b"v2")
+        assert content.lookup(xlsx) is None
+        content.store(xlsx, {"model_key": "PX224"})
+        content.mark_pushed()
+        assert not content.is_dirty(xlsx) and content.for_consumer("assets").is_dirty(xlsx)
+
+        # --full re-pushes for this consumer only and keeps the other's markers.
+        content.reset()
+        assert content.lookup(xlsx) is None and content.is_dirty(xlsx)
+        assert content.entries["101 PX224.xlsx"]["pushed"]["content"]
+
+
+def test_prune_only_touches_the_given_file_types():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        folder = tmp / "Cotizaciones"
+        folder.mkdir()
+        kept = folder / "103 SPX222.xlsx"
+        for name in ("101 PX224.xlsx", "102 AX124.pdf", kept.name):
+            (folder / name).write_bytes(name.encode())
+        manifest = open_manifest(tmp, folder)
+        for name in ("101 PX224.xlsx", "102 AX124.pdf", kept.name):
+            manifest.store(folder / name, {"name": name})
+
+        assert manifest.prune([kept], suffixes=(".xlsx",)) == {"101 PX224.xlsx": {"name": "101 PX224.xlsx"}}
+        assert set(manifest.entries) == {"102 AX124.pdf", kept.name}
+        assert manifest.prune([kept]) == {"102 AX124.pdf": {"name": "102 AX124.pdf"}}
+
+
+def test_assets_sync_leaves_removed_quote_files_to_the_content_sync():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        folder = tmp / "Cotizaciones"
+        folder.mkdir()
+        gone_xlsx, gone_pdf = folder / "101 PX224.xlsx", folder / "102 AX124.pdf"
+        for p in (gone_xlsx, gone_pdf, folder / "103 SPX222.pdf"):
+            p.write_bytes(b"%PDF" if p.suffix == ".pdf" else b"xlsx")
+
+        manifest = open_manifest(tmp, folder)
+        manifest.store(gone_xlsx, {"model_key": "PX224", "description": "Balanza"})
+        manifest.store(gone_pdf, {"key": "AX124"})
+        manifest.mark_pushed()
+        manifest.save()
+        gone_xlsx.unlink()
+        gone_pdf.unlink()
+
+        # The assets sync runs first and drops only its own PDF entries.
+        assets = open_manifest(tmp, folder, consumer="assets")
+        index = build_assets_index(folder, assets)
+        assets.save()
+        assert set(index) == {"SPX222"}, index
+        assert set(assets.entries) == {"101 PX224.xlsx", "103 SPX222.pdf"}, assets.entries
+
+        # The content sync still sees the quote file go and re-checks its model.
+        content = open_manifest(tmp, folder)
+        _by_key, total, _parsed, dirty_keys = build_folder_index(folder, content)
+        assert (total, dirty_keys) == (0, {"PX224"}), (total, dirty_keys)
+        assert set(content.entries) == {"103 SPX222.pdf"}
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("cotizaciones_manifest: ok")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,53 @@
+"""Checks that the Cotizaciones content and assets syncs settle on one row.
+
+Run with: python tests/ohaus-scripts/cotizaciones_patches.py
+"""
+import sys
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from catalog_sync import classify_patch, expand_patch, merge_patch  # noqa: E402
+from ohaus_sources import assets_patch, quote_is_clean, quote_patch  # noqa: E402
+
+NOW = "2026-10-18T00:00:00+00:00"
+
+
+def test_content_and_assets_syncs_settle():
+    row = {"id": "1", "name": "PX224", "summary": "", "description": "", "source_payload": {}, "base_price_usd": None}
+    # The two syncs pick different workbooks for the model.
+    incoming = {"model": "PX224", "description": "Balanza analitica", "price_cop": 1000000, "xlsx_file": "205. PX224 final.xlsx"}
+    assets = {"model": "PX-224", "xlsx": Path("204. PX224.xlsx"), "pdf": Path("ficha PX224.pdf"), "image": {"ext": ".png"}}
+
+    def object_url(path):
+        return f"https://storage/{path}"
+
+    for _ in range(2):
+        row = merge_patch(row, quote_patch(row, incoming, 4000.0, NOW))
+        row = merge_patch(row, assets_patch(row, "PX224", assets, object_url))
+
+    payload = row["source_payload"]
+    assert payload["quote_xlsx_file"] == "205. PX224 final.xlsx" and payload["quote_model"] == "PX224", payload
+    assert payload["quote_pdf_file"] == "ficha PX224.pdf"
+    assert quote_is_clean(row, "PX224", incoming, dirty_keys=set())
+    assert classify_patch(row, expand_patch(row, quote_patch(row, incoming, 4000.0, NOW))) == "unchanged"
+    assert classify_patch(row, expand_patch(row, assets_patch(row, "PX224", assets, object_url))) == "unchanged"
+
+
+def test_assets_fill_quote_model_only_when_missing():
+    assets = {"model": "PX-224", "pdf": Path("ficha PX224.pdf")}
+    patch = assets_patch({"name": "PX224", "source_payload": {}}, "PX224", assets, str)
+    assert patch["source_payload"]["quote_model"] == "PX-224"
+    patch = assets_patch({"name": "PX224", "source_payload": {"quote_model": "PX224"}}, "PX224", assets, str)
+    assert "quote_model" not in patch["source_payload"]
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("cotizaciones_patches: ok")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,93 @@
+"""Checks for how the price-list import maps entries onto stored catalog rows.
+
+Run with: python tests/ohaus-scripts/pricelist_import.py
+"""
+import itertools
+import runpy
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+pricelist = runpy.run_path(str(SCRIPTS / "import-ohaus-pricelist-xlsx.py"), run_name="pricelist")
+parse_xlsx = pricelist["parse_xlsx"]
+plan_import = pricelist["plan_import"]
+URL = pricelist["PRODUCT_URL_BASE"]
+_ids = itertools.count(1)
+
+
+def parse(lines):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "lista.csv"
+        path.write_text("\n".join(["Familia;Modelo;Capacidad;Resolucion;Antioquia;Bogota;Distribuidor", *lines]) + "\n", encoding="utf-8")
+        return parse_xlsx(path, "t", "u", "ohaus_colombia", 4000.0)
+
+
+def stored(lines, urls=None):
+    """Catalog rows as an earlier import left them, optionally under other URLs."""
+    rows = parse(lines)
+    for row, url in zip(rows, urls or [r["product_url"] for r in rows]):
+        row.update(id=f"row{next(_ids)}", product_url=url)
+    return {r["product_url"]: r for r in rows}
+
+
+def test_second_entry_does_not_move_the_first():
+    existing = stored(["Explorer;PX224;220 g;0,1 mg;1;1;1"])
+    (kept,) = existing.values()
+    rows = parse(["Explorer;PX224;220 g;0,1 mg;1;1;1", "Explorer;PX224;320 g;1 mg;2;2;2"])
+
+    inserts, updates, deactivate, unchanged = plan_import(rows, dict(existing))
+    assert (updates, deactivate, unchanged) == ([], [], 1), (updates, deactivate, unchanged)
+    assert [r["product_url"] for r in inserts] == [f"{URL}/PX224--explorer-320-g-1-mg"]
+    assert kept["product_url"] == f"{URL}/PX224"
+
+
+def test_legacy_row_number_urls_keep_their_rows():
+    lines = ["Explorer;PX224;220 g;0,1 mg;1;1;1", "Explorer;PX224;320 g;1 mg;2;2;2", "Explorer;PX224;320 g;1 mg;3;3;3"]
+    existing = stored(lines, [f"{URL}/PX224", f"{URL}/PX224-7", f"{URL}/PX224-12"])
+    ids = {url: r["id"] for url, r in existing.items()}
+
+    # Rows moved around the sheet: every entry finds its own row again.
+    rows = parse([lines[2], lines[0], lines[1]])
+    assert plan_import(rows, dict(existing)) == ([], [], [], 3)
+
+    # A price edit on one of two identical variants touches only that row.
+    rows = parse([lines[0], lines[1], "Explorer;PX224;320 g;1 mg;4;4;4"])
+    inserts, updates, deactivate, unchanged = plan_import(rows, dict(existing))
+    assert (inserts, deactivate, unchanged) == ([], [], 2), (inserts, deactivate, unchanged)
+    assert [u["id"] for u in updates] == [ids[f"{URL}/PX224-12"]]
+
+
+def test_edited_entry_falls_back_to_its_url():
+    existing = stored(["Explorer;PX224;220 g;0,1 mg;1;1;1"])
+    rows = parse(["Explorer;PX224;220 g;0,01 mg;1;1;1"])
+
+    inserts, updates, deactivate, _unchanged = plan_import(rows, dict(existing))
+    assert (inserts, deactivate) == ([], [])
+    assert [u["patch"]["source_payload"]["resolution"] for u in updates] == ["0,01 mg"]
+
+
+def test_new_row_never_takes_a_stored_url():
+    # An earlier edit left the 420 g variant under the 320 g URL. It matches
+    # the 420 g entry on content, so the new 320 g entry is numbered on.
+    existing = stored(
+        ["Explorer;PX224;220 g;0,1 mg;1;1;1", "Explorer;PX224;420 g;1 mg;2;2;2"],
+        [f"{URL}/PX224", f"{URL}/PX224--explorer-320-g-1-mg"],
+    )
+    rows = parse(["Explorer;PX224;220 g;0,1 mg;1;1;1", "Explorer;PX224;420 g;1 mg;2;2;2", "Explorer;PX224;320 g;1 mg;3;3;3"])
+
+    inserts, updates, deactivate, unchanged = plan_import(rows, dict(existing))
+    assert [r["product_url"] for r in inserts] == [f"{URL}/PX224--explorer-320-g-1-mg-2"]
+    assert (updates, deactivate, unchanged) == ([], [], 2), (updates, deactivate, unchanged)
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("pricelist_import: ok")
+
+
+if __name__ == "__main__":
+    run()
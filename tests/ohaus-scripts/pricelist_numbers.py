@@ -0,0 +1,52 @@
+"""Regression checks for COP prices read from CSV/TSV price lists.
+
+Run with: python tests/ohaus-scripts/pricelist_numbers.py
+"""
+import runpy
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+pricelist = runpy.run_path(str(SCRIPTS / "import-ohaus-pricelist-xlsx.py"), run_name="pricelist")
+num_es = pricelist["num_es"]
+parse_xlsx = pricelist["parse_xlsx"]
+
+
+def run():
+    cases = {
+        "$ 500.000": 500000.0,
+        "1.234.567": 1234567.0,
+        "1.234.567,50": 1234567.5,
+        "$1.234.567,5": 1234567.5,
+        "2.500.000 COP": 2500000.0,
+        "500,000": 500000.0,
+        "1,234,567": 1234567.0,
+        "12.5": 12.5,
+        "1,5": 1.5,
+        "850000": 850000.0,
+        "": None,
+        "$ 0": None,
+        "N/A": None,
+    }
+    for text, expected in cases.items():
+        assert num_es(text) == expected, f"num_es({text!r}) = {num_es(text)!r}, expected {expected!r}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = Path(tmp) / "lista.csv"
+        csv_path.write_text(
+            "Familia;Modelo;Capacidad;Resolucion;Antioquia;Bogota;Distribuidor\n"
+            'Balanza analitica;PX224;220 g;0,1 mg;$ 12.345.678;"$ 12.500.000,00";9.800.000\n',
+            encoding="cp1252",
+        )
+        (row,) = parse_xlsx(csv_path, "t", "u", "ohaus_colombia", 4000.0)
+        prices = row["source_payload"]["prices_cop"]
+        assert prices == {"antioquia": 12345678.0, "bogota": 12500000.0, "distribuidor": 9800000.0}, prices
+        assert row["base_price_usd"] == 3125.0, row["base_price_usd"]
+
+    print("pricelist_numbers: ok")
+
+
+if __name__ == "__main__":
+    run()
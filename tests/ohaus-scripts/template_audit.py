@@ -0,0 +1,74 @@
+"""Checks for the quote-template sync and audit (ohaus_sources template helpers).
+
+Run with: python tests/ohaus-scripts/template_audit.py
+"""
+import runpy
+import sys
+import tempfile
+from pathlib import Path
+
+import openpyxl
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from ohaus_sources import audit_template, parse_template_rows, template_patch  # noqa: E402
+
+sync = runpy.run_path(str(SCRIPTS / "sync-and-audit-ohaus-template.py"), run_name="sync")
+HEADER = ["modelo", "descripcion_comercial_corta", "descripcion_comercial_larga", "familia", "marca", "imagen_url", "ficha_pdf_url"]
+HEADER += ["precio_bogota_cop", "precio_antioquia_cop", "precio_distribuidor_cop"]
+
+
+def template_from(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "plantilla.xlsx"
+        wb = openpyxl.Workbook()
+        wb.active.append(HEADER)
+        for row in rows:
+            wb.active.append(row)
+        wb.save(path)
+        return parse_template_rows(path)
+
+
+def catalog_row(name, summary, family, prices):
+    return {"id": name, "name": name, "summary": summary, "description": summary, "source_payload": {"family": family, "prices_cop": prices}}
+
+
+def test_audit_keeps_its_own_normalisation():
+    template = template_from(
+        [
+            ["PX224", "N/A", None, "Explorer", None, None, None, "$ 0", 1500000, None],
+            ["AX124", "Balanza", None, "Adventurer", None, None, None, "2.000.000", "n/a", None],
+        ]
+    )
+    # The sync writes "N/A" (only lowercase markers are blank for it) and never a 0 price.
+    assert template_patch({}, template["px224"])["summary"] == "N/A"
+    assert "bogota" not in template_patch({}, template["px224"])["source_payload"]["prices_cop"]
+
+    rows = {
+        "px224": catalog_row("PX224", "Balanza analitica", "Explorer", {"bogota": 900000, "antioquia": 1500000}),
+        "ax124": catalog_row("AX124", "Balanza", "Adventurer", {"bogota": 2000000}),
+    }
+    missing, mismatches = audit_template(template, rows)
+    # "N/A" is blank in any case, so the summary is not checked; 0 is a price to check.
+    assert missing == []
+    assert mismatches == ["PX224: price_bogota expected=0.0 got=900000.0"], mismatches
+
+    missing, mismatches = audit_template(template, {"ax124": rows["ax124"]})
+    assert (missing, mismatches) == (["PX224"], [])
+
+
+def test_replan_drops_rows_renamed_away_from_the_template():
+    template = template_from([["PX224", "Balanza", None, "Explorer"]])
+    assert sync["replan_template"]({"id": "1", "name": "PX-224"}, template)["summary"] == "Balanza"
+    assert sync["replan_template"]({"id": "1", "name": "Otro"}, template) is None
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("template_audit: ok")
+
+
+if __name__ == "__main__":
+    run()
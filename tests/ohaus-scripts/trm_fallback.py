@@ -0,0 +1,69 @@
+"""Checks for how the OHAUS syncs pick the USD/COP rate (scripts/fx_rates.py).
+
+Run with: python tests/ohaus-scripts/trm_fallback.py
+"""
+import json
+import sys
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from fx_rates import DEFAULT_TRM, resolve_trm  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeFx:
+    """agent_fx_rates holding `rows`, newest first."""
+
+    def __init__(self, name, rows):
+        self.base_url = f"fake://fx-{name}"
+        self.rows = rows
+        self.requests = 0
+
+    def get(self, path, params=None, **kwargs):
+        self.requests += 1
+        return FakeResponse(self.rows[: int(params["limit"])])
+
+
+def test_latest_rate_is_used_and_cached():
+    client = FakeFx("latest", [{"rate": 3950.5, "rate_date": "2026-10-17", "source": "banrep"}])
+    assert resolve_trm(client, "owner") == 3950.5
+    assert resolve_trm(client, "owner") == 3950.5
+    assert client.requests == 1
+
+
+def test_explicit_rate_wins():
+    client = FakeFx("explicit", [])
+    assert resolve_trm(client, "owner", "4100") == 4100.0
+    assert client.requests == 0
+
+
+def test_missing_rate_falls_back_unless_refused():
+    for rows in ([], [{"rate": 1.0, "rate_date": "2026-10-17"}]):
+        client = FakeFx(f"missing-{len(rows)}", rows)
+        assert resolve_trm(client, "owner") == DEFAULT_TRM
+        try:
+            resolve_trm(client, "owner", fallback=None)
+        except RuntimeError as exc:
+            assert "pass --trm" in str(exc), exc
+        else:
+            raise AssertionError("fallback=None resolved a rate")
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("trm_fallback: ok")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,67 @@
+"""Checks for the product photo picked from a quote workbook (scripts/xlsx_images.py).
+
+Run with: python tests/ohaus-scripts/workbook_images.py
+"""
+import sys
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+import openpyxl
+from openpyxl.drawing.image import Image as XlImage
+from PIL import Image
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from xlsx_images import pick_product_image  # noqa: E402
+
+
+def picture(size, fmt="PNG", color="white"):
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format=fmt)
+    buf.seek(0)
+    return buf
+
+
+def workbook(path: Path, pictures):
+    wb = openpyxl.Workbook()
+    wb.active["A1"] = "Cotizacion"
+    for anchor, buf in pictures:
+        wb.active.add_image(XlImage(buf), anchor)
+    wb.save(path)
+    return path
+
+
+def test_product_photo_beats_banner_and_logo():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = workbook(
+            Path(tmp) / "101. PX224.xlsx",
+            [
+                ("A1", picture((1400, 180), color="navy")),  # letterhead banner
+                ("H3", picture((40, 40), color="red")),  # logo
+                ("B6", picture((320, 300), "JPEG", color="gray")),  # product photo
+            ],
+        )
+        picked = pick_product_image(path)
+        assert picked["ext"] == ".jpg" and picked["format"] == "jpeg", picked
+        with Image.open(BytesIO(picked["bytes"])) as img:
+            assert (img.format, img.size) == ("JPEG", (320, 300))
+
+        header_only = pick_product_image(path, with_bytes=False)
+        assert "bytes" not in header_only and header_only["media"] == picked["media"]
+
+
+def test_workbook_without_pictures_has_no_image():
+    with tempfile.TemporaryDirectory() as tmp:
+        assert pick_product_image(workbook(Path(tmp) / "102. AX124.xlsx", [])) is None
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("workbook_images: ok")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,127 @@
+"""Checks for the AIMD write executor (supabase_rest.AdaptiveExecutor).
+
+Run with: python tests/ohaus-scripts/write_executor.py
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+from supabase_rest import AdaptiveExecutor  # noqa: E402
+
+
+class FakeClient:
+    """Counts requests and tells observers about each response, like SupabaseRest."""
+
+    def __init__(self):
+        self.stats = {"requests": 0}
+        self.observers = []
+        self.inflight = 0
+        self.max_inflight = 0
+        self._lock = threading.Lock()
+
+    def add_observer(self, fn):
+        self.observers.append(fn)
+
+    def remove_observer(self, fn):
+        self.observers.remove(fn)
+
+    def respond(self, status=200, elapsed=0.01):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.inflight += 1
+            self.max_inflight = max(self.max_inflight, self.inflight)
+        time.sleep(elapsed)
+        with self._lock:
+            self.inflight -= 1
+        for fn in list(self.observers):
+            fn(status, elapsed, status in (429, 503))
+        return status
+
+
+def test_results_keep_task_order_within_the_worker_limit():
+    client = FakeClient()
+    executor = AdaptiveExecutor(client, workers=4)
+    tasks = [lambda i=i: client.respond(elapsed=0.002 * (i % 5)) and i for i in range(40)]
+
+    assert executor.run(tasks) == list(range(40))
+    assert 1 < client.max_inflight <= 4, client.max_inflight
+    assert executor.last_run["tasks"] == 40 and executor.last_run["requests"] == 40
+    assert client.observers == []
+
+
+def test_lazy_tasks_are_pulled_as_slots_free_up():
+    client = FakeClient()
+    pulled = []
+
+    def tasks():
+        for i in range(20):
+            pulled.append(i)
+            # Never more than the in-flight limit ahead of the finished tasks.
+            assert len(pulled) - client.stats["requests"] <= 2 + 1, (len(pulled), client.stats)
+            yield lambda: client.respond(elapsed=0.005)
+
+    AdaptiveExecutor(client, workers=2).run(tasks())
+    assert pulled == list(range(20))
+
+
+def test_throttling_halves_the_limit_and_healthy_responses_add_back():
+    executor = AdaptiveExecutor(FakeClient(), workers=8, target_latency_sec=1.0, increase_after=2)
+    executor._on_response(429, 0.1, True)
+    assert executor.limit == 4
+    executor._on_response(503, 0.1, True)
+    assert executor.limit == 2
+    executor._on_response(200, 0.1, False)
+    executor._on_response(200, 5.0, False)  # slow: resets the healthy streak
+    executor._on_response(200, 0.1, False)
+    assert executor.limit == 2
+    executor._on_response(200, 0.1, False)
+    assert executor.limit == 3
+    for _ in range(20):
+        executor._on_response(200, 0.1, False)
+    assert executor.limit == 8
+
+
+def test_throttled_run_completes_with_a_lower_limit():
+    client = FakeClient()
+    executor = AdaptiveExecutor(client, workers=8, increase_after=1000)
+    statuses = [429] * 3 + [200] * 20
+    results = executor.run([lambda s=s: client.respond(s) for s in statuses])
+    assert results == statuses
+    assert executor.last_run["throttled"] == 3 and executor.last_run["final_limit"] == 1, executor.last_run
+
+
+def test_first_error_is_raised_after_in_flight_work_drains():
+    client = FakeClient()
+    done = []
+
+    def fail():
+        client.respond()
+        raise ValueError("batch rejected")
+
+    def ok(i):
+        client.respond(elapsed=0.02)
+        done.append(i)
+
+    tasks = [lambda: ok(0), fail] + [lambda i=i: ok(i) for i in range(1, 50)]
+    try:
+        AdaptiveExecutor(client, workers=3).run(tasks)
+    except ValueError as exc:
+        assert str(exc) == "batch rejected"
+    else:
+        raise AssertionError("task error was swallowed")
+    assert client.inflight == 0 and 0 in done
+    assert len(done) < 49, "tasks kept being submitted after the error"
+
+
+def run():
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+    print("write_executor: ok")
+
+
+if __name__ == "__main__":
+    run()